@@ -0,0 +1,189 @@
+'''
+  File: asyncstore.py
+  Description: This module provides the AsyncNodeStore class, a node store
+    for BTrees used from asyncio code. It wraps another node store, such as
+    a FileNodeStore or a BufferPool in front of one, and adds the coroutine
+    aread, which reads a node on a pool of reader threads so the event
+    loop is never blocked by a page read. BTree.aretrieve and BTree.arange
+    read their nodes with aread, for instance
+
+        store = AsyncNodeStore(nodestore.FileNodeStore("Feed.pages"))
+        feedIndex = BTree(3, store = store)
+        item = await feedIndex.aretrieve(Item(2285, None))
+        async for item in feedIndex.arange(Item(2000, None), None):
+            ...
+
+    When several coroutines miss on the same node at the same time, the
+    node is read once and all of them get the node of that read.
+
+    The wrapped store is not safe for threads, so its calls are made one
+    at a time under a lock. The nodes answered by aread are shared by the
+    coroutines which asked for them and must not be changed.
+
+    The ReaderThreads class is a small pool of threads running functions
+    for coroutines. The executors of concurrent.futures are not used, since
+    they import the standard queue module, which is hidden by queue.py in
+    this directory.
+'''
+
+import asyncio
+import collections
+import threading
+
+READER_THREADS = 4
+
+
+class ReaderThreads:
+    def __init__(self, threads = READER_THREADS):
+        ''' Start threads daemon threads waiting for work. '''
+        if threads < 1:
+            raise ValueError("A reader pool needs at least 1 thread")
+        self.work = collections.deque()
+        self.ready = threading.Condition()
+        self.closed = False
+        self.threads = []
+        for i in range(threads):
+            thread = threading.Thread(target = self.serve, daemon = True)
+            thread.start()
+            self.threads.append(thread)
+
+    def serve(self):
+        while True:
+            with self.ready:
+                while len(self.work) == 0 and not self.closed:
+                    self.ready.wait()
+                if len(self.work) == 0:
+                    return
+                function, args, loop, future = self.work.popleft()
+            try:
+                result = function(*args)
+            except BaseException as error:
+                loop.call_soon_threadsafe(setException, future, error)
+            else:
+                loop.call_soon_threadsafe(setResult, future, result)
+
+    async def run(self, function, *args):
+        ''' Answer function(*args), called on one of the threads. '''
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self.ready:
+            if self.closed:
+                raise RuntimeError("The reader threads are closed")
+            self.work.append((function, args, loop, future))
+            self.ready.notify()
+        return await future
+
+    def close(self):
+        # Let the threads finish the work already given and stop
+        with self.ready:
+            self.closed = True
+            self.ready.notify_all()
+        for thread in self.threads:
+            thread.join()
+
+
+def setResult(future, result):
+    # The waiting coroutine may have been cancelled
+    if not future.done():
+        future.set_result(result)
+
+
+def setException(future, error):
+    if not future.done():
+        future.set_exception(error)
+
+
+class AsyncNodeStore:
+    def __init__(self, store, threads = READER_THREADS):
+        ''' Wrap the node store store, reading nodes for aread on threads
+          reader threads.
+        '''
+        self.store = store
+        self.rootIndex = store.rootIndex
+        self.freeIndex = store.freeIndex
+        # Nodes of a sized store are measured by the store
+        self.sized = getattr(store, "sized", False)
+        if hasattr(store, "pageSize"):
+            self.pageSize = store.pageSize
+        self.lock = threading.Lock()
+        self.readers = ReaderThreads(threads)
+        # The reads in progress by node index
+        self.reading = {}
+        self.reads = 0
+        self.coalesced = 0
+
+    async def aread(self, index):
+        ''' Answer the node with the given index, read on a reader thread.
+          A read of the same node already in progress is shared.
+        '''
+        future = self.reading.get(index)
+        if future == None:
+            future = asyncio.ensure_future(self.readers.run(self.read, index))
+            self.reading[index] = future
+            future.add_done_callback(lambda done: self.reading.pop(index, \
+                None))
+            self.reads += 1
+        else:
+            self.coalesced += 1
+        # Cancelling one waiter must not cancel the read for the others
+        return await asyncio.shield(future)
+
+    def bind(self, nodeClass, itemClass):
+        self.store.bind(nodeClass, itemClass)
+
+    def nodeSize(self, aNode):
+        return self.store.nodeSize(aNode)
+
+    def read(self, index):
+        with self.lock:
+            return self.store.read(index)
+
+    def write(self, index, aNode):
+        with self.lock:
+            self.store.write(index, aNode)
+
+    def pin(self, index):
+        with self.lock:
+            self.store.pin(index)
+
+    def unpin(self, index):
+        with self.lock:
+            self.store.unpin(index)
+
+    def recycle(self, index):
+        with self.lock:
+            self.store.recycle(index)
+
+    def reuse(self):
+        with self.lock:
+            return self.store.reuse()
+
+    def freeIndices(self):
+        with self.lock:
+            return self.store.freeIndices()
+
+    def setHeader(self, rootIndex, freeIndex):
+        self.rootIndex = rootIndex
+        self.freeIndex = freeIndex
+        with self.lock:
+            self.store.setHeader(rootIndex, freeIndex)
+
+    def commit(self):
+        with self.lock:
+            self.store.commit()
+
+    def flush(self):
+        with self.lock:
+            self.store.flush()
+
+    def close(self):
+        self.readers.close()
+        with self.lock:
+            self.store.close()
+
+    def statistics(self):
+        ''' Answer a dictionary with the number of nodes read for aread
+          and the number of aread calls which shared a read in progress.
+        '''
+        return {'reads': self.reads, 'coalesced': self.coalesced, \
+            'threads': len(self.readers.threads)}
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import time
+
+import asyncstore
+import nodestore
+from joinquerybtree import BTree, Item
+
+class SlowNodeStore(nodestore.MemoryNodeStore):
+    '''
+      A memory node store whose reads take delay seconds and which
+      records the threads reading its nodes.
+    '''
+    def __init__(self):
+        nodestore.MemoryNodeStore.__init__(self)
+        self.delay = 0
+        self.failing = False
+        self.threads = set()
+
+    def read(self, index):
+        self.threads.add(threading.current_thread())
+        if self.failing:
+            raise ValueError("The page of node " + str(index) + \
+                " cannot be read")
+        time.sleep(self.delay)
+        return nodestore.MemoryNodeStore.read(self, index)
+
+def main():
+    slowStore = SlowNodeStore()
+    store = asyncstore.AsyncNodeStore(slowStore, 4)
+    aTree = BTree(3, store = store)
+    for key in range(0, 3000, 3):
+        aTree.insert(Item(key, 2 * key))
+    try:
+        asyncio.run(tests(aTree, slowStore, store))
+    finally:
+        store.close()
+
+async def tests(aTree, slowStore, store):
+    # aretrieve and arange answer what retrieve and range do
+    keys = [0, 3, 4, 1500, 2999, 2997, 5000]
+    found = [await aTree.aretrieve(Item(key, None)) for key in keys]
+    expected = [aTree.retrieve(Item(key, None)) for key in keys]
+    items = [item async for item in aTree.arange(Item(300, None), \
+        Item(900, None), (True, False))]
+    if [repr(item) for item in found] == [repr(item) for item in \
+        expected] and found[2] == None and \
+        [item.getKey() for item in items] == list(range(300, 900, 3)):
+        print("Test 1 Passed")
+    else:
+        print("Test 1 Failed with", found, expected)
+
+    # Nodes are read on the reader threads, so the event loop keeps
+    # running while the pages are read
+    slowStore.delay = 0.002
+    slowStore.threads = set()
+    ticks = 0
+
+    async def ticker():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.001)
+            ticks += 1
+
+    tickerTask = asyncio.ensure_future(ticker())
+    found = await asyncio.gather(*[aTree.aretrieve(Item(key, None)) for \
+        key in range(0, 600, 2)])
+    tickerTask.cancel()
+    if ticks > 0 and threading.current_thread() not in \
+        slowStore.threads and all((item != None) == (key % 3 == 0) for \
+        key, item in zip(range(0, 600, 2), found)):
+        print("Test 2 Passed")
+    else:
+        print("Test 2 Failed with", ticks, "ticks")
+
+    # Lookups missing on the same nodes at the same time share one read,
+    # and cancelling one of them does not cancel the read for the others
+    before = store.statistics()
+    lookups = [asyncio.ensure_future(aTree.aretrieve(Item(1500, None))) \
+        for i in range(20)]
+    await asyncio.sleep(0)
+    lookups[0].cancel()
+    found = await asyncio.gather(*lookups[1:])
+    statistics = store.statistics()
+    if statistics["coalesced"] - before["coalesced"] >= 19 and \
+        statistics["reads"] - before["reads"] < 20 and \
+        all(item.getValue() == 3000 for item in found):
+        print("Test 3 Passed")
+    else:
+        print("Test 3 Failed with", statistics)
+
+    # An error reading a node is raised in the coroutine that asked for it
+    slowStore.failing = True
+    try:
+        await aTree.aretrieve(Item(3, None))
+        print("Test 4 Failed")
+    except ValueError:
+        print("Test 4 Passed")
+    slowStore.failing = False
+
+if __name__ == "__main__":
+    main()
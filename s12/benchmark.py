@@ -0,0 +1,271 @@
+'''
+  File: benchmark.py
+  Description: This module benchmarks the strategies for the Feed query on
+    synthetic tables. The generateTables function writes Feed.tbl,
+    FeedAttribType.tbl and FeedAttribute.tbl with the columns of feedCols,
+    attribTypeCols and feedAttributeCols. Every feed gets one attribute of
+    each type, as in the tables of this directory.
+
+    Each strategy is run in its own process, so its peak resident set size
+    is measured on its own. A run reports the number of rows, the time
+    to build indexes, the time of the join, rows per second, the peak RSS
+    of the process and the largest peak RSS of the processes it started,
+    such as the workers of the parallel strategy. The memory the parallel
+    strategy needs is then up to its peak RSS plus the number of workers
+    times the peak RSS of a worker. The results are written as JSON. A
+    run can be compared with earlier results, and slowdowns beyond a
+    tolerance are reported as regressions.
+
+    By default the tables have the sizes of SIZES. The --large flag adds
+    the sizes of LARGE_SIZES, up to 10^7 FeedAttribute rows. The largest
+    tables take hundreds of megabytes of disk and minutes per strategy.
+
+    Strategies are registered in STRATEGIES. A strategy is a function
+    which answers a tuple of the seconds spent building indexes and an
+    iterable of the result rows. It is run in the directory holding the
+    tables.
+
+    Usage:
+        python benchmark.py --sizes 1000 10000 100000 --output results.json
+        python benchmark.py --large --output large.json
+        python benchmark.py --compare results.json
+'''
+
+import argparse
+import datetime
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import schema
+
+attribTypeCols = ["int","char20","char60","int","int","int","int"]
+feedCols = ["int","int","int","char50","datetime","float","float","int","char50","int"]
+feedAttributeCols = ["int","int","float"]
+
+ATTRIB_TYPES = 57
+# The naive join is O(n*m), so it is skipped on larger tables
+NAIVE_LIMIT = 10000
+# The FeedAttribute row counts run by default and added by --large
+SIZES = [1000, 10000, 100000]
+LARGE_SIZES = [1000000, 10000000]
+
+
+def writeTable(fileName, colTypes, rows):
+    # Write rows as fixed-width records in large blocks
+    encode = schema.compileSchema(colTypes).encode
+    with open(fileName, "w", buffering = 1 << 20) as table:
+        for row in rows:
+            table.write(encode(row))
+            table.write("\n")
+
+
+def generateTables(directory, attributeRows, attribTypes = ATTRIB_TYPES, \
+    seed = 1):
+    ''' Write synthetic Feed, FeedAttribType and FeedAttribute tables to
+      directory. FeedAttribute gets about attributeRows rows, one per feed
+      and attribute type, ordered by FeedID. Answer the number of
+      FeedAttribute rows written.
+    '''
+    rand = random.Random(seed)
+    feeds = max(1, (attributeRows + attribTypes - 1) // attribTypes)
+    # FeedIDs are ascending but not consecutive, as in Feed.tbl
+    feedIDs = [1000 + 2*i + rand.randrange(2) for i in range(feeds)]
+    start = datetime.datetime(1990, 1, 1)
+
+    writeTable(os.path.join(directory, "FeedAttribType.tbl"), \
+        attribTypeCols, ((i, "T" + str(i), "Attribute type " + str(i), \
+        i, i, i, 0) for i in range(attribTypes)))
+
+    writeTable(os.path.join(directory, "Feed.tbl"), feedCols, \
+        ((feedIDs[i], 0, i+1, "MasterFeed" + str(i+1), \
+        start + datetime.timedelta(days = rand.randrange(10000)), \
+        rand.random(), rand.random(), rand.randrange(20), \
+        "Synthetic feed " + str(i+1), None) for i in range(feeds)))
+
+    count = min(attributeRows, feeds * attribTypes)
+    writeTable(os.path.join(directory, "FeedAttribute.tbl"), \
+        feedAttributeCols, ((feedIDs[i // attribTypes], i % attribTypes, \
+        round(rand.random() * 100, 3)) for i in range(count)))
+    return count
+
+
+def naiveJoin():
+    import joinquery
+    return 0.0, joinquery.joinedRows()
+
+
+def btreeJoin():
+    import joinquerybtree
+    for indexName in ("Feed.idx", "FeedAttribType.idx"):
+        if os.path.isfile(indexName):
+            os.remove(indexName)
+    before = time.perf_counter()
+    feedIndex = joinquerybtree.openIndex("Feed.idx", "Feed.tbl", \
+        feedCols)[1]
+    attribTypeIndex = joinquerybtree.openIndex("FeedAttribType.idx", \
+        "FeedAttribType.tbl", attribTypeCols)[1]
+    buildSeconds = time.perf_counter() - before
+    return buildSeconds, joinquerybtree.indexJoinRows(feedIndex, \
+        attribTypeIndex)
+
+
+def parallelJoin():
+    import paralleljoin
+    before = time.perf_counter()
+    btreeJoin()
+    buildSeconds = time.perf_counter() - before
+    return buildSeconds, paralleljoin.parallelJoinRows()
+
+
+def engineJoin(strategy):
+    import joinengine
+    return 0.0, joinengine.feedQuery(strategy = strategy)
+
+
+STRATEGIES = {
+    "naive": naiveJoin,
+    "btree": btreeJoin,
+    "parallel": parallelJoin,
+    "hash": lambda: engineJoin("hash"),
+    "sortmerge": lambda: engineJoin("sort merge"),
+}
+
+
+def peakRSS(who = resource.RUSAGE_SELF):
+    ''' Answer the peak resident set size of this process in kilobytes, or
+      with RUSAGE_CHILDREN the largest one of its finished child
+      processes.
+    '''
+    peak = resource.getrusage(who).ru_maxrss
+    if sys.platform == "darwin":
+        peak = peak // 1024
+    return peak
+
+
+def runStrategy(name):
+    ''' Run the strategy name in the current directory and answer a
+      dictionary with its measurements. The result rows are counted but
+      not written anywhere.
+    '''
+    buildSeconds, rows = STRATEGIES[name]()
+    before = time.perf_counter()
+    count = 0
+    for row in rows:
+        count += 1
+    joinSeconds = time.perf_counter() - before
+    return {
+        "strategy": name,
+        "resultRows": count,
+        "indexBuildSeconds": buildSeconds,
+        "joinSeconds": joinSeconds,
+        "rowsPerSecond": count / joinSeconds if joinSeconds > 0 else None,
+        "peakRssKB": peakRSS(),
+        "peakWorkerRssKB": peakRSS(resource.RUSAGE_CHILDREN),
+    }
+
+
+def runInProcess(name, directory):
+    # Run a strategy in a child process and answer its measurements
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), \
+        "--child", name], cwd = directory, check = True, \
+        stdout = subprocess.PIPE).stdout
+    return json.loads(output)
+
+
+def runBenchmarks(sizes, strategies, naiveLimit = NAIVE_LIMIT, \
+    directory = None):
+    ''' Generate tables of each size and run each strategy on them.
+      Answer a list of result dictionaries.
+    '''
+    results = []
+    for size in sizes:
+        tableDir = directory or tempfile.mkdtemp(prefix = "s12bench")
+        try:
+            rows = generateTables(tableDir, size)
+            for name in strategies:
+                if name == "naive" and rows > naiveLimit:
+                    continue
+                result = runInProcess(name, tableDir)
+                result["attributeRows"] = rows
+                results.append(result)
+                print(json.dumps(result), file = sys.stderr)
+        finally:
+            if directory == None:
+                shutil.rmtree(tableDir)
+    return results
+
+
+def findRegressions(results, baseline, tolerance):
+    ''' Answer the results whose rows per second dropped by more than the
+      fraction tolerance compared to the matching run of baseline.
+    '''
+    earlier = {}
+    for result in baseline:
+        earlier[(result["strategy"], result["attributeRows"])] = result
+    regressions = []
+    for result in results:
+        old = earlier.get((result["strategy"], result["attributeRows"]))
+        if old == None or not old["rowsPerSecond"] or \
+            not result["rowsPerSecond"]:
+            continue
+        if result["rowsPerSecond"] < old["rowsPerSecond"] * (1 - tolerance):
+            regressions.append({"strategy": result["strategy"], \
+                "attributeRows": result["attributeRows"], \
+                "rowsPerSecond": result["rowsPerSecond"], \
+                "baselineRowsPerSecond": old["rowsPerSecond"]})
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description = \
+        "Benchmark the Feed query strategies on synthetic tables.")
+    parser.add_argument("--sizes", type = int, nargs = "+", \
+        default = SIZES, help = "FeedAttribute row counts to generate")
+    parser.add_argument("--large", action = "store_true", \
+        help = "also run the sizes " + \
+        ", ".join(str(size) for size in LARGE_SIZES))
+    parser.add_argument("--strategies", nargs = "+", \
+        default = list(STRATEGIES), choices = list(STRATEGIES))
+    parser.add_argument("--naive-limit", type = int, default = NAIVE_LIMIT, \
+        help = "the largest table the naive join is run on")
+    parser.add_argument("--output", help = "write the results to this file")
+    parser.add_argument("--compare", \
+        help = "report regressions against results in this file")
+    parser.add_argument("--tolerance", type = float, default = 0.2, \
+        help = "the fraction of rows per second a run may lose")
+    parser.add_argument("--child", help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(runStrategy(args.child)))
+        return
+
+    sizes = args.sizes
+    if args.large:
+        sizes = sizes + [size for size in LARGE_SIZES if size not in sizes]
+    results = runBenchmarks(sizes, args.strategies, args.naive_limit)
+    report = json.dumps(results, indent = 2)
+    if args.output:
+        with open(args.output, "w") as outputFile:
+            outputFile.write(report + "\n")
+    else:
+        print(report)
+
+    if args.compare:
+        with open(args.compare) as baselineFile:
+            regressions = findRegressions(results, json.load(baselineFile), \
+                args.tolerance)
+        for regression in regressions:
+            print("Regression:", json.dumps(regression), file = sys.stderr)
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+'''
+  File: bloomfilter.py
+  Description: This module provides the BloomFilter class, a set of keys
+    which may answer that a key is present when it is not, but never that
+    a key is absent when it is present. A BTree with a Bloom filter
+    rejects most keys it does not hold without reading a node, which on a
+    disk-backed index saves the page reads of a search ending in a leaf.
+
+    A filter for n keys with a false positive rate p has
+    m = -n ln p / (ln 2)**2 bits and sets k = m/n ln 2 of them for each
+    key, so about 9.6 bits per key for a rate of 1%. The k bit positions
+    of a key are h1 + i*h2 modulo m for i from 0 to k-1, where h1 and h2
+    are two 64 bit halves of a BLAKE2b hash of the key, so the positions
+    are the same in every process. Keys are hashed by their repr, with
+    floats which are whole numbers hashed as ints, as 1035.0 == 1035.
+
+    Keys cannot be removed, so a filter still answers that deleted keys
+    may be present. It only gets less selective until it is rebuilt. A
+    filter holding more keys than its capacity is full, and its false
+    positive rate grows beyond the rate it was sized for.
+
+    A filter is kept in a file next to the index file, named after it with
+    .bloom added. The file has a header of a magic number, a format
+    version, the number of hash functions, the number of keys added, the
+    number of bits, the capacity and the false positive rate, followed by
+    the bits. Files of version 1, whose header ends with the number of
+    bits, are still read. Their filters are taken to be sized for the keys
+    they hold.
+'''
+
+import hashlib
+import math
+import os
+import struct
+
+MAGIC = b"BTBF"
+VERSION = 2
+HEADER = struct.Struct("<4sHIIQQd")
+HEADER_V1 = struct.Struct("<4sHIIQ")
+FALSE_POSITIVE_RATE = 0.01
+MIN_BITS = 64
+
+
+def canonical(key):
+    # Answer key with equal numbers written alike
+    if type(key) == float and key.is_integer():
+        return int(key)
+    if type(key) == tuple:
+        return tuple([canonical(part) for part in key])
+    return key
+
+
+class BloomFilter:
+    def __init__(self, capacity, falsePositiveRate = FALSE_POSITIVE_RATE, \
+        bits = None, hashes = None, data = None):
+        ''' Create an empty filter sized for capacity keys at the given
+          false positive rate. A filter read from a file is given its
+          bits, hashes and data instead.
+        '''
+        if not (0 < falsePositiveRate < 1):
+            raise ValueError("The false positive rate must be between " + \
+                "0 and 1")
+        if bits == None:
+            n = max(capacity, 1)
+            bits = max(MIN_BITS, math.ceil(-n * math.log(falsePositiveRate) \
+                / math.log(2)**2))
+            hashes = max(1, round(bits / n * math.log(2)))
+        self.bits = bits
+        self.hashes = hashes
+        self.capacity = capacity
+        self.falsePositiveRate = falsePositiveRate
+        if data == None:
+            data = bytearray((bits + 7) // 8)
+        self.data = bytearray(data)
+        self.count = 0
+        self.checks = 0
+        self.rejections = 0
+
+    def __repr__(self):
+        return "BloomFilter(bits=" + str(self.bits) + ",hashes=" + \
+            str(self.hashes) + ",count=" + str(self.count) + ")"
+
+    def positions(self, key):
+        digest = hashlib.blake2b(repr(canonical(key)).encode(), \
+            digest_size = 16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i*h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self.positions(key):
+            self.data[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def mayContain(self, key):
+        ''' Answer False if key was never added, and True if it may have
+          been.
+        '''
+        self.checks += 1
+        data = self.data
+        for position in self.positions(key):
+            if not data[position >> 3] & (1 << (position & 7)):
+                self.rejections += 1
+                return False
+        return True
+
+    def __contains__(self, key):
+        return self.mayContain(key)
+
+    def isFull(self):
+        # Answer True if more keys were added than the filter is sized for
+        return self.count > self.capacity
+
+    def expectedFalsePositiveRate(self):
+        # Answer the false positive rate for the keys added so far
+        return (1 - math.exp(-self.hashes * self.count / self.bits)) ** \
+            self.hashes
+
+    def statistics(self):
+        ''' Answer a dictionary with the size of the filter, the number of
+          keys checked and the number of keys it rejected.
+        '''
+        return {'bits': self.bits, 'hashes': self.hashes, 'keys': self.count, \
+            'checks': self.checks, 'rejections': self.rejections, \
+            'falsePositiveRate': self.expectedFalsePositiveRate()}
+
+
+def bloomName(indexName):
+    # Answer the name of the Bloom filter file of the index file indexName
+    return indexName + ".bloom"
+
+
+def writeBloomFilter(fileName, bloom):
+    ''' Write bloom to fileName. The file is written under a temporary
+      name and then renamed, as index files are.
+    '''
+    tempName = fileName + ".tmp"
+    with open(tempName, "wb") as bloomFile:
+        bloomFile.write(HEADER.pack(MAGIC, VERSION, bloom.hashes, \
+            bloom.count, bloom.bits, bloom.capacity, \
+            bloom.falsePositiveRate))
+        bloomFile.write(bloom.data)
+    os.replace(tempName, fileName)
+
+
+def readBloomFilter(fileName):
+    # Answer the BloomFilter in fileName, or None if there is no file
+    if not os.path.isfile(fileName):
+        return None
+    with open(fileName, "rb") as bloomFile:
+        data = bloomFile.read()
+    if len(data) < HEADER_V1.size:
+        raise ValueError(fileName + " is not a Bloom filter file")
+    magic, version, hashes, count, bits = HEADER_V1.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise ValueError(fileName + " is not a Bloom filter file")
+    if version == 1:
+        size = HEADER_V1.size
+        capacity = count
+        # The rate of a filter sized for count keys
+        falsePositiveRate = min(0.5, math.exp(-bits * math.log(2)**2 / \
+            max(count, 1)))
+    elif version == VERSION:
+        size = HEADER.size
+        capacity, falsePositiveRate = HEADER.unpack_from(data, 0)[5:]
+    else:
+        raise ValueError("Unsupported Bloom filter version " + str(version))
+    if len(data) - size != (bits + 7) // 8:
+        raise ValueError(fileName + " is truncated")
+    bloom = BloomFilter(capacity, falsePositiveRate, bits, hashes, \
+        data[size:])
+    bloom.count = count
+    return bloom
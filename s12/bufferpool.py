@@ -0,0 +1,170 @@
+'''
+  File: bufferpool.py
+  Description: This module provides the BufferPool class. A buffer pool sits
+    between a BTree and its node store and keeps a bounded number of nodes
+    in memory. It can be used wherever a node store is expected, for
+    instance
+
+        store = BufferPool(nodestore.FileNodeStore("Feed.pages", 3), 64)
+        feedIndex = BTree(3, store = store)
+
+    When the pool is full, the least recently used node which is not
+    pinned is evicted. A node which was written while in the pool is dirty
+    and is written back to the store when it is evicted or when the pool
+    is flushed. The BTree pins the nodes on its search path while an
+    operation is in progress, so they stay in the pool until it is done.
+
+    The pool counts hits, misses, evictions and write-backs. The counts
+    are answered by the statistics method and help to size the pool for a
+    workload.
+'''
+
+from collections import OrderedDict
+
+
+class BufferPool:
+    def __init__(self, store, capacity = 64):
+        ''' Create a pool holding at most capacity nodes of store. '''
+        if capacity < 1:
+            raise ValueError("A buffer pool needs a capacity of at least 1")
+        self.store = store
+        self.capacity = capacity
+        self.pages = OrderedDict()
+        self.dirty = set()
+        self.pins = {}
+        self.rootIndex = store.rootIndex
+        self.freeIndex = store.freeIndex
+        self.resetStatistics()
+        # Nodes of a sized store are measured by the store
+        self.sized = getattr(store, "sized", False)
+        if hasattr(store, "pageSize"):
+            self.pageSize = store.pageSize
+
+    def bind(self, nodeClass, itemClass):
+        self.store.bind(nodeClass, itemClass)
+
+    def nodeSize(self, aNode):
+        return self.store.nodeSize(aNode)
+
+    def read(self, index):
+        ''' Answer the node with the given index, reading it from the store
+          if it is not in the pool.
+        '''
+        if index in self.pages:
+            self.hits += 1
+            self.pages.move_to_end(index)
+            return self.pages[index]
+
+        self.misses += 1
+        aNode = self.store.read(index)
+        if aNode != None:
+            self.admit(index, aNode)
+        return aNode
+
+    def write(self, index, aNode):
+        # The node is written to the store when it leaves the pool
+        if index in self.pages:
+            self.pages.move_to_end(index)
+        else:
+            self.admit(index, aNode)
+        self.pages[index] = aNode
+        self.dirty.add(index)
+
+    def admit(self, index, aNode):
+        # Make room for a node and put it in the pool
+        while len(self.pages) >= self.capacity:
+            self.evict()
+        self.pages[index] = aNode
+
+    def evict(self):
+        ''' Remove the least recently used node which is not pinned from the
+          pool, writing it back if it is dirty.
+        '''
+        for index in self.pages:
+            if index not in self.pins:
+                self.writeBack(index)
+                del self.pages[index]
+                self.evictions += 1
+                return
+        raise RuntimeError("All " + str(self.capacity) + \
+            " pages of the buffer pool are pinned")
+
+    def writeBack(self, index):
+        if index in self.dirty:
+            self.store.write(index, self.pages[index])
+            self.dirty.discard(index)
+            self.writeBacks += 1
+
+    def pin(self, index):
+        ''' Keep the node with the given index in the pool until it is
+          unpinned. Pins are counted, so a node pinned twice must be
+          unpinned twice.
+        '''
+        self.pins[index] = self.pins.get(index, 0) + 1
+
+    def unpin(self, index):
+        count = self.pins.get(index, 0)
+        if count <= 1:
+            self.pins.pop(index, None)
+        else:
+            self.pins[index] = count - 1
+
+    def recycle(self, index):
+        # The cleared node is written back before the store recycles it
+        if index in self.pages:
+            self.writeBack(index)
+            del self.pages[index]
+        self.pins.pop(index, None)
+        self.store.recycle(index)
+
+    def reuse(self):
+        return self.store.reuse()
+
+    def freeIndices(self):
+        return self.store.freeIndices()
+
+    def setHeader(self, rootIndex, freeIndex):
+        self.rootIndex = rootIndex
+        self.freeIndex = freeIndex
+        self.store.setHeader(rootIndex, freeIndex)
+
+    def commit(self):
+        ''' Write all dirty nodes back and commit the store, so the store
+          sees every change of the operation being committed.
+        '''
+        for index in list(self.dirty):
+            self.writeBack(index)
+        self.store.commit()
+
+    def flush(self):
+        ''' Write all dirty nodes back and flush the store. The nodes stay
+          in the pool.
+        '''
+        for index in list(self.dirty):
+            self.writeBack(index)
+        self.store.flush()
+
+    def close(self):
+        self.flush()
+        self.store.close()
+
+    def resetStatistics(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writeBacks = 0
+
+    def statistics(self):
+        ''' Answer a dictionary with the counters of the pool. '''
+        requests = self.hits + self.misses
+        return {
+            'capacity': self.capacity,
+            'size': len(self.pages),
+            'pinned': len(self.pins),
+            'dirty': len(self.dirty),
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'writeBacks': self.writeBacks,
+            'hitRatio': self.hits / requests if requests > 0 else 0.0,
+        }
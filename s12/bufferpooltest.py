@@ -0,0 +1,103 @@
+import os
+import random
+import shutil
+import tempfile
+
+import bufferpool
+import nodestore
+from joinquerybtree import BTree, Item
+
+def main():
+    # The page files are written to a temporary directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)
+    try:
+        tests()
+    finally:
+        os.chdir(here)
+        shutil.rmtree(directory)
+
+def tests():
+    # The least recently used node leaves a full pool first
+    store = nodestore.MemoryNodeStore({1: "one", 2: "two", 3: "three", \
+        4: "four"})
+    pool = bufferpool.BufferPool(store, 3)
+    for index in [1, 2, 3, 1, 4]:
+        pool.read(index)
+    statistics = pool.statistics()
+    if list(pool.pages) == [3, 1, 4] and statistics["hits"] == 1 and \
+        statistics["misses"] == 4 and statistics["evictions"] == 1:
+        print("Test 1 Passed")
+    else:
+        print("Test 1 Failed with", list(pool.pages), statistics)
+
+    # A pinned node stays in the pool until it is unpinned as often as it
+    # was pinned, and a pool of pinned nodes cannot admit another
+    pool.pin(3)
+    pool.pin(3)
+    pool.read(2)
+    pool.unpin(3)
+    pool.read(1)
+    kept = list(pool.pages)
+    pool.pin(2)
+    pool.pin(1)
+    try:
+        pool.read(4)
+        full = False
+    except RuntimeError:
+        full = True
+    pool.unpin(3)
+    pool.read(4)
+    if kept == [3, 2, 1] and full and list(pool.pages) == [2, 1, 4]:
+        print("Test 2 Passed")
+    else:
+        print("Test 2 Failed with", kept, list(pool.pages))
+
+    # A dirty node reaches the store when it is evicted or committed, and
+    # is written back once
+    pool = bufferpool.BufferPool(nodestore.MemoryNodeStore(), 2)
+    pool.write(5, "five")
+    pool.write(5, "FIVE")
+    pool.write(6, "six")
+    before = pool.store.read(5)
+    pool.write(7, "seven")
+    evicted = pool.store.read(5)
+    pool.commit()
+    if before == None and evicted == "FIVE" and \
+        pool.store.read(7) == "seven" and pool.writeBacks == 3 and \
+        pool.statistics()["dirty"] == 0:
+        print("Test 3 Passed")
+    else:
+        print("Test 3 Failed with", pool.statistics())
+
+    # A BTree through a small pool over a page file holds the same items
+    # as one in memory, and the page file holds them after a flush
+    store = nodestore.FileNodeStore("feed.pages", 2, 512)
+    pool = bufferpool.BufferPool(store, 16)
+    aTree = BTree(2, store = pool)
+    expected = BTree(2)
+    generator = random.Random(3)
+    largest = 0
+    for step in range(3000):
+        key = generator.randrange(500)
+        if generator.random() < 0.6:
+            aTree.insert(Item(key, step))
+            expected.insert(Item(key, step))
+        else:
+            aTree.delete(Item(key, None))
+            expected.delete(Item(key, None))
+        largest = max(largest, len(pool.pages))
+    aTree.close()
+    store = nodestore.FileNodeStore("feed.pages")
+    items = [repr(item) for item in BTree(2, store = store)]
+    statistics = pool.statistics()
+    if items == [repr(item) for item in expected] and largest <= 16 and \
+        statistics["evictions"] > 0 and statistics["hitRatio"] > 0.5:
+        print("Test 4 Passed")
+    else:
+        print("Test 4 Failed with", statistics)
+    store.close()
+
+if __name__ == "__main__":
+    main()
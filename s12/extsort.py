@@ -0,0 +1,63 @@
+'''
+  File: extsort.py
+  Description: This module provides the externalSort function. It sorts a
+    stream of items which may not fit in memory. The items are read in runs
+    of runSize items. Each run is sorted in memory. If all items fit in one
+    run they are answered directly. Otherwise each sorted run is written to
+    a temporary file and the runs are merged.
+
+    The items must be picklable and understand the < operator.
+'''
+
+import heapq
+import pickle
+import tempfile
+
+
+def readRun(runFile):
+    # Answer the items of a run file one at a time
+    runFile.seek(0)
+    while True:
+        try:
+            yield pickle.load(runFile)
+        except EOFError:
+            return
+
+
+def writeRun(run):
+    # Answer a temporary file holding the sorted items of run
+    runFile = tempfile.TemporaryFile()
+    for item in run:
+        pickle.dump(item, runFile, pickle.HIGHEST_PROTOCOL)
+    return runFile
+
+
+def externalSort(items, runSize = 100000):
+    ''' Answer the items in ascending order, one at a time. At most runSize
+      items are kept in memory while the runs are built.
+    '''
+    if runSize < 1:
+        raise ValueError("The run size must be at least 1")
+
+    runFiles = []
+    run = []
+    for item in items:
+        run.append(item)
+        if len(run) == runSize:
+            run.sort()
+            runFiles.append(writeRun(run))
+            run = []
+    run.sort()
+
+    if len(runFiles) == 0:
+        yield from run
+        return
+
+    if len(run) > 0:
+        runFiles.append(writeRun(run))
+    run = None
+    try:
+        yield from heapq.merge(*[readRun(f) for f in runFiles])
+    finally:
+        for runFile in runFiles:
+            runFile.close()
@@ -0,0 +1,295 @@
+'''
+  File: indexfile.py
+  Description: This module reads and writes the binary index files (.idx)
+    used by the main function of joinquerybtree.py. An index file holds the
+    record length of the indexed table and a BTree.
+
+    The file starts with a header holding a magic number, a format version,
+    the record length, the degree, the root index, the free index, the
+    number of node entries and the number of recycled node indices. Then
+    it holds the state of the indexed table, as answered by
+    TableReader.state: the number of records indexed, a CRC-32 of the
+    last CHECKED_BYTES bytes of those records, the number of bytes
+    checked, and the size and modification time of the table. A table
+    whose size and modification time are unchanged is not read at all.
+    Otherwise the record count tells which records were appended since
+    the index was written, and the checksum tells whether the records
+    before them still end as they did, so opening an index costs time in
+    the number of appended records and not in the size of the table. The
+    recycled indices follow the header. Then each node is written as its
+    index and length followed by the packed node from the nodestore
+    module. Only the live items of a node are written. Nodes are written
+    in the plain layout, since an index file is read whole and has no
+    pages whose searches the slotted layout would speed up.
+
+    Reading an index decodes the nodes straight into a MemoryNodeStore, so
+    neither eval nor a deepcopy of the nodes is needed. Files of version 1,
+    whose header ends with the number of recycled node indices, are still
+    read. Their record count is unknown. Files of version 2 hold only the
+    record count and a CRC-32 of all the indexed records.
+
+    Index files written by older versions of joinquerybtree.py hold the
+    record length on the first line followed by the repr of the BTree. The
+    convertIndex function parses such a file without eval, accepting only
+    BTree, BTreeNode and Item constructors and literals, and writes it in
+    the binary format.
+
+    An index read from a file and then changed, as when records appended
+    to its table are added, can be written back by appendIndex. The nodes
+    written since the index was read are appended to the file and the
+    header is written again, so the file holds entries which are no longer
+    used. A node read later replaces an earlier node with the same index.
+    The nodes are forced to disk before the header, so the file answers
+    either the old or the new index. Once most entries of a file would be
+    unused, or its recycled indices changed, the whole file is written
+    again.
+'''
+
+import ast
+import os
+import struct
+
+import nodestore
+
+MAGIC = b"BTIX"
+VERSION = 3
+HEADER = struct.Struct("<4sHIIIIIIIIIQQ")
+HEADER_V2 = struct.Struct("<4sHIIIIIIII")
+HEADER_V1 = struct.Struct("<4sHIIIIII")
+# The bytes at the end of the indexed records whose checksum is kept
+CHECKED_BYTES = 65536
+# The record count of an index whose indexed records are unknown
+UNKNOWN_COUNT = 0xFFFFFFFF
+NODE_ENTRY = struct.Struct("<II")
+FREE_ENTRY = struct.Struct("<I")
+
+
+def isLegacyIndex(fileName):
+    ''' Answer True if fileName is an index file in the old text format. '''
+    with open(fileName, "rb") as indexFile:
+        return indexFile.read(len(MAGIC)) != MAGIC
+
+
+def packHeader(aTree, recordLength, count, freeCount, tableState):
+    # Answer the header of an index file of aTree. tableState is None if
+    # the indexed records are unknown.
+    if tableState == None:
+        tableState = {'recordCount': None, 'checksum': 0, \
+            'checkedBytes': None, 'tableSize': 0, 'tableTime': 0}
+    recordCount = tableState['recordCount']
+    if recordCount == None:
+        recordCount = UNKNOWN_COUNT
+    # A checksum of all the records is recorded as checking no bytes
+    checkedBytes = tableState['checkedBytes'] or 0
+    return HEADER.pack(MAGIC, VERSION, recordLength, aTree.degree, \
+        aTree.rootIndex, aTree.freeIndex, count, freeCount, recordCount, \
+        tableState['checksum'], checkedBytes, tableState['tableSize'], \
+        tableState['tableTime'])
+
+
+def writeIndex(fileName, aTree, recordLength, itemClass, tableState = None):
+    ''' Write aTree and the record length of its table to fileName, with
+      the state of the indexed table, as answered by TableReader.state, if
+      it is known. The file is written under a temporary name and then
+      renamed, so a reader never sees a partly written index.
+    '''
+    freeList = aTree.store.freeIndices()
+    free = set(freeList)
+    body = bytearray()
+    count = 0
+    for index in range(1, aTree.freeIndex):
+        if index in free:
+            continue
+        node = aTree.readFrom(index)
+        if node == None:
+            continue
+        data = nodestore.packNode(node, aTree.degree, itemClass)
+        body += NODE_ENTRY.pack(index, len(data))
+        body += data
+        count += 1
+
+    tempName = fileName + ".tmp"
+    with open(tempName, "wb") as indexFile:
+        indexFile.write(packHeader(aTree, recordLength, count, \
+            len(freeList), tableState))
+        for index in freeList:
+            indexFile.write(FREE_ENTRY.pack(index))
+        indexFile.write(body)
+    os.replace(tempName, fileName)
+
+
+def unpackHeader(data, fileName):
+    ''' Answer a dictionary of the fields of the header at the start of
+      data, read from fileName. The record count is None if it is unknown.
+      The number of bytes checked is None if the checksum covers all the
+      indexed records, and the size and modification time of the table
+      are None if they were not recorded.
+    '''
+    if len(data) < HEADER_V1.size:
+        raise ValueError(fileName + " is not a binary index file")
+    magic, version = struct.unpack_from("<4sH", data, 0)
+    if magic != MAGIC:
+        raise ValueError(fileName + " is not a binary index file")
+    if version == 1:
+        fields = HEADER_V1.unpack_from(data, 0) + (UNKNOWN_COUNT, 0, 0, \
+            None, None)
+        size = HEADER_V1.size
+    elif version == 2:
+        fields = HEADER_V2.unpack_from(data, 0) + (0, None, None)
+        size = HEADER_V2.size
+    elif version == VERSION:
+        fields = HEADER.unpack_from(data, 0)
+        size = HEADER.size
+    else:
+        raise ValueError("Unsupported index file version " + str(version))
+
+    magic, version, recordLength, degree, rootIndex, freeIndex, count, \
+        freeCount, recordCount, checksum, checkedBytes, tableSize, \
+        tableTime = fields
+    if recordCount == UNKNOWN_COUNT:
+        recordCount = None
+    if checkedBytes == 0:
+        checkedBytes = None
+    return {'version': version, 'size': size, 'recordLength': recordLength, \
+        'degree': degree, 'rootIndex': rootIndex, 'freeIndex': freeIndex, \
+        'nodes': count, 'free': freeCount, 'recordCount': recordCount, \
+        'checksum': checksum, 'checkedBytes': checkedBytes, \
+        'tableSize': tableSize, 'tableTime': tableTime}
+
+
+def readIndexHeader(fileName):
+    # Answer the header of the binary index file fileName, as unpackHeader
+    with open(fileName, "rb") as indexFile:
+        return unpackHeader(indexFile.read(HEADER.size), fileName)
+
+
+def readIndex(fileName, treeClass, nodeClass, itemClass):
+    ''' Answer a tuple of the record length and the BTree stored in the
+      binary index file fileName.
+    '''
+    with open(fileName, "rb") as indexFile:
+        data = memoryview(indexFile.read())
+
+    header = unpackHeader(data, fileName)
+    recordLength = header['recordLength']
+    degree = header['degree']
+    rootIndex = header['rootIndex']
+    freeIndex = header['freeIndex']
+    count = header['nodes']
+    freeCount = header['free']
+
+    pos = header['size']
+    store = nodestore.MemoryNodeStore()
+    for i in range(freeCount):
+        store.recycle(FREE_ENTRY.unpack_from(data, pos)[0])
+        pos += FREE_ENTRY.size
+
+    for i in range(count):
+        index, size = NODE_ENTRY.unpack_from(data, pos)
+        pos += NODE_ENTRY.size
+        store.nodes[index] = nodestore.unpackNode(data, degree, index, \
+            nodeClass, itemClass, pos)[0]
+        pos += size
+
+    aTree = treeClass(degree, rootIndex = rootIndex, freeIndex = freeIndex, \
+        store = store)
+    store.changed.clear()
+    return recordLength, aTree
+
+
+def appendIndex(fileName, aTree, recordLength, itemClass, tableState):
+    ''' Append the nodes of aTree written since it was read from the index
+      file fileName to the file, and write the header again with the
+      state of the indexed table tableState. Answer False, and
+      leave the file as it is, if the file must be written again by
+      writeIndex instead.
+    '''
+    with open(fileName, "r+b") as indexFile:
+        data = indexFile.read(HEADER.size)
+        header = unpackHeader(data, fileName)
+        freeList = aTree.store.freeIndices()
+        if header['version'] != VERSION or \
+            header['recordLength'] != recordLength or \
+            header['degree'] != aTree.degree or \
+            header['free'] != len(freeList):
+            return False
+        recorded = indexFile.read(FREE_ENTRY.size * len(freeList))
+        if recorded != b"".join([FREE_ENTRY.pack(index) \
+            for index in freeList]):
+            return False
+
+        free = set(freeList)
+        changed = [index for index in sorted(aTree.store.changed) \
+            if index not in free]
+        count = header['nodes'] + len(changed)
+        # More than half of the entries would be unused
+        if count > 2 * (aTree.freeIndex - 1 - len(freeList)):
+            return False
+
+        # Nodes left by an append which did not get to write the header
+        # follow the recorded entries and are overwritten
+        end = indexFile.tell()
+        for i in range(header['nodes']):
+            indexFile.seek(end)
+            index, size = NODE_ENTRY.unpack(indexFile.read(NODE_ENTRY.size))
+            end += NODE_ENTRY.size + size
+
+        body = bytearray()
+        for index in changed:
+            data = nodestore.packNode(aTree.readFrom(index), aTree.degree, \
+                itemClass)
+            body += NODE_ENTRY.pack(index, len(data))
+            body += data
+        indexFile.seek(end)
+        indexFile.truncate()
+        indexFile.write(body)
+        indexFile.flush()
+        os.fsync(indexFile.fileno())
+        indexFile.seek(0)
+        indexFile.write(packHeader(aTree, recordLength, count, \
+            len(freeList), tableState))
+    aTree.store.changed.clear()
+    return True
+
+
+def legacyValue(expr, constructors):
+    ''' Answer the value of an expression from an old text index file.
+      Only literals and calls of the given constructors are accepted.
+    '''
+    if isinstance(expr, ast.Constant):
+        return expr.value
+    if isinstance(expr, ast.UnaryOp) and isinstance(expr.op, ast.USub):
+        return -legacyValue(expr.operand, constructors)
+    if isinstance(expr, ast.List):
+        return [legacyValue(e, constructors) for e in expr.elts]
+    if isinstance(expr, ast.Tuple):
+        return tuple(legacyValue(e, constructors) for e in expr.elts)
+    if isinstance(expr, ast.Dict):
+        return {legacyValue(k, constructors): legacyValue(v, constructors) \
+            for k, v in zip(expr.keys, expr.values)}
+    if isinstance(expr, ast.Call) and isinstance(expr.func, ast.Name) and \
+        expr.func.id in constructors and len(expr.keywords) == 0:
+        args = [legacyValue(a, constructors) for a in expr.args]
+        return constructors[expr.func.id](*args)
+    raise ValueError("Unexpected expression in index file at line " + \
+        str(getattr(expr, "lineno", "?")))
+
+
+def convertIndex(oldFileName, newFileName, treeClass, nodeClass, itemClass):
+    ''' Convert the old text index file oldFileName to the binary format
+      and write it to newFileName. Both names may be the same.
+    '''
+    with open(oldFileName, "r") as indexFile:
+        recordLength = int(indexFile.readline())
+        text = indexFile.read()
+
+    def makeTree(degree, nodes, rootIndex = 1, freeIndex = 2):
+        # The parsed nodes are fresh objects, so they are not copied
+        return treeClass(degree, rootIndex = rootIndex, \
+            freeIndex = freeIndex, store = nodestore.MemoryNodeStore(nodes))
+
+    constructors = {"BTree": makeTree, "BTreeNode": nodeClass, \
+        "Item": itemClass}
+    aTree = legacyValue(ast.parse(text.strip(), mode = "eval").body, \
+        constructors)
+    writeIndex(newFileName, aTree, recordLength, itemClass)
@@ -0,0 +1,243 @@
+'''
+  File: joinengine.py
+  Description: This module provides a small join engine for the fixed-width
+    tables of the Feed query. Rows are tuples and relations are iterables
+    of rows, so joins can be chained. Two join algorithms are provided.
+
+    The hashJoin function builds a dictionary from the build side and
+    probes it with the rows of the probe side, keeping the order of the
+    probe side. If the build side holds more than memoryRows rows, both
+    sides are hash partitioned into temporary files and each pair of
+    partitions is joined on its own, as in a Grace hash join. The rows of
+    a partitioned join come out partition by partition, so the order of
+    the probe side is lost.
+
+    The sortMergeJoin function sorts both sides on their join keys with
+    the external sort of the extsort module and merges them.
+
+    The join function picks the algorithm from the row counts of its
+    inputs. When the smaller side fits in memory, it is the build side of
+    an in-memory hash join. When it fits in memory after one partitioning
+    pass, a partitioned hash join is used. Otherwise both sides are
+    sorted and merged.
+
+    Rows whose join key is None never match, as in SQL.
+
+    The main function runs the query
+
+        SELECT Feed.FeedNum, Feed.Name, FeedAttribType.Name,
+            FeedAttribute.Value
+        WHERE Feed.FeedID = FeedAttribute.FeedID AND
+            FeedAttribute.FeedAttribTypeID = FeedAttribType.FeedAttribTypeID
+
+    with the join engine.
+'''
+
+import datetime
+import itertools
+import pickle
+import tempfile
+
+import extsort
+import resultsink
+import tablereader
+
+# The number of build rows kept in memory by a hash join
+MEMORY_ROWS = 500000
+# The number of partitions a spilling hash join splits its inputs into
+PARTITIONS = 16
+# The number of times a partition may be partitioned again
+MAX_DEPTH = 3
+
+attribTypeCols = ["int","char20","char60","int","int","int","int"]
+feedCols = ["int","int","int","char50","datetime","float","float","int","char50","int"]
+feedAttributeCols = ["int","int","float"]
+
+
+def scan(reader, fieldNums = None):
+    ''' Answer the rows of the TableReader reader as tuples of the fields
+      fieldNums, or of all fields if fieldNums is None.
+    '''
+    if fieldNums == None:
+        fieldNums = range(len(reader.schema))
+    project = reader.schema.projection(fieldNums)
+    # No record slice is held while the row is yielded, so the reader can
+    # be closed as soon as the scan is done
+    for recNum in range(len(reader)):
+        yield project(reader.record(recNum))
+
+
+def concatenate(probeRow, buildRow):
+    return probeRow + buildRow
+
+
+def hashJoin(build, probe, buildKey, probeKey, memoryRows = MEMORY_ROWS, \
+    combine = concatenate, depth = 0):
+    ''' Answer the rows combine(probeRow, buildRow) for every probe row
+      and build row whose keys, at positions probeKey and buildKey, match.
+      The probe side is read once. If the build side has more than
+      memoryRows rows, both sides are partitioned on disk first, and the
+      rows are answered partition by partition instead of in the order of
+      the probe side.
+    '''
+    table = {}
+    count = 0
+    buildRows = iter(build)
+    for row in buildRows:
+        key = row[buildKey]
+        if key is None:
+            continue
+        if key in table:
+            table[key].append(row)
+        else:
+            table[key] = [row]
+        count += 1
+        if count > memoryRows and depth < MAX_DEPTH:
+            # Spill the rows read so far and the rest of the build side
+            held = (row for rows in table.values() for row in rows)
+            table = None
+            yield from partitionedJoin(itertools.chain(held, buildRows), \
+                probe, buildKey, probeKey, memoryRows, combine, depth)
+            return
+
+    for row in probe:
+        matches = table.get(row[probeKey])
+        if matches != None:
+            for match in matches:
+                yield combine(row, match)
+
+
+def partition(rows, keyIndex, depth):
+    ''' Write rows into PARTITIONS temporary files by the hash of their
+      key. Answer the list of files. depth is mixed into the hash so a
+      partition is split differently when it is partitioned again.
+    '''
+    files = [tempfile.TemporaryFile() for i in range(PARTITIONS)]
+    for row in rows:
+        key = row[keyIndex]
+        if key is None:
+            continue
+        part = hash((depth, key)) % PARTITIONS
+        pickle.dump(row, files[part], pickle.HIGHEST_PROTOCOL)
+    return files
+
+
+def partitionedJoin(build, probe, buildKey, probeKey, memoryRows, combine, \
+    depth):
+    # Join each pair of partitions of the build and probe sides
+    buildFiles = partition(build, buildKey, depth)
+    probeFiles = partition(probe, probeKey, depth)
+    try:
+        for i in range(PARTITIONS):
+            yield from hashJoin(extsort.readRun(buildFiles[i]), \
+                extsort.readRun(probeFiles[i]), buildKey, probeKey, \
+                memoryRows, combine, depth+1)
+    finally:
+        for aFile in buildFiles + probeFiles:
+            aFile.close()
+
+
+def sortMergeJoin(left, right, leftKey, rightKey, memoryRows = MEMORY_ROWS):
+    ''' Answer the rows leftRow + rightRow for every pair of rows whose
+      keys match, in ascending order of the keys. Both sides are sorted
+      with an external sort that keeps at most memoryRows rows in memory.
+    '''
+    # The sequence number keeps rows with equal keys from being compared
+    leftRows = extsort.externalSort(((row[leftKey], i, row) \
+        for i, row in enumerate(left) if row[leftKey] is not None), memoryRows)
+    rightRows = extsort.externalSort(((row[rightKey], i, row) \
+        for i, row in enumerate(right) if row[rightKey] is not None), \
+        memoryRows)
+
+    l = next(leftRows, None)
+    r = next(rightRows, None)
+    while l != None and r != None:
+        if l[0] < r[0]:
+            l = next(leftRows, None)
+        elif r[0] < l[0]:
+            r = next(rightRows, None)
+        else:
+            key = l[0]
+            group = []
+            while r != None and r[0] == key:
+                group.append(r[2])
+                r = next(rightRows, None)
+            while l != None and l[0] == key:
+                for row in group:
+                    yield l[2] + row
+                l = next(leftRows, None)
+
+
+def chooseStrategy(leftCount, rightCount, memoryRows = MEMORY_ROWS):
+    ''' Answer "hash", "partitioned hash" or "sort merge" for joining
+      relations with the given row counts.
+    '''
+    smaller = min(leftCount, rightCount)
+    if smaller <= memoryRows:
+        return "hash"
+    if smaller <= memoryRows * PARTITIONS:
+        return "partitioned hash"
+    return "sort merge"
+
+
+def join(left, right, leftKey, rightKey, leftCount, rightCount, \
+    memoryRows = MEMORY_ROWS, strategy = None):
+    ''' Answer the rows leftRow + rightRow of the equijoin of left and
+      right on the keys at positions leftKey and rightKey. leftCount and
+      rightCount are the row counts, or estimates of them, used to pick the
+      strategy when strategy is None. A hash join builds on the smaller
+      side. Only an in-memory hash join with the right side as the build
+      side answers the rows in the order of the left side. A partitioned
+      hash join answers them partition by partition, and a sort merge join
+      in ascending order of the keys.
+    '''
+    if strategy == None:
+        strategy = chooseStrategy(leftCount, rightCount, memoryRows)
+
+    if strategy == "sort merge":
+        return sortMergeJoin(left, right, leftKey, rightKey, memoryRows)
+    if strategy != "hash" and strategy != "partitioned hash":
+        raise ValueError("Unknown join strategy " + repr(strategy))
+    if rightCount <= leftCount:
+        return hashJoin(right, left, rightKey, leftKey, memoryRows)
+    return hashJoin(left, right, leftKey, rightKey, memoryRows, \
+        lambda probeRow, buildRow: buildRow + probeRow)
+
+
+def feedQuery(memoryRows = MEMORY_ROWS, strategy = None):
+    ''' Answer the rows (FeedNum, Feed Name, FeedAttribType Name, Value) of
+      the Feed query. The tables are read from the current directory.
+    '''
+    attributes = tablereader.TableReader("FeedAttribute.tbl", \
+        feedAttributeCols)
+    feeds = tablereader.TableReader("Feed.tbl", feedCols)
+    attribTypes = tablereader.TableReader("FeedAttribType.tbl", \
+        attribTypeCols)
+
+    try:
+        # (FeedID, FeedAttribTypeID, Value) join (FeedID, FeedNum, Name)
+        rows = join(scan(attributes), scan(feeds, [0,2,3]), 0, 0, \
+            len(attributes), len(feeds), memoryRows, strategy)
+        # Each attribute row matches at most one feed
+        rows = join(rows, scan(attribTypes, [0,1]), 1, 0, len(attributes), \
+            len(attribTypes), memoryRows, strategy)
+
+        for row in rows:
+            yield (row[4], row[5], row[7], row[2])
+    finally:
+        attributes.close()
+        feeds.close()
+        attribTypes.close()
+
+
+def main(outputFormat = "text"):
+    before = datetime.datetime.now()
+    resultsink.writeRows(feedQuery(), outputFormat = outputFormat)
+    after = datetime.datetime.now()
+    deltaT = after - before
+    milliseconds = deltaT.total_seconds() * 1000
+    print("Done. The total time for the query with the join engine was", \
+        milliseconds, "milliseconds.")
+
+if __name__ == "__main__":
+    main()
@@ -1,62 +1,16 @@
 import datetime
+import schema
+import resultsink
 
 def readField(record,colTypes,fieldNum):
     # fieldNum is zero based
     # record is a string containing the record
     # colTypes is the types for each of the columns in the record
-    
-    offset = 0
-    for i in range(fieldNum):
-        colType = colTypes[i]
-        
-        if colType == "int":
-            offset+=10
-        elif colType[:4] == "char":
-            size = int(colType[4:])
-            offset += size
-        elif colType == "float":
-            offset+=20
-        elif colType == "datetime":
-            offset+=24
-            
-    colType = colTypes[fieldNum]
-   
-    if colType == "int":
-        value = record[offset:offset+10].strip()
-        if value == "null":
-            val = None
-        else:
-            val = int(value)
-    elif colType == "float":
-        value = record[offset:offset+20].strip()
-        if value == "null":
-            val = None
-        else:        
-            val = float(value)
-    elif colType[:4] == "char":
-        size = int(colType[4:])
-        value = record[offset:offset+size].strip()
-        if value == "null":
-            val = None
-        else:   
-            val = value[1:-1] # remove the ' and ' from each end of the string
-            if type(val) == bytes:
-                val = val.decode("utf-8")
-    elif colType == "datetime":
-        value = record[offset:offset+24].strip()
-        if value == "null":
-            val = None
-        else:
-            if type(val) == bytes:
-                val = val.decode("utf-8") 
-            val = datetime.datetime.strptime(val,'%m/%d/%Y %I:%M:%S %p')
-    else:
-        print("Unrecognized Type")
-        raise Exception("Unrecognized Type") 
-    
-    return val         
+    # The column list is compiled into a Schema once, so the offset of
+    # the field is not recomputed on every call.
+    return schema.compileSchema(colTypes).field(record, fieldNum)
 
-def main():
+def joinedRows():
     # SELECT Feed.FeedNum, Feed.Name, FeedAttribType.Name, FeedAttribute.Value WHERE
     # Feed.FeedID = FeedAttribute.FeedID AND 
     # FeedAttribute.FeedAttribTypeID = FeedAttribType.FeedAttribTypeID
@@ -65,7 +19,6 @@ def main():
     feedCols = ["int","int","int","char50","datetime","float","float","int","char50","int"]
     feedAttributeCols = ["int","int","float"]
     
-    before = datetime.datetime.now()
     feedAttributeTable = open("FeedAttribute.tbl","r")
     
     for record in feedAttributeTable:
@@ -96,7 +49,12 @@ def main():
             
         feedAttribTypeName = readField(feedAttribTypeRecord,attribTypeCols,1)
         
-        print(feedNum,feedName,feedAttribTypeName,value)
+        yield (feedNum,feedName,feedAttribTypeName,value)
+
+def main(outputFormat = "text"):
+    before = datetime.datetime.now()
+    # The rows are written to standard output in large batches
+    resultsink.writeRows(joinedRows(), outputFormat = outputFormat)
     after = datetime.datetime.now()
     deltaT = after - before
     milliseconds = deltaT.total_seconds() * 1000    
@@ -19,16 +19,74 @@
     The main function either builds a new BTree or reads an existing BTree
     from the index files, Feed.idx and FeedAttribType.idx files. If the idx
     file does not exist, then a new BTree is built and written to the
-    corresponding idx file.
+    corresponding idx file. An idx file records how many records of its
+    table it indexes. Records appended to the table since are inserted
+    into the BTree when it is read, and the idx file is written again, so
+    an append costs time in the number of new records. Only the end of the
+    indexed records is checked, and a table whose size and modification
+    time are unchanged is not read at all. If the indexed records no
+    longer end as they did, as when the table was written again, the
+    index is rebuilt. The idx files use the binary format of the indexfile
+    module. Index files in the old text format are converted to the binary
+    format when they are read. When an index is built, the statistics of
+    the columns of its table are collected in the same pass and written
+    next to the index file, as provided by the tablestats module.
+
+    The nodes of a BTree are kept in a node store from the nodestore module.
+    By default the nodes are kept in memory. A FileNodeStore keeps them in
+    fixed-size pages of a file instead, so a tree can be reopened without
+    rebuilding it. A BufferPool from the bufferpool module can be put in
+    front of a FileNodeStore to keep the most recently used nodes in
+    memory. The nodes on the search path of an operation are pinned in the
+    pool until the operation is done. Every operation which changes the
+    tree ends with a commit of the store. A LoggedFileNodeStore from the
+    wal module logs the changes of each commit, so they survive a crash.
+    A VersionedNodeStore from the versionstore module keeps the versions
+    of the nodes, so snapshots of the tree can be read while it changes.
+    The coroutines aretrieve and arange read nodes on the reader threads
+    of an AsyncNodeStore from the asyncstore module.
+
+    A store whose pages hold as many items as fit, as a FileNodeStore with
+    the slotted layout does, is sized. In a sized store a node is split
+    when it no longer fits in its page instead of at 2*degree items. The
+    item carried up to the parent is the smallest of the items near the
+    middle of the bytes of the node, so internal nodes get short keys. A
+    node is only merged with a sibling once it is empty, and only if both
+    fit in one page. Otherwise their items are shared between them.
+
+    A BTree can also be a non-unique index. Its items are then inserted
+    with insertPosting, and each key is stored once with a PostingList of
+    the record offsets of that key as its value, as provided by the
+    postings module.
+
+    A BTree may have a Bloom filter of its keys, from the bloomfilter
+    module, so lookups of keys it does not hold usually read no nodes.
+    Indexes built by openIndex get one, kept next to the index file.
 '''
 
+import bisect
+import bloomfilter
 import datetime
 import os
 from copy import deepcopy
 import sys
 import stack
 import queue
-
+import nodestore
+import postings
+import treestats
+import tablestats
+import indexfile
+import extsort
+import schema
+import tablereader
+import resultsink
+
+# The number of nodes fromSorted writes between two commits of the store
+BUILD_COMMIT_NODES = 1024
+# The fraction of the bytes of a node around its middle in which a sized
+# store looks for the smallest item to carry up when the node is split
+SPLIT_WINDOW = 0.2
 
 class BTreeNode:
     '''
@@ -75,7 +133,24 @@ class BTreeNode:
          returned. Note that the last child of the receiver
          and the first child of the new node will be the same.
         '''
-        pass
+        if not self.isFull():
+            raise RuntimeError("Attempt to split a node which is not full")
+
+        degree = len(self.items)//2
+        position = self.searchNode(anItem)['nodeIndex']
+        items = self.items[:position] + [anItem] + self.items[position:]
+        child = self.child[:position] + [left, right] + \
+            self.child[position+1:]
+
+        newNode = BTreeNode(degree)
+        newNode.items[:degree] = items[degree+1:]
+        newNode.child[:degree+1] = child[degree+1:]
+        newNode.setNumberOfKeys(degree)
+
+        self.items = items[:degree+1] + [None]*(degree-1)
+        self.child = child[:degree+2] + [None]*(degree-1)
+        self.setNumberOfKeys(degree+1)
+        return newNode
 
     def getChild(self,i):
         # Answer the index of the ith child
@@ -91,20 +166,18 @@ class BTreeNode:
     def childIndexOf(self, anIndex):
         # Answer the index of the child in the receiver
         # which contains anIndex.
-        index = -1
-        k = 0
-        found = False
-        while not found and k <= self.numberOfKeys :
-            if self.child[k] == anIndex:
-                index = k
-                found = True
-            else:
-                k += 1
-        if index < 0:
+        try:
+            return self.child.index(anIndex, 0, self.numberOfKeys+1)
+        except ValueError:
             print( 'Error in childIndexOf' )
             return -1
-        else:
-            return index
+
+    def getNumberOfKeys(self):
+        return self.numberOfKeys
+
+    def isLeaf(self):
+        # Leaves have no children
+        return self.child[0] == None
 
     def clear(self):
         self.numberOfKeys = 0
@@ -118,7 +191,11 @@ class BTreeNode:
           The copying within the receiver begins at position
           index. Answer the receiver.
         '''
-        pass
+        count = finish - start + 1
+        self.items[index:index+count] = fromNode.items[start:finish+1]
+        self.child[index:index+count+1] = fromNode.child[start:finish+2]
+        self.numberOfKeys = max(self.numberOfKeys, index+count)
+        return self
 
     def copyWithRight(self, aNode, parentNode):
         '''Answer a node which contains all the items and children
@@ -126,35 +203,42 @@ class BTreeNode:
           all the items and children of aNode.  The receiver and
           aNode are left and right siblings wrt the parentNode.
         '''
-        pass
+        separator = parentNode.childIndexOf(self.index)
+        newNode = BTreeNode(len(self.items)//2)
+        newNode.setIndex(self.index)
+        newNode.copyItemsAndChildren(self, 0, self.numberOfKeys-1, 0)
+        position = self.numberOfKeys
+        newNode.items[position] = parentNode.items[separator]
+        newNode.copyItemsAndChildren(aNode, 0, aNode.numberOfKeys-1, \
+            position+1)
+        newNode.setNumberOfKeys(self.numberOfKeys + 1 + aNode.numberOfKeys)
+        return newNode
 
-    def insertItem(self, anItem, left = 0, right = 0):
+    def insertItem(self, anItem, left = None, right = None):
         ''' We assume that the receiver is not full. anItem is
           inserted into the BTreeNode with child indices left and
           right.  This is done while retaining the <= ordering on
           the key of the item.  If the insertion is successful,
           answer True.  If not, answer False.
         '''
-        for i, item in enumerate(self.items):
-            if anItem == item:
-                return False
-
-            if item == None:
-                self.items[i] = anItem
-                return True
-
-            if anItem < item:
-                self.items.insert(i, anItem)
-                if self.isFull:
-                    if self.items[-1] == None:
-                        self.items.pop(-1)
-                    else:
-                        pass # implement child behavior later
+        if self.isFull():
+            return False
 
-                return True
+        result = self.searchNode(anItem)
+        if result['found']:
+            return False
 
-            if anItem > item:
-                continue
+        # Shift the items and children after position up one slot in
+        # place. The slices have equal lengths, so the lists keep their size.
+        position = result['nodeIndex']
+        n = self.numberOfKeys
+        self.items[position+1:n+1] = self.items[position:n]
+        self.child[position+2:n+2] = self.child[position+1:n+1]
+        self.items[position] = anItem
+        self.child[position] = left
+        self.child[position+1] = right
+        self.numberOfKeys += 1
+        return True
 
     def isFull(self):
         ''' Answer True if the receiver is full.  If not, return
@@ -169,14 +253,29 @@ class BTreeNode:
           the child entries down one, as removeItem will
           decrement numberOfKeys.
         '''
-        pass
+        if not (0 <= index <= self.numberOfKeys):
+            return None
+
+        aChild = self.child[index]
+        n = self.numberOfKeys
+        self.child[index:n] = self.child[index+1:n+1]
+        self.child[n] = None
+        return aChild
 
     def removeItem(self, index):
         '''If index is valid, remove and answer the item at
           location index. Update the key count.  If not, answer
           None.
         '''
-        pass
+        if not (0 <= index < self.numberOfKeys):
+            return None
+
+        anItem = self.items[index]
+        n = self.numberOfKeys
+        self.items[index:n-1] = self.items[index+1:n]
+        self.numberOfKeys -= 1
+        self.items[self.numberOfKeys] = None
+        return anItem
 
     def searchNode(self, anItem):
         '''Answer a dictionary satisfying: at 'found'
@@ -187,8 +286,11 @@ class BTreeNode:
           anItem < item, or self.numberOfKeys if all items
           are < anItem.  In other words, nodeIndex is the place in the node
           where the object is, or should go if there is room in the node.
+        The live items are searched with a binary search.
         '''
-        pass
+        i = bisect.bisect_left(self.items, anItem, 0, self.numberOfKeys)
+        found = i < self.numberOfKeys and self.items[i] == anItem
+        return {'found': found, 'nodeIndex': i}
 
     def setIndex(self, anInteger):
         self.index = anInteger
@@ -197,26 +299,54 @@ class BTreeNode:
         self.numberOfKeys = anInt
 
 class BTree:
-    def __init__(self, degree, nodes = {}, rootIndex = 1, freeIndex = 2):
-        # This method is complete
+    def __init__(self, degree, nodes = {}, rootIndex = 1, freeIndex = 2, \
+        store = None):
+        ''' Create a BTree of the given degree. The nodes are kept in store,
+          or in a MemoryNodeStore holding a copy of nodes if no store is
+          given. If the store already holds a tree, as a reopened
+          FileNodeStore does, the root and free index are taken from it.
+        '''
         self.degree = degree
 
-        if len(nodes) == 0:
-            self.rootNode = BTreeNode(degree)
-            self.nodes = {}
-            self.rootNode.setIndex(rootIndex)
-            self.writeAt(1, self.rootNode)
-        else:
-            self.nodes = deepcopy(nodes)
-            self.rootNode = self.nodes[rootIndex]
+        if store == None:
+            store = nodestore.MemoryNodeStore(deepcopy(nodes))
+        self.store = store
+        self.store.bind(BTreeNode, Item)
+
+        if store.rootIndex != None:
+            rootIndex = store.rootIndex
+            freeIndex = store.freeIndex
 
         self.stackOfNodes = stack.Stack()
+        self.pinnedPath = []
+        self.stats = None
+        # An optional BloomFilter of the keys, checked before a search
+        self.bloom = None
+        # The number of nodes written by fromSorted
+        self.written = 0
+        # The nodes of a sized store are split when their page is full
+        self.sized = getattr(store, "sized", False)
         self.rootIndex = rootIndex
         self.freeIndex = freeIndex
 
+        if self.readFrom(rootIndex) == None:
+            rootNode = BTreeNode(degree)
+            rootNode.setIndex(rootIndex)
+            self.writeAt(rootIndex, rootNode)
+            self.__commit()
+
+    def __iter__(self):
+        # Answer the items of the BTree in ascending order
+        return self.range()
+
     def __repr__(self):
         # This method is complete
-        return "BTree("+str(self.degree)+",\n "+repr(self.nodes)+","+ \
+        nodes = {}
+        for x in range(1, self.freeIndex):
+            node = self.readFrom(x)
+            if node != None:
+                nodes[x] = node
+        return "BTree("+str(self.degree)+",\n "+repr(nodes)+","+ \
             str(self.rootIndex)+","+str(self.freeIndex)+")"
 
     def __str__(self):
@@ -227,19 +357,612 @@ class BTree:
               str(self.rootIndex) + '.\n'
         for x in range(1, self.freeIndex):
             node = self.readFrom(x)
-            if node.getNumberOfKeys() > 0:
+            if node != None and node.getNumberOfKeys() > 0:
                 st += str(node)
         return st
 
+    def buildBloomFilter(self, falsePositiveRate = \
+        bloomfilter.FALSE_POSITIVE_RATE, capacity = None):
+        ''' Attach a new BloomFilter from the bloomfilter module holding the
+          keys of the tree and answer it. It is sized for capacity keys, or
+          for the keys of the tree if capacity is None or smaller. From
+          then on, retrieve, retrievePostings and retrieveMany answer at
+          once for keys the filter rejects, and inserted keys are added to
+          it. Setting bloom to None removes the filter.
+        '''
+        keys = [item.getKey() for item in self]
+        if capacity == None or capacity < len(keys):
+            capacity = len(keys)
+        self.bloom = bloomfilter.BloomFilter(capacity, falsePositiveRate)
+        for key in keys:
+            self.bloom.add(key)
+        return self.bloom
+
+    @staticmethod
+    def bulkLoad(items, degree, fillFactor = 1.0, store = None, \
+        runSize = 100000):
+        ''' Answer a new BTree holding items, which may come in any
+          order. The items are sorted with an external sort that keeps at
+          most runSize items in memory, and the tree is then built with
+          fromSorted.
+        '''
+        return BTree.fromSorted(extsort.externalSort(items, runSize), \
+            degree, fillFactor, store)
+
+    @staticmethod
+    def bulkLoadPostings(items, degree, fillFactor = 1.0, store = None, \
+        runSize = 100000):
+        ''' Answer a new non-unique index holding items, whose values are
+          record offsets and which may come in any order and share keys.
+          Each key gets one item with the PostingList of its offsets.
+        '''
+        return BTree.fromSorted(postings.groupPostings( \
+            extsort.externalSort(items, runSize)), degree, fillFactor, store)
 
+    def close(self):
+        # Flush the tree and close its node store
+        self.flush()
+        self.store.close()
+
+    @treestats.measured
     def delete(self, anItem):
         ''' Answer None if a matching item is not found.  If found,
           answer the entire item.
         '''
-        pass
+        result = self.__searchTree(anItem)
+        if not result['found']:
+            self.__releasePath()
+            return None
+        if self.sized:
+            deletedItem = self.__deleteBySize(result, anItem)
+            self.__releasePath()
+            self.__commit()
+            return deletedItem
+
+        node = self.readFrom(result['fileIndex'])
+        position = result['nodeIndex']
+        deletedItem = node.items[position]
+
+        if not node.isLeaf():
+            # Replace the item by its inorder successor, which is then
+            # deleted from its leaf.
+            self.__pushPath(node)
+            leaf = self.readFrom(node.getChild(position+1))
+            while not leaf.isLeaf():
+                self.__pushPath(leaf)
+                leaf = self.readFrom(leaf.getChild(0))
+            node.items[position] = leaf.items[0]
+            self.writeAt(node.index, node)
+            node = leaf
+            position = 0
+
+        node.removeItem(position)
+        self.writeAt(node.index, node)
+
+        while node.index != self.rootIndex and \
+            node.getNumberOfKeys() < self.degree:
+            parent = self.stackOfNodes.pop()
+            # The parent may have been rewritten since it was pushed
+            parent = self.readFrom(parent.index)
+            node = self.__fixUnderflow(node, parent)
+
+        if node.index == self.rootIndex and node.getNumberOfKeys() == 0 \
+            and not node.isLeaf():
+            self.rootIndex = node.getChild(0)
+            self.recycle(node)
+
+        self.__releasePath()
+        self.__commit()
+        return deletedItem
+
+    @treestats.measured
+    def deletePosting(self, anItem):
+        ''' Remove the record offset held as the value of anItem from the
+          posting list of the matching key of a non-unique index. The key
+          is deleted with its last offset. Answer None if the offset is not
+          found, and anItem otherwise.
+        '''
+        result = self.__searchTree(anItem)
+        self.__releasePath()
+        if not result['found']:
+            return None
+        node = self.readFrom(result['fileIndex'])
+        postingList = node.items[result['nodeIndex']].getValue()
+        if not postingList.remove(anItem.getValue()):
+            return None
+        if len(postingList) == 0:
+            self.delete(anItem)
+        else:
+            self.writeAt(node.index, node)
+            self.__commit()
+        return anItem
+
+    def __fixUnderflow(self, node, parent):
+        ''' node has fewer than degree items. Borrow an item from a
+          sibling or coalesce node with a sibling. Answer the parent, which
+          may now have too few items itself.
+        '''
+        position = parent.childIndexOf(node.index)
+        redistributed = False
+
+        if position < parent.getNumberOfKeys():
+            right = self.readFrom(parent.getChild(position+1))
+            if right.getNumberOfKeys() > self.degree:
+                node.insertItem(parent.items[position], \
+                    node.getChild(node.getNumberOfKeys()), right.getChild(0))
+                parent.items[position] = right.items[0]
+                right.removeChild(0)
+                right.removeItem(0)
+                self.writeAt(right.index, right)
+                redistributed = True
+            else:
+                merged = node.copyWithRight(right, parent)
+                parent.removeChild(position+1)
+                parent.removeItem(position)
+                self.recycle(right)
+                node = merged
+        else:
+            left = self.readFrom(parent.getChild(position-1))
+            last = left.getNumberOfKeys()
+            if last > self.degree:
+                node.insertItem(parent.items[position-1], \
+                    left.getChild(last), node.getChild(0))
+                parent.items[position-1] = left.items[last-1]
+                left.removeChild(last)
+                left.removeItem(last-1)
+                self.writeAt(left.index, left)
+                redistributed = True
+            else:
+                merged = left.copyWithRight(node, parent)
+                parent.removeChild(position)
+                parent.removeItem(position-1)
+                self.recycle(node)
+                node = merged
+
+        if self.stats != None:
+            if redistributed:
+                self.stats.redistributions += 1
+            else:
+                self.stats.merges += 1
+        self.writeAt(node.index, node)
+        self.writeAt(parent.index, parent)
+        return parent
+
+    def __deleteBySize(self, result, anItem):
+        ''' Delete the item anItem of a sized store, found by the search
+          answering result, and answer it. An item of an internal node is
+          replaced by its inorder successor, which is deleted from its
+          leaf first. The successor may be larger than the item, so the
+          node holding the item is found again and split if it no longer
+          fits.  Private
+        '''
+        node = self.readFrom(result['fileIndex'])
+        position = result['nodeIndex']
+        deletedItem = node.items[position]
+
+        if not node.isLeaf():
+            leaf = self.readFrom(node.getChild(position+1))
+            while not leaf.isLeaf():
+                leaf = self.readFrom(leaf.getChild(0))
+            successor = leaf.items[0]
+            self.__deleteBySize(self.__searchTree(successor), successor)
+            result = self.__searchTree(anItem)
+            node = self.readFrom(result['fileIndex'])
+            node.items[result['nodeIndex']] = successor
+            self.__settle(node)
+            return deletedItem
+
+        node.removeItem(position)
+        self.writeAt(node.index, node)
+        while node.index != self.rootIndex and node.getNumberOfKeys() == 0:
+            parent = self.stackOfNodes.pop()
+            # The parent may have been rewritten since it was pushed
+            parent = self.readFrom(parent.index)
+            node = self.__fixEmpty(node, parent)
+
+        if node.index == self.rootIndex and node.getNumberOfKeys() == 0 \
+            and not node.isLeaf():
+            self.rootIndex = node.getChild(0)
+            self.recycle(node)
+        return deletedItem
+
+    def __fixEmpty(self, node, parent):
+        ''' node of a sized store has no items left. Merge it with a
+          sibling if both fit in one page, or else share the items of both
+          between them. Answer the parent, which may now be empty itself.
+          Private
+        '''
+        position = parent.childIndexOf(node.index)
+        if position < parent.getNumberOfKeys():
+            left = node
+            right = self.readFrom(parent.getChild(position+1))
+        else:
+            position -= 1
+            left = self.readFrom(parent.getChild(position))
+            right = node
+        m = left.getNumberOfKeys()
+        n = right.getNumberOfKeys()
+        items = left.items[:m] + [parent.items[position]] + right.items[:n]
+        child = left.child[:m+1] + right.child[:n+1]
+
+        self.__setContents(left, items, child)
+        if self.__fits(left):
+            parent.removeChild(position+1)
+            parent.removeItem(position)
+            self.recycle(right)
+            self.writeAt(left.index, left)
+            self.writeAt(parent.index, parent)
+            if self.stats != None:
+                self.stats.merges += 1
+            return parent
+
+        parent.items[position] = self.__divide(items, child, left, right)
+        self.writeAt(left.index, left)
+        self.writeAt(right.index, right)
+        if self.stats != None:
+            self.stats.redistributions += 1
+        # The item carried up may be larger than the one it replaced
+        self.__settle(parent)
+        return parent
+
+    def __fits(self, aNode):
+        # Answer True if aNode fits in a page of the sized store.  Private
+        return aNode.getNumberOfKeys() <= 2*self.degree and \
+            self.store.nodeSize(aNode) <= self.store.pageSize
+
+    def __checkItem(self, anItem):
+        ''' Raise a ValueError if anItem takes more than 1/ITEM_SHARE of a
+          page of the sized store, as nodestore.ITEM_SHARE allows.  Private
+        '''
+        aNode = BTreeNode(self.degree)
+        self.__setContents(aNode, [anItem], [None, None])
+        size = self.store.nodeSize(aNode)
+        if size * nodestore.ITEM_SHARE > self.store.pageSize:
+            raise ValueError("An item of " + str(size) + " bytes does " + \
+                "not fit in a page of " + str(self.store.pageSize) + \
+                " bytes with the other items of its node")
+
+    def __checkPostings(self, postingItem, aNode = None):
+        ''' Raise a ValueError if the posting list of postingItem is too
+          long to be kept in a page of the store. Posting lists have no
+          overflow pages, so a posting list may take at most 1/ITEM_SHARE
+          of a page, and aNode, the node holding postingItem in a store
+          which is not sized, must still fit in its page. Stores without
+          pages hold posting lists of any length.  Private
+        '''
+        if not hasattr(self.store, "pageSize"):
+            return
+        single = BTreeNode(self.degree)
+        self.__setContents(single, [postingItem], [None, None])
+        if self.store.nodeSize(single) * nodestore.ITEM_SHARE <= \
+            self.store.pageSize and (aNode == None or self.sized or \
+            self.store.nodeSize(aNode) <= self.store.pageSize):
+            return
+        raise ValueError("The posting list of key " + \
+            repr(postingItem.getKey()) + " with " + \
+            str(len(postingItem.getValue())) + " offsets does not fit " + \
+            "in a page of " + str(self.store.pageSize) + " bytes")
+
+    def __setContents(self, aNode, items, child):
+        ''' Make items and child the items and children of aNode. A node
+          of a sized store may hold more than 2*degree items until it is
+          split.  Private
+        '''
+        aNode.items = items + [None]*(2*self.degree - len(items))
+        aNode.child = child + [None]*(2*self.degree + 1 - len(child))
+        aNode.setNumberOfKeys(len(items))
+
+    def __addItem(self, aNode, anItem, left, right):
+        # Insert anItem with the children left and right into aNode, even
+        # if aNode no longer fits in its page.  Private
+        position = aNode.searchNode(anItem)['nodeIndex']
+        n = aNode.getNumberOfKeys()
+        self.__setContents(aNode, \
+            aNode.items[:position] + [anItem] + aNode.items[position:n], \
+            aNode.child[:position] + [left, right] + \
+            aNode.child[position+1:n+1])
+
+    def __splitPoint(self, items):
+        ''' Answer the position of the item to carry up when items are
+          split between two nodes. It is the smallest item whose bytes are
+          within SPLIT_WINDOW of the middle of the bytes of all the items,
+          so the parent gets short keys, and neither node is empty.
+          Private
+        '''
+        sizes = []
+        for anItem in items:
+            out = bytearray()
+            nodestore.packValue(anItem, out, Item)
+            sizes.append(len(out))
+        total = sum(sizes)
+        best = None
+        before = 0
+        for i in range(1, len(items)-1):
+            before += sizes[i-1]
+            middle = before + sizes[i] / 2
+            if abs(middle - total / 2) <= total * SPLIT_WINDOW / 2 and \
+                (best == None or sizes[i] < sizes[best]):
+                best = i
+            elif best == None and middle > total / 2:
+                best = i
+        if best == None:
+            return len(items)//2
+        return best
+
+    def __divide(self, items, child, left, right):
+        ''' Share items and their children child between the nodes left
+          and right of a sized store, so that both fit. Answer the item
+          between them.  Private
+        '''
+        for m in [self.__splitPoint(items), len(items)//2]:
+            self.__setContents(left, items[:m], child[:m+1])
+            self.__setContents(right, items[m+1:], child[m+1:])
+            if self.__fits(left) and self.__fits(right):
+                return items[m]
+        raise RuntimeError("A node cannot be split into two nodes which " + \
+            "fit in a page of " + str(self.store.pageSize) + " bytes")
+
+    def __settle(self, node):
+        ''' Write node of a sized store, whose ancestors are on the search
+          path. While it does not fit in its page, it is split and the
+          item between the halves is carried up to its parent.  Private
+        '''
+        while not self.__fits(node):
+            n = node.getNumberOfKeys()
+            newNode = BTreeNode(self.degree)
+            item = self.__divide(node.items[:n], node.child[:n+1], node, \
+                newNode)
+            newNode.setIndex(self.getFreeIndex())
+            self.writeAt(node.index, node)
+            self.writeAt(newNode.index, newNode)
+            if self.stats != None:
+                self.stats.splits += 1
+
+            if self.stackOfNodes.isEmpty():
+                parent = self.getFreeNode()
+                self.rootIndex = parent.index
+            else:
+                parent = self.stackOfNodes.pop()
+            self.__addItem(parent, item, node.index, newNode.index)
+            node = parent
+        self.writeAt(node.index, node)
+
+    def __commit(self):
+        ''' Record the root and free index in the store and commit the
+          changes of the operation which just ended, so a store with a
+          log can recover them together.  Private
+        '''
+        self.store.setHeader(self.rootIndex, self.freeIndex)
+        self.store.commit()
+
+    def flush(self):
+        # Record the root and free index in the store and flush it
+        self.store.setHeader(self.rootIndex, self.freeIndex)
+        self.store.flush()
+
+    @staticmethod
+    def fromSorted(items, degree, fillFactor = 1.0, store = None):
+        ''' Answer a new BTree holding items, which must come in ascending
+          order. Of two matching items only the first is kept, as insert
+          would do. The tree is built bottom up. The leaves are packed left
+          to right and written as soon as they are full, then each level
+          of internal nodes is built in one pass over the separators of
+          the level below. fillFactor is the fraction of the 2*degree item
+          slots used in each node. No node gets fewer than degree items.
+          The store is committed every BUILD_COMMIT_NODES nodes, so a
+          store with a log keeps few pages in memory. The root is written
+          last, in place of the empty root, so until then a crash
+          recovers the empty tree. In a sized store the nodes are filled
+          to fillFactor of the bytes of a page instead.
+        '''
+        aTree = BTree(degree, store = store)
+        if aTree.readFrom(aTree.rootIndex).getNumberOfKeys() > 0:
+            raise ValueError("A BTree can only be bulk loaded into an " + \
+                "empty store")
+        if aTree.sized:
+            children, separators = aTree.__packLevel(((item, None) \
+                for item in aTree.__ascending(items)), None, fillFactor)
+            while len(children) > 1:
+                children, separators = aTree.__packLevel( \
+                    zip(separators, children[1:]), children[0], fillFactor)
+            aTree.__commit()
+            return aTree
+
+        target = max(degree, min(2*degree, int(round(2*degree*fillFactor))))
+        children = []
+        separators = []
+        leaf = []
+        previous = None
+
+        for item in aTree.__ascending(items):
+            if len(leaf) < target:
+                leaf.append(item)
+            else:
+                # The leaf is full. The previous leaf is only written now,
+                # so the last two leaves can be balanced at the end.
+                if previous != None:
+                    children.append(aTree.__writeNode(previous, None))
+                previous = leaf
+                separators.append(item)
+                leaf = []
+
+        if previous != None:
+            if len(leaf) < degree:
+                combined = previous + [separators.pop()] + leaf
+                if len(combined) > 2*degree:
+                    half = len(combined)//2
+                    children.append(aTree.__writeNode(combined[:half], None))
+                    separators.append(combined[half])
+                    leaf = combined[half+1:]
+                else:
+                    leaf = combined
+            else:
+                children.append(aTree.__writeNode(previous, None))
+        if len(children) == 0:
+            # A single leaf is the root
+            aTree.__writeNode(leaf, None, aTree.rootIndex)
+        else:
+            children.append(aTree.__writeNode(leaf, None))
+
+        while len(children) > 1:
+            children, separators = aTree.__buildLevel(children, separators, \
+                target)
+
+        aTree.__commit()
+        return aTree
+
+    def __ascending(self, items):
+        # Answer the items, leaving out an item matching the one before
+        # it. A ValueError is raised for items out of order and for
+        # posting lists too long for a page.  Private
+        last = None
+        for item in items:
+            if last != None and not last < item:
+                if item == last:
+                    continue
+                raise ValueError("fromSorted needs items in ascending order")
+            if isinstance(getattr(item, "value", None), postings.PostingList):
+                self.__checkPostings(item)
+            last = item
+            yield item
+
+    def __packLevel(self, entries, first, fillFactor):
+        ''' Write the nodes of one level of a tree bulk loaded into a sized
+          store. entries are pairs of an item and the child after it, in
+          ascending order, and first is the first child. The children of a
+          leaf level are None. Each node is filled to fillFactor of a page,
+          and the last two nodes are balanced. Answer the indices of the
+          nodes and the items between them, as __buildLevel does.  Private
+        '''
+        limit = self.store.pageSize * fillFactor
+        children = []
+        separators = []
+        previous = None
+        items = []
+        child = [first]
+        entries = iter(entries)
+        while True:
+            entry = next(entries, None)
+            if entry != None:
+                items.append(entry[0])
+                child.append(entry[1])
+                if len(items) <= 2*self.degree:
+                    continue
+            while not self.__fitsIn(items, child, limit):
+                # The node before the one cut off is written now
+                if previous != None:
+                    children.append(self.__writeNode(*previous))
+                m = self.__cutPoint(items, child, limit)
+                previous = (items[:m], child[:m+1])
+                separators.append(items[m])
+                items = items[m+1:]
+                child = child[m+1:]
+            if entry == None:
+                break
+
+        if previous != None:
+            # The last node may be nearly empty, so it shares the items
+            # of the node before it if both do not fit in one page
+            items = previous[0] + [separators.pop()] + items
+            child = previous[1] + child
+            if not self.__fitsIn(items, child, self.store.pageSize):
+                left = BTreeNode(self.degree)
+                right = BTreeNode(self.degree)
+                separators.append(self.__divide(items, child, left, right))
+                children.append(self.__writeNode( \
+                    left.items[:left.numberOfKeys], \
+                    left.child[:left.numberOfKeys+1]))
+                items = right.items[:right.numberOfKeys]
+                child = right.child[:right.numberOfKeys+1]
+        if len(children) == 0:
+            # A single node is the root
+            children.append(self.__writeNode(items, child, self.rootIndex))
+        else:
+            children.append(self.__writeNode(items, child))
+        return children, separators
+
+    def __fitsIn(self, items, child, limit):
+        # Answer True if a node of items and child takes at most limit
+        # bytes of a page of the sized store.  Private
+        aNode = BTreeNode(self.degree)
+        self.__setContents(aNode, items, child)
+        return len(items) <= 2*self.degree and \
+            self.store.nodeSize(aNode) <= limit
+
+    def __cutPoint(self, items, child, limit):
+        ''' Answer the position of the item after the first node cut off
+          items when bulk loading a sized store. The node holds as many
+          items as fit in limit bytes, less any items after the smallest
+          item within the last SPLIT_WINDOW/2 of them, which separates it
+          from the next node.  Private
+        '''
+        lo = 1
+        hi = len(items) - 1
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            if self.__fitsIn(items[:mid], child[:mid+1], limit):
+                lo = mid
+            else:
+                hi = mid - 1
+        best = lo
+        bestSize = None
+        for i in range(lo, max(1, int(lo * (1 - SPLIT_WINDOW / 2))) - 1, -1):
+            out = bytearray()
+            nodestore.packValue(items[i], out, Item)
+            if bestSize == None or len(out) < bestSize:
+                best = i
+                bestSize = len(out)
+        return best
+
+    def __buildLevel(self, children, separators, target):
+        ''' Group the nodes of one level under new parent nodes. The
+          separators[i] item separates children[i] and children[i+1].
+          Answer the indices of the parents and the separators between
+          them. The children are spread evenly, and no parent gets fewer
+          than degree+1 children unless it is the only one.
+        '''
+        count = len(children)
+        groups = (count + target) // (target+1)
+        if count // groups < self.degree+1:
+            groups = max(1, count // (self.degree+1))
+
+        parents = []
+        parentSeparators = []
+        start = 0
+        for i in range(groups):
+            size = count // groups + (1 if i < count % groups else 0)
+            parents.append(self.__writeNode(separators[start:start+size-1], \
+                children[start:start+size], \
+                self.rootIndex if groups == 1 else None))
+            if start+size-1 < len(separators):
+                parentSeparators.append(separators[start+size-1])
+            start += size
+        return parents, parentSeparators
+
+    def __writeNode(self, items, children, index = None):
+        # Write a new node with the given items and child indices, at
+        # index or at a free index, and answer its index. The store is
+        # committed every BUILD_COMMIT_NODES nodes.  Private
+        aNode = BTreeNode(self.degree)
+        aNode.items[:len(items)] = items
+        if children != None:
+            aNode.child[:len(children)] = children
+        aNode.setNumberOfKeys(len(items))
+        if index == None:
+            index = self.getFreeIndex()
+        aNode.setIndex(index)
+        self.writeAt(aNode.index, aNode)
+        self.written += 1
+        if self.written % BUILD_COMMIT_NODES == 0:
+            self.__commit()
+        return aNode.index
 
     def getFreeIndex(self):
-        # Answer a new index and update freeIndex.  Private
+        # Answer a new index and update freeIndex.  Recycled
+        # indices are used first.  Private
+        index = self.store.reuse()
+        if index != None:
+            return index
         self.freeIndex += 1
         return self.freeIndex - 1
 
@@ -265,38 +988,370 @@ class BTree:
         ''' Print the items of the subtree of the BTree, which is
           rooted at index, in inorder on aFile.
         '''
-        pass
-
+        if index == None:
+            return
+        node = self.readFrom(index)
+        for i in range(node.getNumberOfKeys()):
+            self.inorderOnFrom(aFile, node.getChild(i))
+            aFile.write(str(node.items[i]) + '\n')
+        self.inorderOnFrom(aFile, node.getChild(node.getNumberOfKeys()))
+
+    @treestats.measured
     def insert(self, anItem):
         ''' Answer None if the BTree already contains a matching
           item. If not, insert a deep copy of anItem and answer
           anItem.
         '''
-        return anItem if self.nodes[self.rootIndex].insertItem(anItem) else None
+        if self.sized:
+            self.__checkItem(anItem)
+        result = self.__searchTree(anItem)
+        if result['found']:
+            self.__releasePath()
+            return None
+
+        self.__insertAt(result['fileIndex'], deepcopy(anItem))
+        if self.bloom != None:
+            self.bloom.add(anItem.getKey())
+        return anItem
+
+    def __insertAt(self, index, item):
+        ''' Insert item into the leaf at index, where the last search
+          ended, splitting the nodes on the search path as needed.  Private
+        '''
+        node = self.readFrom(index)
+        if self.sized:
+            self.__addItem(node, item, None, None)
+            self.__settle(node)
+            self.__releasePath()
+            self.__commit()
+            return
+        left = None
+        right = None
+
+        while node.isFull():
+            # Split the node and carry its middle item up to the parent
+            newNode = node.addItemAndSplit(item, left, right)
+            item = node.removeItem(self.degree)
+            node.setChild(self.degree+1, None)
+            newNode.setIndex(self.getFreeIndex())
+            self.writeAt(node.index, node)
+            self.writeAt(newNode.index, newNode)
+            if self.stats != None:
+                self.stats.splits += 1
+            left = node.index
+            right = newNode.index
+
+            if self.stackOfNodes.isEmpty():
+                node = self.getFreeNode()
+                self.rootIndex = node.index
+            else:
+                node = self.stackOfNodes.pop()
+
+        node.insertItem(item, left, right)
+        self.writeAt(node.index, node)
+        self.__releasePath()
+        self.__commit()
+
+    @treestats.measured
+    def insertPosting(self, anItem):
+        ''' Add the record offset held as the value of anItem to the
+          posting list of the matching key of a non-unique index. If the
+          key is new, it is inserted with a new PostingList. Answer None
+          if the offset is already there, and anItem otherwise. Posting
+          lists are kept inline in their node, so in a store with pages a
+          ValueError is raised, and the offset is not added, if the
+          posting list would no longer fit in a page.
+        '''
+        result = self.__searchTree(anItem)
+        if not result['found']:
+            newItem = type(anItem)(deepcopy(anItem.getKey()), \
+                postings.PostingList([anItem.getValue()]))
+            self.__checkPostings(newItem)
+            self.__insertAt(result['fileIndex'], newItem)
+            if self.bloom != None:
+                self.bloom.add(anItem.getKey())
+            return anItem
+
+        node = self.readFrom(result['fileIndex'])
+        postingItem = node.items[result['nodeIndex']]
+        if not postingItem.getValue().add(anItem.getValue()):
+            self.__releasePath()
+            return None
+        try:
+            self.__checkPostings(postingItem, node)
+        except ValueError:
+            postingItem.getValue().remove(anItem.getValue())
+            self.__releasePath()
+            raise
+        if self.sized:
+            self.__settle(node)
+        else:
+            self.writeAt(node.index, node)
+        self.__releasePath()
+        self.__commit()
+        return anItem
 
     def levelByLevel(self, aFile):
         ''' Print the nodes of the BTree level-by-level on aFile. )
         '''
-        pass
+        aFile.write("A level by level listing of the nodes:\n")
+        nodes = queue.Queue()
+        nodes.enqueue(self.rootIndex)
+        while not nodes.isEmpty():
+            node = self.readFrom(nodes.dequeue())
+            aFile.write(str(node))
+            if not node.isLeaf():
+                for i in range(node.getNumberOfKeys()+1):
+                    nodes.enqueue(node.getChild(i))
+
+    def range(self, lo = None, hi = None, inclusive = True):
+        ''' Answer the items from lo to hi in ascending order, one at a
+          time. lo and hi are compared with the items of the BTree as in
+          retrieve, so for a BTree of Item objects they are Items like
+          Item(key, None). A bound of None leaves that end of the range
+          open. inclusive is either True or False for both ends or a
+          pair with a value for each end.
+
+          The tree is descended once to the first item. After that the
+          cursor walks forward keeping only the nodes of the current
+          path, so memory does not grow with the size of the result. The
+          items are not copied and must not be modified, and the BTree
+          must not be changed while the cursor is in use.
+        '''
+        cursor = self.__cursor(lo, hi, inclusive)
+        node = None
+        while True:
+            try:
+                read, value = cursor.send(node)
+            except StopIteration:
+                return
+            node = None
+            if read:
+                node = self.readFrom(value)
+            else:
+                yield value
+
+    def __cursor(self, lo, hi, inclusive):
+        ''' The cursor of range and arange, which only differ in how they
+          read nodes. It yields (True, index) when it needs the node at
+          index, which must then be sent to it, and (False, item) for each
+          item of the range.  Private
+        '''
+        if inclusive == True or inclusive == False:
+            inclusive = (inclusive, inclusive)
+        loInclusive, hiInclusive = inclusive
+
+        path = stack.Stack()
+        index = self.rootIndex
+        while index != None:
+            node = yield True, index
+            n = node.getNumberOfKeys()
+            if lo == None:
+                i = 0
+            elif loInclusive:
+                i = bisect.bisect_left(node.items, lo, 0, n)
+            else:
+                i = bisect.bisect_right(node.items, lo, 0, n)
+            path.push((node, i))
+            index = node.getChild(i)
+
+        while not path.isEmpty():
+            node, i = path.pop()
+            if i >= node.getNumberOfKeys():
+                continue
+            item = node.items[i]
+            if hi != None and (hi < item or (not hiInclusive and \
+                not item < hi)):
+                return
+            yield False, item
+            path.push((node, i+1))
+            # Walk down to the leftmost leaf of the next subtree
+            index = node.getChild(i+1)
+            while index != None:
+                child = yield True, index
+                path.push((child, 0))
+                index = child.getChild(0)
+
+    def instrument(self):
+        ''' Attach a new TreeStatistics object from the treestats module to
+          the tree and answer it. From then on the tree counts its node
+          reads, splits and merges and measures its operations. Setting
+          stats to None turns the instrumentation off.
+        '''
+        self.stats = treestats.TreeStatistics()
+        return self.stats
+
+    async def arange(self, lo = None, hi = None, inclusive = True):
+        ''' Answer the items from lo to hi in ascending order, one at a
+          time, as range does, for use with async for. Nodes are read as
+          by aretrieve.
+        '''
+        cursor = self.__cursor(lo, hi, inclusive)
+        node = None
+        while True:
+            try:
+                read, value = cursor.send(node)
+            except StopIteration:
+                return
+            node = None
+            if read:
+                node = await self.__aread(value)
+            else:
+                yield value
+
+    async def aretrieve(self, anItem):
+        ''' If found, answer a deep copy of the matching item.
+          If not found, answer None. The nodes are read with the aread
+          coroutine of the node store, as an AsyncNodeStore from the
+          asyncstore module provides, so the event loop is not blocked by
+          page reads. The search path is not kept, so many aretrieve
+          calls may run at the same time.
+        '''
+        if self.bloom != None and not self.bloom.mayContain(anItem.getKey()):
+            return None
+        index = self.rootIndex
+        while index != None:
+            node = await self.__aread(index)
+            result = node.searchNode(anItem)
+            if result['found']:
+                return deepcopy(node.items[result['nodeIndex']])
+            if node.isLeaf():
+                return None
+            index = node.getChild(result['nodeIndex'])
+        return None
+
+    async def __aread(self, index):
+        # Read a node without blocking the event loop if the store can.
+        # Private
+        if self.stats != None:
+            self.stats.reads += 1
+        if hasattr(self.store, "aread"):
+            return await self.store.aread(index)
+        return self.store.read(index)
 
     def readFrom(self, index):
         ''' Answer the node at entry index of the btree structure.
-          Later adapt to files
+          The node is read from the node store of the tree.
         '''
-        if self.nodes.__contains__(index):
-            return self.nodes[index]
-        else:
-            return None
+        if self.stats != None:
+            self.stats.reads += 1
+        return self.store.read(index)
 
     def recycle(self, aNode):
-        # For now, do nothing
+        # Clear the node and put its index on the free list of the store
         aNode.clear()
+        self.writeAt(aNode.index, aNode)
+        self.store.recycle(aNode.index)
 
+    @treestats.measured
     def retrieve(self, anItem):
         ''' If found, answer a deep copy of the matching item.
-          If not found, answer None
+          If not found, answer None. A store which can search its pages,
+          as a FileNodeStore can, is searched without decoding whole
+          nodes.
         '''
-        pass
+        if self.bloom != None and not self.bloom.mayContain(anItem.getKey()):
+            return None
+        if hasattr(self.store, "searchPage"):
+            # The item is decoded from its page, so it is not copied
+            index = self.rootIndex
+            while index != None:
+                if self.stats != None:
+                    self.stats.reads += 1
+                i, item, index = self.store.searchPage(index, anItem)
+                if item != None:
+                    return item
+            return None
+        result = self.__searchTree(anItem)
+        self.__releasePath()
+        if not result['found']:
+            return None
+        node = self.readFrom(result['fileIndex'])
+        return deepcopy(node.items[result['nodeIndex']])
+
+    @treestats.measured
+    def retrievePostings(self, anItem):
+        ''' Answer the list of the record offsets of the key of anItem in
+          a non-unique index, in ascending order. The list is empty if the
+          key is not found.
+        '''
+        if self.bloom != None and not self.bloom.mayContain(anItem.getKey()):
+            return []
+        result = self.__searchTree(anItem)
+        self.__releasePath()
+        if not result['found']:
+            return []
+        node = self.readFrom(result['fileIndex'])
+        return node.items[result['nodeIndex']].getValue().getOffsets()
+
+    @treestats.measured
+    def retrieveMany(self, items):
+        ''' Answer a list with, for each item of items, a deep copy of the
+          matching item of the BTree or None. The answers are in the order
+          of items. The items are sorted and matching items are looked up
+          only once, and all items which go to the same subtree share a
+          single descent into it. Matching items in items get the same
+          copy in the answer. Items whose keys the Bloom filter rejects are
+          not searched for.
+        '''
+        order = sorted(range(len(items)), key = lambda i: items[i])
+        probes = []
+        for i in order:
+            if len(probes) == 0 or not probes[-1] == items[i]:
+                probes.append(items[i])
+
+        searched = probes
+        if self.bloom != None:
+            searched = [probe for probe in probes \
+                if self.bloom.mayContain(probe.getKey())]
+        found = [None]*len(searched)
+        if len(searched) > 0:
+            self.__retrieveFrom(self.rootIndex, searched, 0, len(searched), \
+                found)
+        if len(searched) < len(probes):
+            # Put None in found for the rejected probes
+            searchedFound = found
+            found = []
+            j = 0
+            for probe in probes:
+                if j < len(searched) and searched[j] is probe:
+                    found.append(searchedFound[j])
+                    j += 1
+                else:
+                    found.append(None)
+
+        answer = [None]*len(items)
+        p = -1
+        for i in order:
+            if p < 0 or not probes[p] == items[i]:
+                p += 1
+            answer[i] = found[p]
+        return answer
+
+    def __retrieveFrom(self, index, probes, start, end, found):
+        ''' Look up probes[start:end], which are sorted and distinct, in
+          the subtree rooted at index. Deep copies of the matching items
+          are put in found.  Private
+        '''
+        node = self.readFrom(index)
+        n = node.getNumberOfKeys()
+        i = 0
+        p = start
+        while p < end:
+            i = bisect.bisect_left(node.items, probes[p], i, n)
+            if i < n and node.items[i] == probes[p]:
+                found[p] = deepcopy(node.items[i])
+                p += 1
+                continue
+            # All probes below items[i] go to the same child
+            groupEnd = p + 1
+            while groupEnd < end and (i == n or probes[groupEnd] < \
+                node.items[i]):
+                groupEnd += 1
+            if not node.isLeaf():
+                self.__retrieveFrom(node.getChild(i), probes, p, groupEnd, \
+                    found)
+            p = groupEnd
 
     def __searchTree(self, anItem):
         ''' Answer a dictionary.  If there is a matching item, at
@@ -311,22 +1366,113 @@ class BTree:
           (or the node containing a match).  Again, the rootnode
           is pushed if it is not a leaf node and has no match.
         '''
-        pass
-
+        self.__releasePath()
+        self.stackOfNodes.clear()
+        index = self.rootIndex
+        while True:
+            node = self.readFrom(index)
+            result = node.searchNode(anItem)
+            if result['found'] or node.isLeaf():
+                return {'found': result['found'], 'fileIndex': index, \
+                    'nodeIndex': result['nodeIndex']}
+            self.__pushPath(node)
+            index = node.getChild(result['nodeIndex'])
+
+    def __pushPath(self, aNode):
+        # Push aNode on the search path and pin it in the node store
+        self.store.pin(aNode.index)
+        self.pinnedPath.append(aNode.index)
+        self.stackOfNodes.push(aNode)
+
+    def __releasePath(self):
+        # Unpin the nodes pinned by the last search
+        for index in self.pinnedPath:
+            self.store.unpin(index)
+        self.pinnedPath = []
+
+    def snapshot(self):
+        ''' Answer a read-only BTree showing this BTree as of its last
+          change. The snapshot is not affected by later changes and can be
+          read by another thread while this BTree is changed. The node
+          store must keep versions, as a VersionedNodeStore from the
+          versionstore module does. The snapshot should be closed when it
+          is no longer needed.
+        '''
+        if not hasattr(self.store, "snapshot"):
+            raise RuntimeError("The node store of this BTree does not " + \
+                "keep versions")
+        return BTreeSnapshot(self.degree, store = self.store.snapshot())
+
+    def statistics(self, buckets = 10):
+        ''' Answer a dictionary with the counters of the instrumentation,
+          if the tree is instrumented, the shape answered by
+          treestats.treeShape and, under 'store', the statistics of the
+          node store if it keeps any, and under 'bloom', the statistics of
+          the Bloom filter if there is one. Every node is read to find the
+          shape.
+        '''
+        statistics = {}
+        if self.stats != None:
+            statistics.update(self.stats.asDict())
+        statistics.update(treestats.treeShape(self, buckets))
+        if self.bloom != None:
+            statistics['bloom'] = self.bloom.statistics()
+        if hasattr(self.store, "statistics"):
+            statistics['store'] = self.store.statistics()
+        return statistics
+
+    @treestats.measured
     def update(self, anItem):
         ''' If found, update the item with a matching key to be a
           deep copy of anItem and answer anItem.  If not, answer None.
         '''
-        pass
+        if self.sized:
+            self.__checkItem(anItem)
+        result = self.__searchTree(anItem)
+        if not result['found']:
+            self.__releasePath()
+            return None
+        node = self.readFrom(result['fileIndex'])
+        node.items[result['nodeIndex']] = deepcopy(anItem)
+        if self.sized:
+            self.__settle(node)
+        else:
+            self.writeAt(node.index, node)
+        self.__releasePath()
+        self.__commit()
+        return anItem
 
     def writeAt(self, index, aNode):
         ''' Set the element in the btree with the given index
           to aNode.  This method must be invoked to make any
-          permanent changes to the btree.  We may later change
-          this method to work with files.
-          This method is complete at this time.
+          permanent changes to the btree.  The node is written
+          to the node store of the tree.
         '''
-        self.nodes[index] = aNode
+        self.store.write(index, aNode)
+
+class BTreeSnapshot(BTree):
+    '''
+      A read-only BTree answered by BTree.snapshot. Its nodes are shared
+      with other snapshots, so every change is refused before a node is
+      touched.
+    '''
+    def refuseChange(self):
+        raise RuntimeError("A snapshot of a BTree cannot be changed")
+
+    def delete(self, anItem):
+        self.refuseChange()
+
+    def deletePosting(self, anItem):
+        self.refuseChange()
+
+    def insert(self, anItem):
+        self.refuseChange()
+
+    def insertPosting(self, anItem):
+        self.refuseChange()
+
+    def update(self, anItem):
+        self.refuseChange()
 
 def btreemain():
     print("My/Our name(s) is/are ")
@@ -539,57 +1685,36 @@ def readField(record, colTypes, fieldNum, val=None):
     # fieldNum is zero based
     # record is a string containing the record
     # colTypes is the types for each of the columns in the record
-
-    offset = 0
-    for i in range(fieldNum):
-        colType = colTypes[i]
-
-        if colType == "int":
-            offset+=10
-        elif colType[:4] == "char":
-            size = int(colType[4:])
-            offset += size
-        elif colType == "float":
-            offset+=20
-        elif colType == "datetime":
-            offset+=24
-
-    colType = colTypes[fieldNum]
-
-    if colType == "int":
-        value = record[offset:offset+10].strip()
-        if value == "null":
-            val = None
-        else:
-            val = int(value)
-    elif colType == "float":
-        value = record[offset:offset+20].strip()
-        if value == "null":
-            val = None
-        else:
-            val = float(value)
-    elif colType[:4] == "char":
-        size = int(colType[4:])
-        value = record[offset:offset+size].strip()
-        if value == "null":
-            val = None
-        else:
-            val = value[1:-1] # remove the ' and ' from each end of the string
-            if type(val) == bytes:
-                val = val.decode("utf-8")
-    elif colType == "datetime":
-        value = record[offset:offset+24].strip()
-        if value == "null":
-            val = None
-        else:
-            if type(val) == bytes:
-                val = val.decode("utf-8")
-            val = datetime.datetime.strptime(val,'%m/%d/%Y %I:%M:%S %p')
-    else:
-        print("Unrecognized Type")
-        raise Exception("Unrecognized Type")
-
-    return val
+    # The column list is compiled into a Schema once, so the offset of
+    # the field is not recomputed on every call.
+    return schema.compileSchema(colTypes).field(record, fieldNum)
+
+def readIndex(fileName):
+    ''' Answer a tuple of the record length and the BTree stored in the
+      index file fileName. An index file in the old text format is first
+      converted to the binary format. The Bloom filter kept next to the
+      index file, if there is one, is attached to the BTree.
+    '''
+    if indexfile.isLegacyIndex(fileName):
+        indexfile.convertIndex(fileName, fileName, BTree, BTreeNode, Item)
+    recLength, index = indexfile.readIndex(fileName, BTree, BTreeNode, Item)
+    index.bloom = bloomfilter.readBloomFilter(bloomfilter.bloomName(fileName))
+    return recLength, index
+
+def writeIndex(fileName, aTree, recordLength, tableState = None):
+    ''' Write aTree to the binary index file fileName, and its Bloom
+      filter, if it has one, next to it. A Bloom filter left by an older
+      version of the index is removed. tableState is the state of the
+      indexed table, as answered by TableReader.state, if it is known. The
+      Bloom filter is written first, so it never misses a key of the index
+      file.
+    '''
+    bloomName = bloomfilter.bloomName(fileName)
+    if aTree.bloom != None:
+        bloomfilter.writeBloomFilter(bloomName, aTree.bloom)
+    elif os.path.isfile(bloomName):
+        os.remove(bloomName)
+    indexfile.writeIndex(fileName, aTree, recordLength, Item, tableState)
 
 class Item:
     def __init__(self,key,value):
@@ -620,80 +1745,295 @@ class Item:
     def getKey(self):
         return self.key
 
-def main():
+attribTypeCols = ["int","char20","char60","int","int","int","int"]
+feedCols = ["int","int","int","char50","datetime","float","float","int","char50","int"]
+feedAttributeCols = ["int","int","float"]
+
+class IndexDefinition:
+    def __init__(self, colTypes, keyFields, includeFields = (), \
+        unique = True):
+        ''' Define an index over the columns keyFields of a table whose
+          columns have the types colTypes. A key of one column is its
+          value, and a key of several columns is the tuple of their
+          values, so keys are ordered column by column. The value of an
+          item is the record offset. If includeFields are given, the
+          value is a tuple of the offset and the values of those columns,
+          so a query needing only them is answered from the index. A
+          non-unique index keeps a posting list of offsets per key and
+          cannot include columns.
+        '''
+        if len(keyFields) == 0:
+            raise ValueError("An index needs at least one key column")
+        if not unique and len(includeFields) > 0:
+            raise ValueError("A non-unique index cannot include columns")
+        self.colTypes = list(colTypes)
+        self.keyFields = list(keyFields)
+        self.includeFields = list(includeFields)
+        self.unique = unique
+        tableSchema = schema.compileSchema(colTypes)
+        self.keyOf = tableSchema.projection(self.keyFields)
+        self.includedOf = tableSchema.projection(self.includeFields)
+
+    def __repr__(self):
+        return "IndexDefinition(" + repr(self.colTypes) + "," + \
+            repr(self.keyFields) + "," + repr(self.includeFields) + "," + \
+            repr(self.unique) + ")"
+
+    def key(self, record):
+        ''' Answer the key of record, or None if a key column of the
+          record is null.
+        '''
+        key = self.keyOf(record)
+        if None in key:
+            return None
+        if len(key) == 1:
+            return key[0]
+        return key
+
+    def item(self, offset, record):
+        # Answer the Item of record, or None if its key is null
+        key = self.key(record)
+        if key == None:
+            return None
+        if len(self.includeFields) == 0:
+            return Item(key, offset)
+        return Item(key, (offset, self.includedOf(record)))
+
+    def items(self, tableName, statistics = None):
+        ''' Answer the Items of the records of the table tableName in the
+          order of the table. Records with a null key are not indexed.
+          If statistics is given, every record is also added to it.
+        '''
+        with tablereader.TableReader(tableName, self.colTypes) as table:
+            for offset in range(len(table)):
+                # No slice of the map may outlive the loop
+                if statistics != None:
+                    statistics.addRecord(table.record(offset))
+                item = self.item(offset, table.record(offset))
+                if item != None:
+                    yield item
+
+    def build(self, tableName, degree = 3, store = None, statistics = None):
+        ''' Answer a new BTree indexing the table tableName. If statistics
+          is given, the TableStatistics of the table are collected in the
+          same pass.
+        '''
+        items = self.items(tableName, statistics)
+        if self.unique:
+            return BTree.bulkLoad(items, degree, store = store)
+        return BTree.bulkLoadPostings(items, degree, store = store)
+
+    def offset(self, anItem):
+        # Answer the record offset held by an item of a unique index
+        if len(self.includeFields) == 0:
+            return anItem.getValue()
+        return anItem.getValue()[0]
+
+    def included(self, anItem):
+        ''' Answer the tuple of the included column values held by an
+          item of the index, in the order of includeFields.
+        '''
+        return anItem.getValue()[1]
+
+def openIndex(indexName, tableName, colTypes, fieldNum = 0, unique = True, \
+    falsePositiveRate = bloomfilter.FALSE_POSITIVE_RATE):
+    ''' Answer a tuple of the record length of tableName and the BTree
+      indexing its column fieldNum. The index is read from the index file
+      indexName if it exists. Otherwise it is built and written to
+      indexName. If unique is False, the column may hold a key many times
+      and a non-unique index with a posting list per key is built.
+    '''
+    return openDefinedIndex(indexName, tableName, \
+        IndexDefinition(colTypes, [fieldNum], unique = unique), \
+        falsePositiveRate)
+
+def openDefinedIndex(indexName, tableName, definition, \
+    falsePositiveRate = bloomfilter.FALSE_POSITIVE_RATE):
+    ''' Answer a tuple of the record length of tableName and the BTree
+      of the IndexDefinition definition over it. The index is read from
+      the index file indexName if it exists, and the records appended to
+      the table since it was written are added to it by refreshIndex.
+      Otherwise, or if the table was changed in any other way, it is built
+      and written to indexName, and the statistics of the columns of the
+      table are written next to it, as provided by the tablestats module.
+      A new index gets a Bloom filter of its keys with the false positive
+      rate falsePositiveRate, unless it is None.
+    '''
+    if os.path.isfile(indexName):
+        refreshed = refreshIndex(indexName, tableName, definition)
+        if refreshed != None:
+            return refreshed
+
+    with open(tableName,"r") as table:
+        recLength = len(table.readline())
+    statistics = tablestats.TableStatistics(definition.colTypes, tableName)
+    index = definition.build(tableName, statistics = statistics)
+    statistics.finish()
+    if falsePositiveRate != None:
+        index.buildBloomFilter(falsePositiveRate)
+    with tablereader.TableReader(tableName, definition.colTypes) as table:
+        tableState = table.state(indexfile.CHECKED_BYTES)
+
+    writeIndex(indexName, index, recLength, tableState)
+    tablestats.writeStatistics(tablestats.statisticsName(indexName), \
+        statistics)
+    return recLength, index
+
+def refreshIndex(indexName, tableName, definition):
+    ''' Answer a tuple of the record length of tableName and the BTree of
+      the IndexDefinition definition over it, read from the index file
+      indexName. Records appended to the table since the index was
+      written are inserted into it. The changed nodes are appended to the
+      index file, as provided by indexfile.appendIndex, and the Bloom
+      filter and the statistics are written again. Only the appended
+      records are decoded. A record whose key is already in a unique index
+      is left out, as it is when the index is built. A Bloom filter which
+      gets full is rebuilt with room for as many keys again. A table whose
+      size and modification time are those recorded in the index file is
+      not read. Otherwise only the end of the records the index was built
+      from is checked, so the cost of a refresh does not grow with the
+      table. Answer None if the table no longer ends its indexed records
+      as it did, so the index must be rebuilt. An index file which does
+      not record its records is read as it is.
+    '''
+    if indexfile.isLegacyIndex(indexName):
+        return readIndex(indexName)
+    header = indexfile.readIndexHeader(indexName)
+    indexed = header['recordCount']
+    if indexed == None:
+        return readIndex(indexName)
+    tableStat = os.stat(tableName)
+    if tableStat.st_size == header['tableSize'] and \
+        tableStat.st_mtime_ns == header['tableTime']:
+        return readIndex(indexName)
+
+    with tablereader.TableReader(tableName, definition.colTypes) as table:
+        recordCount = len(table)
+        if recordCount < indexed or table.checksum(indexed, \
+            header['checkedBytes']) != header['checksum']:
+            return None
+        recLength, index = readIndex(indexName)
+        tableState = table.state(indexfile.CHECKED_BYTES)
+        if recordCount == indexed:
+            # Only the new size or modification time is recorded
+            if not indexfile.appendIndex(indexName, index, recLength, Item, \
+                tableState):
+                indexfile.writeIndex(indexName, index, recLength, Item, \
+                    tableState)
+            return recLength, index
+
+        statsName = tablestats.statisticsName(indexName)
+        statistics = tablestats.readStatistics(statsName)
+        for offset in range(indexed, recordCount):
+            if statistics != None:
+                statistics.addRecord(table.record(offset))
+            item = definition.item(offset, table.record(offset))
+            if item == None:
+                continue
+            if definition.unique:
+                index.insert(item)
+            else:
+                index.insertPosting(item)
+
+    if index.bloom != None and index.bloom.isFull():
+        index.buildBloomFilter(index.bloom.falsePositiveRate, \
+            2 * index.bloom.count)
+    # The Bloom filter is written first, as by writeIndex
+    if index.bloom != None:
+        bloomfilter.writeBloomFilter(bloomfilter.bloomName(indexName), \
+            index.bloom)
+    if not indexfile.appendIndex(indexName, index, recLength, Item, \
+        tableState):
+        indexfile.writeIndex(indexName, index, recLength, Item, tableState)
+    if statistics != None:
+        tablestats.writeStatistics(statsName, statistics)
+    return recLength, index
+
+# FeedAttribute rows by (FeedID, FeedAttribTypeID)
+feedAttributeKeyIndex = IndexDefinition(feedAttributeCols, [0,1])
+# Feed.FeedNum and Feed.Name by FeedID, answered without reading Feed.tbl
+feedNameIndex = IndexDefinition(feedCols, [0], [2,3])
+
+def feedAttributeRows(feedAttributeIndex, feedID):
+    ''' Answer the FeedAttribute rows of the feed feedID as tuples, using
+      the non-unique index feedAttributeIndex on FeedAttribute.FeedID.
+      The index is descended once and only the matching records are read.
+    '''
+    offsets = feedAttributeIndex.retrievePostings(Item(feedID,None))
+    with tablereader.TableReader("FeedAttribute.tbl", \
+        feedAttributeCols) as feedAttributeTable:
+        return [feedAttributeTable.decode(offset) for offset in offsets]
+
+def indexJoinRows(feedIndex, attribTypeIndex, first = 0, end = None):
+    ''' Answer the rows (FeedNum, Feed Name, FeedAttribType Name, Value)
+      of the Feed query, using feedIndex and attribTypeIndex to look up
+      the Feed and FeedAttribType records of each FeedAttribute row. Only
+      the FeedAttribute records first up to, but not including, end are
+      joined. If end is None, the records up to the end of the table are
+      joined.
+    '''
+    # The tables are memory-mapped, so a record is a slice of the map
+    # instead of a seek and a read.
+    feedAttributeTable = tablereader.TableReader("FeedAttribute.tbl", \
+        feedAttributeCols)
+    feedTable = tablereader.TableReader("Feed.tbl", feedCols)
+    feedAttribTypeTable = tablereader.TableReader("FeedAttribType.tbl", \
+        attribTypeCols)
+    feedAttributeRow = feedAttributeTable.decode
+    feedRow = feedTable.projection([2,3])
+    attribTypeName = feedAttribTypeTable.projection([1])
+
+    if end == None or end > len(feedAttributeTable):
+        end = len(feedAttributeTable)
+
+    try:
+        # The FeedAttribute rows are joined in batches, so each index is
+        # searched once per distinct key of a batch.
+        for batchStart in range(first, end, 1000):
+            # A row with a null key matches nothing, as in the other joins
+            rows = [feedAttributeRow(recNum) \
+                for recNum in range(batchStart, min(batchStart + 1000, end))]
+            rows = [row for row in rows \
+                if row[0] is not None and row[1] is not None]
+            feedItems = feedIndex.retrieveMany( \
+                [Item(row[0],None) for row in rows])
+            attribTypeItems = attribTypeIndex.retrieveMany( \
+                [Item(row[1],None) for row in rows])
+
+            for i in range(len(rows)):
+                # A row whose Feed or FeedAttribType is missing is skipped
+                if feedItems[i] == None or attribTypeItems[i] == None:
+                    continue
+                value = rows[i][2]
+
+                feedNum, feedName = feedRow(feedItems[i].getValue())
+                feedAttribTypeName, = \
+                    attribTypeName(attribTypeItems[i].getValue())
+
+                yield (feedNum,feedName,feedAttribTypeName,value)
+    finally:
+        feedAttributeTable.close()
+        feedTable.close()
+        feedAttribTypeTable.close()
+
+def main(outputFormat = "text"):
     # Select Feed.FeedNum, Feed.Name, FeedAttribType.Name, FeedAttribute.Value where
     # Feed.FeedID = FeedAttribute.FeedID and FeedAttribute.FeedAtribTypeID = FeedAttribType.ID
-    attribTypeCols = ["int","char20","char60","int","int","int","int"]
-    feedCols = ["int","int","int","char50","datetime","float","float","int","char50","int"]
-    feedAttributeCols = ["int","int","float"]
-
-    feedAttributeTable = open("FeedAttribute.tbl","r")
-
-    if os.path.isfile("Feed.idx"):
-        indexFile = open("Feed.idx","r")
-        feedTableRecLength = int(indexFile.readline())
-        feedIndex = eval("".join(indexFile.readlines()))
-    else:
-        feedIndex = BTree(3)
-        feedTable = open("Feed.tbl","r")
-        offset = 0
-        for record in feedTable:
-            feedID = readField(record,feedCols,0)
-            anItem = Item(feedID,offset)
-            feedIndex.insert(anItem)
-            offset+=1
-            feedTableRecLength = len(record)
-
+    created = not os.path.isfile("Feed.idx")
+    feedTableRecLength, feedIndex = openIndex("Feed.idx", "Feed.tbl", feedCols)
+    if created:
         print("Feed Table Index Created")
-        indexFile = open("Feed.idx","w")
-        indexFile.write(str(feedTableRecLength)+"\n")
-        indexFile.write(repr(feedIndex)+"\n")
-        indexFile.close()
-
-    if os.path.isfile("FeedAttribType.idx"):
-        indexFile = open("FeedAttribType.idx","r")
-        attribTypeTableRecLength = int(indexFile.readline())
-        attribTypeIndex = eval("".join(indexFile.readlines()))
-    else:
-        attribTypeIndex = BTree(3)
-        attribTable = open("FeedAttribType.tbl","r")
-        offset = 0
-        for record in attribTable:
-            feedAttribTypeID = readField(record,attribTypeCols,0)
-            anItem = Item(feedAttribTypeID,offset)
-            attribTypeIndex.insert(anItem)
-            offset+=1
-            attribTypeTableRecLength = len(record)
 
+    created = not os.path.isfile("FeedAttribType.idx")
+    attribTypeTableRecLength, attribTypeIndex = openIndex( \
+        "FeedAttribType.idx", "FeedAttribType.tbl", attribTypeCols)
+    if created:
         print("Attrib Type Table Index Created")
-        indexFile = open("FeedAttribType.idx","w")
-        indexFile.write(str(attribTypeTableRecLength)+"\n")
-        indexFile.write(repr(attribTypeIndex)+"\n")
-        indexFile.close()
 
-    feedTable = open("Feed.tbl","rb")
-    feedAttribTypeTable = open("FeedAttribType.tbl", "rb")
     before = datetime.datetime.now()
-    for record in feedAttributeTable:
-
-        feedID = readField(record,feedAttributeCols,0)
-        feedAttribTypeID = readField(record,feedAttributeCols,1)
-        value = readField(record,feedAttributeCols,2)
-
-        lookupItem = Item(feedID,None)
-        item = feedIndex.retrieve(lookupItem)
-        offset = item.getValue()
-        feedRecord = readRecord(feedTable,offset,feedTableRecLength)
-        feedNum = readField(feedRecord,feedCols,2)
-        feedName = readField(feedRecord,feedCols,3)
-
-        lookupItem = Item(feedAttribTypeID,None)
-        item = attribTypeIndex.retrieve(lookupItem)
-        offset = item.getValue()
-        feedAttribTypeRecord = readRecord(feedAttribTypeTable,offset,attribTypeTableRecLength)
-        feedAttribTypeName = readField(feedAttribTypeRecord,attribTypeCols,1)
-
-        print(feedNum,feedName,feedAttribTypeName,value)
+    # The rows are written to standard output in large batches
+    resultsink.writeRows(indexJoinRows(feedIndex, attribTypeIndex), \
+        outputFormat = outputFormat)
     after = datetime.datetime.now()
     deltaT = after - before
     milliseconds = deltaT.total_seconds() * 1000
@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+
+import joinquerybtree
+import paralleljoin
+import schema
+import tablereader
+
+def appendRows(fileName, colTypes, rows):
+    encode = schema.compileSchema(colTypes).encode
+    with open(fileName, "a") as table:
+        for row in rows:
+            table.write(encode(row) + "\n")
+
+def main():
+    # The tables are copied to a temporary directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    directory = tempfile.mkdtemp()
+    for tableName in ["Feed.tbl", "FeedAttribType.tbl", "FeedAttribute.tbl"]:
+        shutil.copy(os.path.join(here, tableName), directory)
+    os.chdir(directory)
+    try:
+        tests()
+    finally:
+        os.chdir(here)
+        shutil.rmtree(directory)
+
+def tests():
+    # FeedAttribute rows with a missing Feed, a missing FeedAttribType and
+    # a null FeedID, and one row which matches
+    with tablereader.TableReader("FeedAttribute.tbl", \
+        joinquerybtree.feedAttributeCols) as feedAttributeTable:
+        first = len(feedAttributeTable)
+    appendRows("FeedAttribute.tbl", joinquerybtree.feedAttributeCols, \
+        [(999999, 56, 1.0), (2285, 999, 2.0), (None, 56, 3.0), \
+        (2285, 56, 4.0)])
+    feedIndex = joinquerybtree.openIndex("Feed.idx", "Feed.tbl", \
+        joinquerybtree.feedCols)[1]
+    attribTypeIndex = joinquerybtree.openIndex("FeedAttribType.idx", \
+        "FeedAttribType.tbl", joinquerybtree.attribTypeCols)[1]
+
+    try:
+        rows = list(joinquerybtree.indexJoinRows(feedIndex, \
+            attribTypeIndex, first))
+        if len(rows) == 1 and rows[0][3] == 4.0:
+            print("Test 1 Passed")
+        else:
+            print("Test 1 Failed with", rows)
+    except AttributeError as error:
+        print("Test 1 Failed with", error)
+
+    # The parallel join skips the same rows
+    try:
+        rows = list(joinquerybtree.indexJoinRows(feedIndex, attribTypeIndex))
+        parallelRows = list(paralleljoin.parallelJoinRows(2))
+        if parallelRows == rows and len(rows) == first + 1:
+            print("Test 2 Passed")
+        else:
+            print("Test 2 Failed with", len(parallelRows), "rows")
+    except RuntimeError as error:
+        print("Test 2 Failed with", error)
+
+    # A Feed appended with a FeedID already in the index keeps the first
+    # record, as a rebuild does, and the index can still be opened
+    with tablereader.TableReader("Feed.tbl", joinquerybtree.feedCols) as \
+        feedTable:
+        feedCount = len(feedTable)
+        last = feedTable.decode(feedCount - 1)
+    appendRows("Feed.tbl", joinquerybtree.feedCols, [(1035,) + last[1:]])
+    try:
+        joinquerybtree.openIndex("Feed.idx", "Feed.tbl", \
+            joinquerybtree.feedCols)
+        feedIndex = joinquerybtree.openIndex("Feed.idx", "Feed.tbl", \
+            joinquerybtree.feedCols)[1]
+        if feedIndex.retrieve(joinquerybtree.Item(1035, None)).getValue() \
+            == 0:
+            print("Test 3 Passed")
+        else:
+            print("Test 3 Failed")
+    except ValueError as error:
+        print("Test 3 Failed with", error)
+
+    # A Bloom filter which gets full is rebuilt with room for more keys
+    appendRows("Feed.tbl", joinquerybtree.feedCols, \
+        [(5000 + i,) + last[1:] for i in range(feedCount)])
+    feedIndex = joinquerybtree.openIndex("Feed.idx", "Feed.tbl", \
+        joinquerybtree.feedCols)[1]
+    bloom = joinquerybtree.readIndex("Feed.idx")[1].bloom
+    if not bloom.isFull() and bloom.count == 2 * feedCount and \
+        feedIndex.retrieve(joinquerybtree.Item(5000 + feedCount - 1, \
+        None)).getValue() == 2 * feedCount:
+        print("Test 4 Passed")
+    else:
+        print("Test 4 Failed with", bloom)
+
+    # The index of a table which did not change is opened without reading
+    # the table
+    tableReader = tablereader.TableReader
+    tablereader.TableReader = None
+    try:
+        feedIndex = joinquerybtree.openIndex("Feed.idx", "Feed.tbl", \
+            joinquerybtree.feedCols)[1]
+        if feedIndex.retrieve(joinquerybtree.Item(1035, None)).getValue() \
+            == 0:
+            print("Test 5 Passed")
+        else:
+            print("Test 5 Failed")
+    except TypeError as error:
+        print("Test 5 Failed with", error)
+    finally:
+        tablereader.TableReader = tableReader
+
+if __name__ == "__main__":
+    main()
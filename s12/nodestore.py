@@ -0,0 +1,627 @@
+'''
+  File: nodestore.py
+  Description: This module provides the node stores used by the BTree class
+    in joinquerybtree.py. A node store maps node indices to BTreeNode
+    objects. Two stores are provided.
+
+    The MemoryNodeStore keeps every node in a dictionary. This is the
+    original behavior of the BTree class.
+
+    The FileNodeStore keeps every node in a fixed-size page of a single
+    file. The page of the node with index i starts at byte i*pageSize. Page
+    0 is the header page which holds the degree, page size, root index,
+    free index, the head of the free list and the node layout. Recycled
+    pages are linked together through the free list so they can be reused
+    by later splits. Nodes are read from the file on every access, so the
+    memory used by a tree stays bounded no matter how large the index
+    gets.
+
+    A FileNodeStore writes its nodes in one of two layouts, which is kept
+    in its header. The plain layout writes the items one after another.
+    The slotted layout is meant for nodes of Items with string keys, such
+    as names. The bytes all keys of a node start with are written once,
+    and each item is written as the rest of its key and its value. A slot
+    array after the children holds the position of each item in the page,
+    so a single item can be decoded without the items before it. The
+    retrieve method of a BTree searches a page with searchPage, which
+    binary searches the slots and decodes only the items it compares.
+
+    A plain page holds at most 2*degree items, and the degree of a new page
+    file can be derived from its page size and the longest key its Items
+    will have, as answered by pageDegree. A slotted page instead holds as
+    many items as fit in its bytes, so keys which share a prefix give a
+    node more items and the tree fewer levels. A store with the slotted
+    layout is sized: a BTree asks it for the size of a node with
+    nodeSize and splits the node when its page is full. The degree of a
+    slotted page file only bounds the number of slots. No item may take
+    more than 1/ITEM_SHARE of a page, so a full page always splits into
+    two pages which fit. A slotted page of a leaf has no child indices,
+    and one of an internal node only those of its items.
+
+    The functions packValue, unpackValue, packNode and unpackNode provide
+    the binary encoding of items and nodes, and packSlottedNode,
+    unpackSlottedNode, unpackSlot and searchSlots the slotted layout.
+    Items may be None, ints, floats, strings, bytes, datetimes, tuples of
+    these, posting lists, or Item objects.
+'''
+
+import datetime
+import os
+import struct
+
+import postings
+import schema
+
+MAGIC = b"BTPG"
+VERSION = 2
+HEADER = struct.Struct("<4sHIIIIIB")
+# Version 1 headers have no layout
+HEADER_V1 = struct.Struct("<4sHIIIII")
+NODE_HEADER = struct.Struct("<BH")
+# kind, number of keys, 1 if the keys are strings, prefix length
+SLOTTED_HEADER = struct.Struct("<BHBH")
+# The flags of a slotted node
+KEYED_NODE = 1
+LEAF_NODE = 2
+FREE_PAGE = struct.Struct("<BI")
+NODE_PAGE = 1
+FREED_PAGE = 2
+# Slotted pages of version 2 files hold 2*degree+1 child indices
+SLOTTED_PAGE_V2 = 3
+SLOTTED_PAGE = 4
+LAYOUTS = {"plain": NODE_PAGE, "slotted": SLOTTED_PAGE}
+INT32 = struct.Struct("<i")
+INT64 = struct.Struct("<q")
+FLOAT64 = struct.Struct("<d")
+LENGTH = struct.Struct("<H")
+# year, month, day, hour, minute, second and microsecond
+DATETIME = struct.Struct("<HBBBBBI")
+
+# The number of bytes of a page we expect each item to need when no page
+# size is given. Items with long string keys need a larger page size.
+ITEM_BUDGET = 32
+# The page size of a page file whose degree is derived from its key width
+PAGE_SIZE = 4096
+# The bytes of a record offset written by packValue
+OFFSET_WIDTH = 1 + INT32.size
+# The fewest bytes an Item takes in a slotted page: its slot, the length
+# of the rest of its key and a value of None
+SLOTTED_ITEM = LENGTH.size + LENGTH.size + 1
+# An item takes at most 1/ITEM_SHARE of a slotted page
+ITEM_SHARE = 4
+
+
+def packValue(value, out, itemClass = None):
+    ''' Append the binary encoding of value to the bytearray out. '''
+    if value is None:
+        out += b"N"
+    elif itemClass != None and isinstance(value, itemClass):
+        out += b"I"
+        packValue(value.getKey(), out, itemClass)
+        packValue(value.getValue(), out, itemClass)
+    elif isinstance(value, int):
+        # Most keys and offsets fit in 32 bits
+        if -2147483648 <= value <= 2147483647:
+            out += b"j"
+            out += INT32.pack(value)
+        else:
+            out += b"i"
+            out += INT64.pack(value)
+    elif isinstance(value, float):
+        out += b"f"
+        out += FLOAT64.pack(value)
+    elif isinstance(value, str):
+        data = value.encode("utf-8")
+        out += b"s"
+        out += LENGTH.pack(len(data))
+        out += data
+    elif isinstance(value, bytes):
+        out += b"b"
+        out += LENGTH.pack(len(value))
+        out += value
+    elif isinstance(value, datetime.datetime):
+        if value.tzinfo != None:
+            raise TypeError("Cannot store a datetime with a time zone")
+        out += b"d"
+        out += DATETIME.pack(value.year, value.month, value.day, value.hour, \
+            value.minute, value.second, value.microsecond)
+    elif isinstance(value, tuple):
+        out += b"t"
+        out += LENGTH.pack(len(value))
+        for element in value:
+            packValue(element, out, itemClass)
+    elif isinstance(value, postings.PostingList):
+        out += b"p"
+        postings.packPostings(value, out)
+    elif isinstance(value, schema.LazyDatetime):
+        packValue(value.value(), out, itemClass)
+    else:
+        raise TypeError("Cannot store a value of type " + type(value).__name__)
+
+
+def unpackValue(data, pos, itemClass = None):
+    ''' Decode the value starting at data[pos]. Answer a tuple of the
+      value and the position just after it.
+    '''
+    tag = data[pos:pos+1]
+    pos += 1
+    if tag == b"N":
+        return None, pos
+    if tag == b"j":
+        return INT32.unpack_from(data, pos)[0], pos + INT32.size
+    if tag == b"i":
+        return INT64.unpack_from(data, pos)[0], pos + INT64.size
+    if tag == b"f":
+        return FLOAT64.unpack_from(data, pos)[0], pos + FLOAT64.size
+    if tag == b"s" or tag == b"b":
+        size = LENGTH.unpack_from(data, pos)[0]
+        pos += LENGTH.size
+        value = bytes(data[pos:pos+size])
+        if tag == b"s":
+            value = value.decode("utf-8")
+        return value, pos + size
+    if tag == b"t":
+        size = LENGTH.unpack_from(data, pos)[0]
+        pos += LENGTH.size
+        elements = []
+        for i in range(size):
+            element, pos = unpackValue(data, pos, itemClass)
+            elements.append(element)
+        return tuple(elements), pos
+    if tag == b"d":
+        return datetime.datetime(*DATETIME.unpack_from(data, pos)), \
+            pos + DATETIME.size
+    if tag == b"p":
+        return postings.unpackPostings(data, pos)
+    if tag == b"I":
+        key, pos = unpackValue(data, pos, itemClass)
+        value, pos = unpackValue(data, pos, itemClass)
+        return itemClass(key, value), pos
+    raise ValueError("Corrupt value with tag " + repr(tag))
+
+
+def packNode(aNode, degree, itemClass = None):
+    ''' Answer the bytes encoding aNode. Only the live items are written.
+      A child index of 0 stands for None, since node indices start at 1.
+    '''
+    out = bytearray(NODE_HEADER.pack(NODE_PAGE, aNode.numberOfKeys))
+    children = [0 if c == None else c for c in aNode.child]
+    out += struct.pack("<%dI" % (2*degree+1), *children)
+    for i in range(aNode.numberOfKeys):
+        packValue(aNode.items[i], out, itemClass)
+    return out
+
+
+def unpackNode(data, degree, index, nodeClass, itemClass = None, pos = 0):
+    ''' Decode the node encoded at data[pos]. Answer a tuple of the node and
+      the position just after it.
+    '''
+    kind, numberOfKeys = NODE_HEADER.unpack_from(data, pos)
+    pos += NODE_HEADER.size
+    childCount = 2*degree+1
+    children = struct.unpack_from("<%dI" % childCount, data, pos)
+    pos += 4 * childCount
+    child = [None if c == 0 else c for c in children]
+    items = [None]*2*degree
+    for i in range(numberOfKeys):
+        items[i], pos = unpackValue(data, pos, itemClass)
+    return nodeClass(degree, numberOfKeys, items, child, index), pos
+
+
+def commonPrefix(first, last):
+    # Answer the bytes both first and last start with
+    size = min(len(first), len(last))
+    i = 0
+    while i < size and first[i] == last[i]:
+        i += 1
+    return first[:i]
+
+
+def packSlottedNode(aNode, degree, itemClass = None):
+    ''' Answer the bytes encoding aNode in the slotted layout. If all
+      items are Items with string keys, their common prefix is written
+      once and each item holds the rest of its key and its value.
+      Otherwise each item is written whole.
+    '''
+    n = aNode.numberOfKeys
+    items = aNode.items[:n]
+    leaf = aNode.child[0] == None
+    keys = None
+    if itemClass != None and n > 0 and all([isinstance(item, itemClass) \
+        and isinstance(item.getKey(), str) for item in items]):
+        keys = [item.getKey().encode("utf-8") for item in items]
+    # The keys are in order, so the first and last share the prefix of all
+    prefix = commonPrefix(keys[0], keys[-1]) if keys != None else b""
+
+    flags = (KEYED_NODE if keys != None else 0) | (LEAF_NODE if leaf else 0)
+    out = bytearray(SLOTTED_HEADER.pack(SLOTTED_PAGE, n, flags, \
+        len(prefix)))
+    out += prefix
+    if not leaf:
+        children = [0 if c == None else c for c in aNode.child[:n+1]]
+        out += struct.pack("<%dI" % (n+1), *children)
+    slotsAt = len(out)
+    out += bytes(LENGTH.size * n)
+    slots = []
+    for i in range(n):
+        if len(out) > 0xffff:
+            raise RuntimeError("A slotted node cannot be larger than " + \
+                "64 KB")
+        slots.append(len(out))
+        if keys != None:
+            suffix = keys[i][len(prefix):]
+            out += LENGTH.pack(len(suffix))
+            out += suffix
+            packValue(items[i].getValue(), out, itemClass)
+        else:
+            packValue(items[i], out, itemClass)
+    struct.pack_into("<%dH" % n, out, slotsAt, *slots)
+    return out
+
+
+def slottedHeader(data, degree):
+    ''' Answer a tuple of whether the keys of the slotted node encoded in
+      data are strings, the prefix of its keys, the positions of its
+      items and the number of its child indices, which follow the prefix.
+    '''
+    kind, n, flags, prefixLength = SLOTTED_HEADER.unpack_from(data, 0)
+    prefix = bytes(data[SLOTTED_HEADER.size:SLOTTED_HEADER.size+prefixLength])
+    if kind == SLOTTED_PAGE_V2:
+        childCount = 2*degree+1
+    elif flags & LEAF_NODE:
+        childCount = 0
+    else:
+        childCount = n+1
+    pos = SLOTTED_HEADER.size + prefixLength + 4*childCount
+    return flags & KEYED_NODE, prefix, \
+        struct.unpack_from("<%dH" % n, data, pos), childCount
+
+
+def unpackSlotAt(data, pos, keyed, prefix, itemClass = None):
+    # Decode the item at pos of a slotted node, as described by its header
+    if not keyed:
+        return unpackValue(data, pos, itemClass)[0]
+    size = LENGTH.unpack_from(data, pos)[0]
+    pos += LENGTH.size
+    key = (prefix + bytes(data[pos:pos+size])).decode("utf-8")
+    return itemClass(key, unpackValue(data, pos + size, itemClass)[0])
+
+
+def unpackSlot(data, degree, i, itemClass = None):
+    ''' Decode only item i of the slotted node encoded in data. '''
+    keyed, prefix, slots, childCount = slottedHeader(data, degree)
+    if not (0 <= i < len(slots)):
+        raise IndexError("Slot " + str(i) + " is not in the node")
+    return unpackSlotAt(data, slots[i], keyed, prefix, itemClass)
+
+
+def searchSlots(data, degree, anItem, itemClass = None):
+    ''' Search the slotted node encoded in data for anItem, as searchNode
+      of a BTreeNode does, decoding only the items compared. Answer a
+      tuple of the position where anItem is or would go, the matching
+      item or None, and the child at that position.
+    '''
+    keyed, prefix, slots, childCount = slottedHeader(data, degree)
+    lo = 0
+    hi = len(slots)
+    # The item at hi, the first not less than anItem found so far
+    item = None
+    while lo < hi:
+        mid = (lo + hi) // 2
+        candidate = unpackSlotAt(data, slots[mid], keyed, prefix, itemClass)
+        if candidate < anItem:
+            lo = mid + 1
+        else:
+            hi = mid
+            item = candidate
+    if item != None and not item == anItem:
+        item = None
+    if childCount == 0:
+        return lo, item, None
+    child = struct.unpack_from("<I", data, SLOTTED_HEADER.size + \
+        len(prefix) + 4*lo)[0]
+    return lo, item, None if child == 0 else child
+
+
+def unpackSlottedNode(data, degree, index, nodeClass, itemClass = None):
+    # Decode the node encoded in data in the slotted layout
+    keyed, prefix, slots, childCount = slottedHeader(data, degree)
+    pos = SLOTTED_HEADER.size + len(prefix)
+    children = struct.unpack_from("<%dI" % childCount, data, pos)
+    child = [None if c == 0 else c for c in children]
+    child += [None]*(2*degree+1 - childCount)
+    items = [None]*2*degree
+    for i in range(len(slots)):
+        items[i] = unpackSlotAt(data, slots[i], keyed, prefix, itemClass)
+    return nodeClass(degree, len(slots), items, child, index)
+
+
+def pageDegree(pageSize, keyWidth = None, layout = "plain", \
+    valueWidth = OFFSET_WIDTH):
+    ''' Answer the degree of a page file with pages of pageSize bytes in
+      the given layout, for Items whose keys are strings of at most
+      keyWidth bytes in UTF-8 and whose values take at most valueWidth
+      bytes in the encoding of packValue, as record offsets do. In the
+      plain layout it is the largest degree whose full nodes fit in a
+      page. A slotted page holds as many items as fit, so the degree only
+      bounds its slots, and the key width, if given, is only checked.
+    '''
+    if layout not in LAYOUTS:
+        raise ValueError("Unknown node layout " + repr(layout))
+    if layout == "slotted":
+        # A slot, the length of the rest of the key and a child index
+        itemSize = LENGTH.size + LENGTH.size + (keyWidth or 0) + \
+            valueWidth + 4
+        degree = (pageSize - SLOTTED_HEADER.size) // (2 * SLOTTED_ITEM)
+        if itemSize * ITEM_SHARE > pageSize - SLOTTED_HEADER.size - 4:
+            degree = 0
+    else:
+        # The tags of the Item and its key and the length of the key
+        itemSize = 2 + LENGTH.size + keyWidth + valueWidth
+        # Each item comes with a child index, and a node has one more child
+        degree = (pageSize - NODE_HEADER.size - 4) // (2 * (4 + itemSize))
+    if degree < 1:
+        raise ValueError("A page of " + str(pageSize) + " bytes cannot " + \
+            "hold a node of keys of " + str(keyWidth) + " bytes")
+    return degree
+
+
+def defaultPageSize(degree):
+    ''' Answer a page size large enough for a node of the given degree
+      whose items need no more than ITEM_BUDGET bytes each. Page sizes are
+      rounded up to a multiple of 512 bytes.
+    '''
+    size = NODE_HEADER.size + 4*(2*degree+1) + ITEM_BUDGET*2*degree
+    size = max(size, HEADER.size)
+    return (size + 511) // 512 * 512
+
+
+class MemoryNodeStore:
+    '''
+      A node store which keeps all nodes in a dictionary. Recycled node
+      indices are kept on a list so they can be handed out again. The
+      indices of the nodes written are kept in changed, so an index file
+      can be brought up to date by writing only those nodes.
+    '''
+    def __init__(self, nodes = None):
+        if nodes == None:
+            nodes = {}
+        self.nodes = nodes
+        self.changed = set()
+        self.freeList = []
+        self.rootIndex = None
+        self.freeIndex = None
+
+    def bind(self, nodeClass, itemClass):
+        # The memory store keeps node objects, so nothing is decoded.
+        pass
+
+    def read(self, index):
+        return self.nodes.get(index)
+
+    def pin(self, index):
+        # Nodes in memory are never evicted, so pins are ignored
+        pass
+
+    def unpin(self, index):
+        pass
+
+    def write(self, index, aNode):
+        self.nodes[index] = aNode
+        self.changed.add(index)
+
+    def recycle(self, index):
+        self.freeList.append(index)
+        self.changed.add(index)
+
+    def reuse(self):
+        ''' Answer a recycled node index, or None if there is none. '''
+        if len(self.freeList) == 0:
+            return None
+        return self.freeList.pop()
+
+    def freeIndices(self):
+        # Answer the recycled node indices
+        return list(self.freeList)
+
+    def setHeader(self, rootIndex, freeIndex):
+        pass
+
+    def commit(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class FileNodeStore:
+    '''
+      A node store which keeps every node in a fixed-size page of a single
+      file. If the file already exists, its header is read and the degree
+      and page size are taken from it. Otherwise a new file is created with
+      the given degree, page size and layout, "plain" or "slotted". If no
+      degree is given but keyWidth is, or the layout is slotted, the
+      degree is answered by pageDegree, and the page size defaults to
+      PAGE_SIZE. A store with the slotted layout is sized, and its nodes
+      are split by the BTree when their page is full.
+    '''
+    def __init__(self, fileName, degree = None, pageSize = None, \
+        layout = "plain", keyWidth = None):
+        self.fileName = fileName
+        self.nodeClass = None
+        self.itemClass = None
+
+        if os.path.isfile(fileName) and os.path.getsize(fileName) > 0:
+            self.file = open(fileName, "r+b")
+            self.readHeader()
+            if degree != None and degree != self.degree:
+                raise ValueError("The page file " + fileName + \
+                    " holds a tree of degree " + str(self.degree))
+        else:
+            if degree == None and (keyWidth != None or layout == "slotted"):
+                if pageSize == None:
+                    pageSize = PAGE_SIZE
+                degree = pageDegree(pageSize, keyWidth, layout)
+            if degree == None:
+                raise ValueError("A degree is needed to create " + fileName)
+            self.file = open(fileName, "w+b")
+            self.degree = degree
+            if pageSize == None:
+                pageSize = defaultPageSize(degree)
+            self.pageSize = pageSize
+            if layout not in LAYOUTS:
+                raise ValueError("Unknown node layout " + repr(layout))
+            self.nodeKind = LAYOUTS[layout]
+            self.sized = self.nodeKind == SLOTTED_PAGE
+            self.rootIndex = None
+            self.freeIndex = None
+            self.freeHead = 0
+            self.writeHeader()
+
+    def bind(self, nodeClass, itemClass):
+        ''' Set the classes used to decode nodes and items. The BTree
+          binds its classes when the store is attached to it.
+        '''
+        self.nodeClass = nodeClass
+        self.itemClass = itemClass
+
+    def readHeader(self):
+        self.file.seek(0)
+        data = self.file.read(HEADER.size)
+        magic, version = struct.unpack_from("<4sH", data)
+        if magic != MAGIC:
+            raise ValueError(self.fileName + " is not a BTree page file")
+        if version == 1:
+            magic, version, self.degree, self.pageSize, rootIndex, \
+                freeIndex, self.freeHead = HEADER_V1.unpack_from(data)
+            self.nodeKind = NODE_PAGE
+        elif version == VERSION:
+            magic, version, self.degree, self.pageSize, rootIndex, \
+                freeIndex, self.freeHead, self.nodeKind = \
+                HEADER.unpack_from(data)
+        else:
+            raise ValueError("Unsupported page file version " + str(version))
+        if self.nodeKind == SLOTTED_PAGE_V2:
+            self.nodeKind = SLOTTED_PAGE
+        self.sized = self.nodeKind == SLOTTED_PAGE
+        self.rootIndex = rootIndex if rootIndex != 0 else None
+        self.freeIndex = freeIndex if freeIndex != 0 else None
+
+    def writeHeader(self):
+        rootIndex = self.rootIndex if self.rootIndex != None else 0
+        freeIndex = self.freeIndex if self.freeIndex != None else 0
+        header = HEADER.pack(MAGIC, VERSION, self.degree, self.pageSize, \
+            rootIndex, freeIndex, self.freeHead, self.nodeKind)
+        self.file.seek(0)
+        self.file.write(header.ljust(self.pageSize, b"\0"))
+
+    def setHeader(self, rootIndex, freeIndex):
+        self.rootIndex = rootIndex
+        self.freeIndex = freeIndex
+
+    def commit(self):
+        # Pages are written in place, so there is nothing to commit
+        pass
+
+    def readPage(self, index):
+        self.file.seek(index * self.pageSize)
+        return self.file.read(self.pageSize)
+
+    def writePage(self, index, data):
+        if len(data) > self.pageSize:
+            raise RuntimeError("Node " + str(index) + " needs " + \
+                str(len(data)) + " bytes but the page size is " + \
+                str(self.pageSize))
+        self.file.seek(index * self.pageSize)
+        self.file.write(bytes(data).ljust(self.pageSize, b"\0"))
+
+    def read(self, index):
+        ''' Answer the node with the given index, or None if the page does
+          not exist or is on the free list.
+        '''
+        data = self.readPage(index)
+        if len(data) < NODE_HEADER.size:
+            return None
+        if data[0] == NODE_PAGE:
+            return unpackNode(data, self.degree, index, self.nodeClass, \
+                self.itemClass)[0]
+        if data[0] == SLOTTED_PAGE or data[0] == SLOTTED_PAGE_V2:
+            return unpackSlottedNode(data, self.degree, index, \
+                self.nodeClass, self.itemClass)
+        return None
+
+    def searchPage(self, index, anItem):
+        ''' Search the node with the given index for anItem. Answer a tuple
+          of the position where anItem is or would go, the matching item
+          or None, and the child at that position. Only the items of a
+          slotted page which are compared are decoded.
+        '''
+        data = self.readPage(index)
+        if data[0] == SLOTTED_PAGE or data[0] == SLOTTED_PAGE_V2:
+            return searchSlots(data, self.degree, anItem, self.itemClass)
+        node = unpackNode(data, self.degree, index, self.nodeClass, \
+            self.itemClass)[0]
+        result = node.searchNode(anItem)
+        i = result['nodeIndex']
+        return i, node.items[i] if result['found'] else None, \
+            node.getChild(i)
+
+    def pack(self, aNode):
+        # Answer the bytes of aNode in the layout of the store
+        if self.nodeKind == SLOTTED_PAGE:
+            return packSlottedNode(aNode, self.degree, self.itemClass)
+        return packNode(aNode, self.degree, self.itemClass)
+
+    def nodeSize(self, aNode):
+        ''' Answer the number of bytes aNode takes in a page. A BTree
+          compares it with pageSize to tell whether the node fits.
+        '''
+        return len(self.pack(aNode))
+
+    def write(self, index, aNode):
+        self.writePage(index, self.pack(aNode))
+
+    def pin(self, index):
+        # Nodes are not cached, so pins are ignored
+        pass
+
+    def unpin(self, index):
+        pass
+
+    def recycle(self, index):
+        ''' Put the page of the given index at the front of the free list. '''
+        self.writePage(index, FREE_PAGE.pack(FREED_PAGE, self.freeHead))
+        self.freeHead = index
+
+    def reuse(self):
+        ''' Answer a page index from the free list, or None if the free
+          list is empty.
+        '''
+        if self.freeHead == 0:
+            return None
+        index = self.freeHead
+        self.freeHead = FREE_PAGE.unpack_from(self.readPage(index))[1]
+        return index
+
+    def freeIndices(self):
+        # Answer the page indices on the free list
+        indices = []
+        index = self.freeHead
+        while index != 0:
+            indices.append(index)
+            index = FREE_PAGE.unpack_from(self.readPage(index))[1]
+        return indices
+
+    def flush(self):
+        ''' Write the header and push all buffered pages to the file. '''
+        self.writeHeader()
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
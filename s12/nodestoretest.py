@@ -0,0 +1,123 @@
+import os
+import random
+import shutil
+import tempfile
+
+import nodestore
+from joinquerybtree import BTree, Item
+
+def feedKey(number):
+    return "MasterFeed%07d" % number
+
+def checkTree(aTree):
+    # Answer the items of aTree in order, or None if a page is over full,
+    # the items are out of order or the leaves are not at one depth
+    store = aTree.store
+    items = []
+    depths = set()
+    stack = [(aTree.rootIndex, 0)]
+    while len(stack) > 0:
+        index, depth = stack.pop()
+        if isinstance(index, Item):
+            items.append(index)
+            continue
+        node = store.read(index)
+        if store.nodeSize(node) > store.pageSize:
+            return None
+        n = node.getNumberOfKeys()
+        if node.isLeaf():
+            depths.add(depth)
+            items.extend(node.items[:n])
+            continue
+        stack.append((node.getChild(n), depth + 1))
+        for i in range(n - 1, -1, -1):
+            stack.append((node.items[i], depth + 1))
+            stack.append((node.getChild(i), depth + 1))
+    if len(depths) > 1 or items != sorted(items):
+        return None
+    return items
+
+def main():
+    # The page files are written to a temporary directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)
+    try:
+        tests()
+    finally:
+        os.chdir(here)
+        shutil.rmtree(directory)
+
+def tests():
+    # A slotted page holds more keys with a shared prefix than a plain
+    # page, so the same keys give a lower tree
+    keys = [feedKey(i) for i in range(20000)]
+    shapes = {}
+    for layout in ["plain", "slotted"]:
+        store = nodestore.FileNodeStore(layout + ".pages", layout = layout, \
+            keyWidth = len(keys[0]))
+        aTree = BTree.fromSorted((Item(key, i) for i, key in \
+            enumerate(keys)), store.degree, store = store)
+        statistics = aTree.statistics()
+        shapes[layout] = (statistics["height"], statistics["nodes"])
+        aTree.close()
+    if shapes["slotted"][0] < shapes["plain"][0] and \
+        shapes["slotted"][1] < shapes["plain"][1]:
+        print("Test 1 Passed")
+    else:
+        print("Test 1 Failed with", shapes)
+
+    # Nodes of a slotted store are split and merged by their size, and
+    # every page holds its node after inserts, deletes and updates with
+    # keys and values of different lengths
+    store = nodestore.FileNodeStore("sized.pages", pageSize = 512, \
+        layout = "slotted")
+    aTree = BTree(store.degree, store = store)
+    generator = random.Random(18)
+    expected = {}
+    for step in range(4000):
+        number = generator.randrange(1500)
+        key = feedKey(number) + "z" * (number % 13)
+        choice = generator.random()
+        if choice < 0.5:
+            if aTree.insert(Item(key, number)) != None:
+                expected[key] = number
+        elif choice < 0.85:
+            aTree.delete(Item(key, None))
+            expected.pop(key, None)
+        elif aTree.update(Item(key, "v" * generator.randrange(40))) != None:
+            expected[key] = aTree.retrieve(Item(key, None)).getValue()
+    items = checkTree(aTree)
+    if items != None and \
+        [(item.key, item.value) for item in items] == sorted(expected.items()):
+        print("Test 2 Passed")
+    else:
+        print("Test 2 Failed")
+
+    # An item which leaves too little room in a page is rejected and the
+    # tree is left as it was
+    try:
+        aTree.insert(Item("x" * 200, 1))
+        print("Test 3 Failed")
+    except ValueError as error:
+        if aTree.retrieve(Item("x" * 200, None)) == None and \
+            len(checkTree(aTree)) == len(expected):
+            print("Test 3 Passed")
+        else:
+            print("Test 3 Failed with", error)
+
+    # The layout and degree are read back when the store is opened again
+    degree = store.degree
+    aTree.close()
+    store = nodestore.FileNodeStore("sized.pages")
+    aTree = BTree(store.degree, store = store)
+    key = sorted(expected)[len(expected) // 2]
+    if store.sized and store.degree == degree and \
+        aTree.retrieve(Item(key, None)).getValue() == expected[key]:
+        print("Test 4 Passed")
+    else:
+        print("Test 4 Failed")
+    aTree.close()
+
+if __name__ == "__main__":
+    main()
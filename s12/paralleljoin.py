@@ -0,0 +1,153 @@
+'''
+  File: paralleljoin.py
+  Description: This module runs the index join of joinquerybtree on several
+    processes. FeedAttribute.tbl is fixed-width, so record i starts at byte
+    i times the record length and the table can be cut into ranges of
+    whole records. Each range is a task.
+
+    A worker process reads Feed.idx and FeedAttribType.idx once and then
+    joins the tasks it is sent with joinquerybtree.indexJoinRows. The
+    tables are memory-mapped read-only by every worker, so their pages are
+    shared through the page cache. The workers answer the rows of a task
+    as one message.
+
+    The rows come out in the order of FeedAttribute.tbl when ordered is
+    True, and in the order the tasks finish otherwise. A worker is sent
+    its next task before the rows of its last task are handed on, so the
+    workers keep working while the rows are written.
+
+    The workers are driven through pipes of the multiprocessing module.
+    multiprocessing.Pool is not used, because it imports the standard
+    queue module, which is hidden by queue.py in this directory.
+'''
+
+import datetime
+import multiprocessing
+import multiprocessing.connection
+import os
+import traceback
+
+import joinquerybtree
+import resultsink
+import tablereader
+
+# The number of FeedAttribute records joined by one task
+TASK_RECORDS = 50000
+
+
+def recordRanges(count, taskRecords = TASK_RECORDS):
+    ''' Answer the list of (first, end) record ranges cutting count records
+      into ranges of at most taskRecords records.
+    '''
+    if taskRecords < 1:
+        raise ValueError("A task must hold at least 1 record")
+    return [(first, min(first + taskRecords, count)) \
+        for first in range(0, count, taskRecords)]
+
+
+def worker(connection):
+    # Join the record ranges sent on connection until None is sent
+    try:
+        feedIndex = joinquerybtree.readIndex("Feed.idx")[1]
+        attribTypeIndex = joinquerybtree.readIndex("FeedAttribType.idx")[1]
+        task = connection.recv()
+        while task != None:
+            first, end = task
+            connection.send((True, list(joinquerybtree.indexJoinRows( \
+                feedIndex, attribTypeIndex, first, end))))
+            task = connection.recv()
+    except EOFError:
+        pass
+    except Exception:
+        connection.send((False, traceback.format_exc()))
+    finally:
+        connection.close()
+
+
+def parallelJoinRows(processes = None, ordered = True, \
+    taskRecords = TASK_RECORDS):
+    ''' Answer the rows (FeedNum, Feed Name, FeedAttribType Name, Value) of
+      the Feed query, joined by processes worker processes, or by one per
+      CPU if processes is None. The index files must exist.
+    '''
+    with tablereader.TableReader("FeedAttribute.tbl", \
+        joinquerybtree.feedAttributeCols) as feedAttributeTable:
+        count = len(feedAttributeTable)
+    tasks = recordRanges(count, taskRecords)
+    if processes == None:
+        processes = os.cpu_count() or 1
+    processes = min(processes, len(tasks))
+
+    workers = []
+    # The task number each connection is working on
+    busy = {}
+    nextTask = 0
+    try:
+        for i in range(processes):
+            connection, workerConnection = multiprocessing.Pipe()
+            process = multiprocessing.Process(target = worker, \
+                args = (workerConnection,), daemon = True)
+            process.start()
+            workerConnection.close()
+            workers.append((process, connection))
+            connection.send(tasks[nextTask])
+            busy[connection] = nextTask
+            nextTask += 1
+
+        # Finished tasks waiting for an earlier task when ordered is True
+        finished = {}
+        nextRows = 0
+        while len(busy) > 0:
+            for connection in multiprocessing.connection.wait(list(busy)):
+                taskNum = busy.pop(connection)
+                try:
+                    ok, rows = connection.recv()
+                except EOFError:
+                    raise RuntimeError("A join worker exited while joining" + \
+                        " records " + repr(tasks[taskNum]))
+                if not ok:
+                    raise RuntimeError("A join worker failed:\n" + rows)
+
+                if nextTask < len(tasks):
+                    connection.send(tasks[nextTask])
+                    busy[connection] = nextTask
+                    nextTask += 1
+
+                if not ordered:
+                    yield from rows
+                    continue
+                finished[taskNum] = rows
+                while nextRows in finished:
+                    yield from finished.pop(nextRows)
+                    nextRows += 1
+    finally:
+        for process, connection in workers:
+            try:
+                connection.send(None)
+            except OSError:
+                pass
+            connection.close()
+        for process, connection in workers:
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+
+
+def main(processes = None, ordered = True, outputFormat = "text"):
+    # The indexes are built by the parent, so the workers only read them
+    joinquerybtree.openIndex("Feed.idx", "Feed.tbl", joinquerybtree.feedCols)
+    joinquerybtree.openIndex("FeedAttribType.idx", "FeedAttribType.tbl", \
+        joinquerybtree.attribTypeCols)
+
+    before = datetime.datetime.now()
+    resultsink.writeRows(parallelJoinRows(processes, ordered), \
+        outputFormat = outputFormat)
+    after = datetime.datetime.now()
+    deltaT = after - before
+    milliseconds = deltaT.total_seconds() * 1000
+    print("Done. The total time for the parallel query was", milliseconds, \
+        "milliseconds.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+'''
+  File: postings.py
+  Description: This module provides the PostingList class used by the
+    non-unique indexes of the BTree class in joinquerybtree.py. In a
+    non-unique index every key is stored once, and the value of its item is
+    a PostingList holding the record offsets of all the records with that
+    key. A lookup then answers every matching offset with a single descent
+    of the tree.
+
+    A posting list keeps its offsets sorted in an array of 64 bit integers
+    instead of a list of int objects. In a node page the offsets are stored
+    as the differences between neighbouring offsets, each as a variable
+    length integer of 7 bits per byte, so the offsets of records stored
+    close together take a byte each.
+
+    Posting lists are kept inline in their node and have no overflow
+    pages. In a page file a BTree rejects an offset, with a ValueError,
+    when the posting list of its key would no longer fit in a page.
+'''
+
+import array
+import bisect
+import struct
+
+COUNT = struct.Struct("<I")
+
+
+class PostingList:
+    def __init__(self, offsets = ()):
+        ''' Create a posting list holding the record offsets offsets. '''
+        self.offsets = array.array("q", sorted(set(offsets)))
+
+    def __repr__(self):
+        return "PostingList(" + repr(self.offsets.tolist()) + ")"
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __iter__(self):
+        return iter(self.offsets)
+
+    def __contains__(self, offset):
+        i = bisect.bisect_left(self.offsets, offset)
+        return i < len(self.offsets) and self.offsets[i] == offset
+
+    def __eq__(self, other):
+        if type(self) != type(other):
+            return False
+        return self.offsets == other.offsets
+
+    def add(self, offset):
+        ''' Add offset to the posting list. Answer False if it was already
+          there.
+        '''
+        i = bisect.bisect_left(self.offsets, offset)
+        if i < len(self.offsets) and self.offsets[i] == offset:
+            return False
+        self.offsets.insert(i, offset)
+        return True
+
+    def remove(self, offset):
+        ''' Remove offset from the posting list. Answer False if it was
+          not there.
+        '''
+        i = bisect.bisect_left(self.offsets, offset)
+        if i == len(self.offsets) or self.offsets[i] != offset:
+            return False
+        del self.offsets[i]
+        return True
+
+    def getOffsets(self):
+        return self.offsets.tolist()
+
+
+def packPostings(postings, out):
+    ''' Append the count and the delta encoded offsets of the PostingList
+      postings to the bytearray out.
+    '''
+    out += COUNT.pack(len(postings.offsets))
+    previous = 0
+    for offset in postings.offsets:
+        if offset < 0:
+            raise ValueError("A posting list cannot hold the negative " + \
+                "offset " + str(offset))
+        delta = offset - previous
+        previous = offset
+        while delta >= 0x80:
+            out.append((delta & 0x7f) | 0x80)
+            delta >>= 7
+        out.append(delta)
+
+
+def unpackPostings(data, pos):
+    ''' Decode the posting list starting at data[pos]. Answer a tuple of
+      the PostingList and the position just after it.
+    '''
+    count = COUNT.unpack_from(data, pos)[0]
+    pos += COUNT.size
+    offsets = array.array("q")
+    previous = 0
+    for i in range(count):
+        delta = 0
+        shift = 0
+        byte = data[pos]
+        while byte & 0x80:
+            delta |= (byte & 0x7f) << shift
+            shift += 7
+            pos += 1
+            byte = data[pos]
+        delta |= byte << shift
+        pos += 1
+        previous += delta
+        offsets.append(previous)
+    postings = PostingList()
+    postings.offsets = offsets
+    return postings, pos
+
+
+def groupPostings(items):
+    ''' Answer one item per key for items sorted by key, whose values are
+      record offsets. The value of each answered item is the PostingList
+      of the offsets of the items with that key. The answered items have
+      the class of the given items.
+    '''
+    key = None
+    offsets = []
+    itemClass = None
+    for item in items:
+        if itemClass != None and item.getKey() != key:
+            yield itemClass(key, PostingList(offsets))
+            offsets = []
+        itemClass = type(item)
+        key = item.getKey()
+        offsets.append(item.getValue())
+    if itemClass != None:
+        yield itemClass(key, PostingList(offsets))
@@ -0,0 +1,79 @@
+import os
+import shutil
+import tempfile
+
+import nodestore
+import postings
+from joinquerybtree import BTree, Item
+
+def main():
+    # The page files are written to a temporary directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)
+    try:
+        tests()
+    finally:
+        os.chdir(here)
+        shutil.rmtree(directory)
+
+def tests():
+    # Every offset of a key is answered in order, and offsets which are
+    # already there are not added again
+    index = BTree(2)
+    for offset in [70, 10, 40, 10]:
+        index.insertPosting(Item(1035, offset))
+    for feedID in range(20):
+        index.insertPosting(Item(feedID, feedID))
+    if index.retrievePostings(Item(1035, None)) == [10, 40, 70] and \
+        index.retrievePostings(Item(999, None)) == []:
+        print("Test 1 Passed")
+    else:
+        print("Test 1 Failed with", index.retrievePostings(Item(1035, None)))
+
+    # A posting list is packed as deltas and read back unchanged
+    postingList = postings.PostingList([5, 2 ** 40, 0, 130, 131])
+    data = bytearray()
+    postings.packPostings(postingList, data)
+    if postings.unpackPostings(bytes(data), 0) == (postingList, len(data)):
+        print("Test 2 Passed")
+    else:
+        print("Test 2 Failed with", postings.unpackPostings(bytes(data), 0))
+
+    # A posting list which would no longer fit in a page is rejected and
+    # the offsets already indexed are kept, in both layouts
+    passed = True
+    for layout in ["plain", "slotted"]:
+        store = nodestore.FileNodeStore(layout + ".pages", 3, 512, layout)
+        index = BTree(store.degree, store = store)
+        for offset in range(200):
+            index.insertPosting(Item(offset % 20, offset))
+        count = None
+        try:
+            for offset in range(200, 100000):
+                index.insertPosting(Item(5, offset * 1000))
+        except ValueError:
+            count = len(index.retrievePostings(Item(5, None)))
+        index.close()
+        store = nodestore.FileNodeStore(layout + ".pages")
+        index = BTree(store.degree, store = store)
+        if count == None or count < 10 or \
+            len(index.retrievePostings(Item(5, None))) != count:
+            print("Test 3 Failed in the", layout, "layout with", count)
+            passed = False
+        index.close()
+    if passed:
+        print("Test 3 Passed")
+
+    # A bulk loaded key with too many offsets for a page is rejected
+    store = nodestore.FileNodeStore("bulk.pages", 3, 512, "slotted")
+    try:
+        BTree.bulkLoadPostings([Item(1035, offset * 1000) for offset in \
+            range(5000)], store.degree, store = store)
+        print("Test 4 Failed")
+    except ValueError:
+        print("Test 4 Passed")
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+'''
+  File: resultsink.py
+  Description: This module writes the rows of a query result in large
+    buffered batches instead of calling print once per row. Rows come from
+    any iterable, usually a generator, and are encoded batchRows rows at a
+    time by an output format, then written to a binary file with a single
+    write per batch.
+
+    Three formats are provided and more can be added to FORMATS.
+
+    The text format writes the values of a row separated by spaces, as
+    print does, so its output matches joinoutput.txt.
+
+    The csv format writes comma separated values with the csv module.
+
+    The binary format starts with the magic number ROWS and a version.
+    Each row is written as its number of values followed by the values in
+    the encoding of nodestore.packValue. The readBinaryRows function reads
+    such a file back.
+
+    Rows read with lazy datetimes, as from a TableReader with lazyDatetimes
+    set, are written by every format as the rows with their datetimes.
+'''
+
+import csv
+import io
+import struct
+import sys
+
+import nodestore
+
+BATCH_ROWS = 4096
+BINARY_MAGIC = b"ROWS"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("<4sH")
+
+
+class TextFormat:
+    def header(self):
+        return b""
+
+    def encode(self, rows):
+        # Encode a batch of rows as print would write them
+        lines = [" ".join([str(value) for value in row]) for row in rows]
+        lines.append("")
+        return "\n".join(lines).encode("utf-8")
+
+
+class CsvFormat:
+    def header(self):
+        return b""
+
+    def encode(self, rows):
+        text = io.StringIO()
+        csv.writer(text, lineterminator = "\n").writerows(rows)
+        return text.getvalue().encode("utf-8")
+
+
+class BinaryFormat:
+    def header(self):
+        return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION)
+
+    def encode(self, rows):
+        out = bytearray()
+        for row in rows:
+            out += nodestore.LENGTH.pack(len(row))
+            for value in row:
+                nodestore.packValue(value, out)
+        return out
+
+
+FORMATS = {"text": TextFormat, "csv": CsvFormat, "binary": BinaryFormat}
+
+
+class ResultSink:
+    def __init__(self, aFile = None, outputFormat = "text", \
+        batchRows = BATCH_ROWS):
+        ''' Create a sink writing to the binary file aFile in the named
+          output format. If aFile is None, the rows go to standard output.
+        '''
+        if outputFormat not in FORMATS:
+            raise ValueError("Unknown output format " + repr(outputFormat))
+        if aFile == None:
+            # Text printed before the rows must come out first
+            sys.stdout.flush()
+            aFile = sys.stdout.buffer
+        self.file = aFile
+        self.format = FORMATS[outputFormat]()
+        self.batchRows = batchRows
+        self.batch = []
+        self.count = 0
+        self.file.write(self.format.header())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.flush()
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batchRows:
+            self.writeBatch()
+
+    def writeAll(self, rows):
+        for row in rows:
+            self.batch.append(row)
+            if len(self.batch) >= self.batchRows:
+                self.writeBatch()
+
+    def writeBatch(self):
+        if len(self.batch) > 0:
+            self.file.write(self.format.encode(self.batch))
+            self.count += len(self.batch)
+            self.batch = []
+
+    def flush(self):
+        # Write the rows still in the batch and flush the file
+        self.writeBatch()
+        self.file.flush()
+
+
+def writeRows(rows, aFile = None, outputFormat = "text", \
+    batchRows = BATCH_ROWS):
+    ''' Write all rows to aFile, or to standard output if aFile is None.
+      Answer the number of rows written.
+    '''
+    sink = ResultSink(aFile, outputFormat, batchRows)
+    sink.writeAll(rows)
+    sink.flush()
+    return sink.count
+
+
+def readBinaryRows(aFile):
+    ''' Answer the rows of a file written in the binary format as tuples,
+      one at a time.
+    '''
+    data = aFile.read()
+    magic, version = BINARY_HEADER.unpack_from(data, 0)
+    if magic != BINARY_MAGIC:
+        raise ValueError("Not a binary row file")
+    if version != BINARY_VERSION:
+        raise ValueError("Unsupported binary row version " + str(version))
+    pos = BINARY_HEADER.size
+    while pos < len(data):
+        size = nodestore.LENGTH.unpack_from(data, pos)[0]
+        pos += nodestore.LENGTH.size
+        row = []
+        for i in range(size):
+            value, pos = nodestore.unpackValue(data, pos)
+            row.append(value)
+        yield tuple(row)
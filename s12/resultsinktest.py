@@ -0,0 +1,66 @@
+import copy
+import datetime
+import io
+import pickle
+
+import joinquerybtree
+import resultsink
+import schema
+import tablereader
+
+def feedRows(lazyDatetimes):
+    with tablereader.TableReader("Feed.tbl", joinquerybtree.feedCols, \
+        lazyDatetimes) as feedTable:
+        return [feedTable.decode(recNum) for recNum in range(len(feedTable))]
+
+def written(rows, outputFormat):
+    out = io.BytesIO()
+    resultsink.writeRows(rows, out, outputFormat)
+    return out.getvalue()
+
+def main():
+    # Rows with lazy datetimes are written as rows with datetimes are
+    rows = feedRows(False)
+    lazyRows = feedRows(True)
+    testNum = 0
+    for outputFormat in sorted(resultsink.FORMATS):
+        testNum += 1
+        try:
+            if written(lazyRows, outputFormat) == written(rows, outputFormat):
+                print("Test", testNum, "Passed")
+            else:
+                print("Test", testNum, "Failed with the", outputFormat, \
+                    "format")
+        except TypeError as error:
+            print("Test", testNum, "Failed with", error)
+
+    testNum += 1
+    out = io.BytesIO(written(lazyRows, "binary"))
+    readRows = list(resultsink.readBinaryRows(out))
+    if readRows == rows and type(readRows[0][4]) == datetime.datetime:
+        print("Test", testNum, "Passed")
+    else:
+        print("Test", testNum, "Failed")
+
+    # A lazy datetime computes, copies and pickles as its datetime
+    testNum += 1
+    lazy = lazyRows[0][4]
+    value = rows[0][4]
+    day = datetime.timedelta(days = 1)
+    try:
+        if type(lazy) == schema.LazyDatetime and lazy.value() == value \
+            and lazy - value == datetime.timedelta() and value - lazy == \
+            datetime.timedelta() and type(lazy + day) == datetime.datetime \
+            and lazy + day == value + day and lazy - day == value - day \
+            and pickle.loads(pickle.dumps(lazy)) == value and \
+            copy.deepcopy(lazy) == value and \
+            schema.formatField("datetime", 24, lazy) == \
+            schema.formatField("datetime", 24, value):
+            print("Test", testNum, "Passed")
+        else:
+            print("Test", testNum, "Failed")
+    except (AttributeError, TypeError) as error:
+        print("Test", testNum, "Failed with", error)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,323 @@
+'''
+  File: schema.py
+  Description: This module provides the Schema class for the fixed-width
+    .tbl files used by the join queries. A schema is compiled once from a
+    column list such as
+
+        feedCols = ["int","int","int","char50","datetime","float","float",
+            "int","char50","int"]
+
+    The offset, width and converter of every column are computed when the
+    schema is compiled. Decoding a field is then a slice and a call of its
+    converter, so no type strings are parsed per record. Records may be
+    strings, bytes or memoryview slices of a memory-mapped table. A field
+    holding null decodes to None, and char fields have their enclosing
+    quotes removed.
+
+    The compileSchema function answers the compiled schema for a column
+    list, compiling each distinct column list only once.
+
+    Datetime fields are parsed by hand for the fixed format of the tables
+    instead of with strptime, which is many times slower. A field which
+    does not have the expected shape is left to strptime. The tables
+    repeat a small number of datetimes, so the datetimes are also kept in
+    a cache of the most recently decoded fields, keyed by the raw field.
+
+    A schema compiled with lazyDatetimes set decodes the datetime fields of
+    a whole record, as decode does, to LazyDatetime objects, which parse
+    their field only when their value is used. Fields decoded by field or
+    by a projection are always decoded at once, so a scan pays for the
+    datetimes it projects and not for the others.
+'''
+
+import datetime
+import functools
+
+WIDTHS = {"int": 10, "float": 20, "datetime": 24}
+DATETIME_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+# The number of distinct datetime fields kept decoded
+DATETIME_CACHE = 4096
+
+
+def isNull(value):
+    return value == "null" or value == b"null"
+
+
+def strip(value):
+    # Only the field is copied out of a memoryview record
+    if type(value) == memoryview:
+        value = value.tobytes()
+    return value.strip()
+
+
+def convertInt(value):
+    value = strip(value)
+    if isNull(value):
+        return None
+    return int(value)
+
+
+def convertFloat(value):
+    value = strip(value)
+    if isNull(value):
+        return None
+    return float(value)
+
+
+def convertChar(value):
+    value = strip(value)
+    if isNull(value):
+        return None
+    value = value[1:-1] # remove the ' and ' from each end of the string
+    if type(value) == bytes:
+        value = value.decode("utf-8")
+    return value
+
+
+def parseDatetime(value):
+    ''' Answer the datetime of the bytes value, such as
+      b"9/30/2004 12:00:00 AM", in the format DATETIME_FORMAT.
+    '''
+    parts = value.split()
+    if len(parts) == 3:
+        date = parts[0].split(b"/")
+        time = parts[1].split(b":")
+        half = parts[2].upper()
+        if len(date) == 3 and len(time) == 3 and \
+            (half == b"AM" or half == b"PM") and \
+            all([part.isdigit() for part in date + time]):
+            hour = int(time[0])
+            if 1 <= hour <= 12:
+                # 12 AM is midnight and 12 PM is noon
+                if half == b"AM":
+                    hour = 0 if hour == 12 else hour
+                elif hour != 12:
+                    hour += 12
+                return datetime.datetime(int(date[2]), int(date[0]), \
+                    int(date[1]), hour, int(time[1]), int(time[2]))
+    return datetime.datetime.strptime(value.decode("utf-8"), DATETIME_FORMAT)
+
+
+@functools.lru_cache(maxsize = DATETIME_CACHE)
+def decodeDatetime(field):
+    # Answer the datetime of the raw bytes field, or None if it is null.
+    # A datetime cannot be changed, so one can be shared by many rows.
+    value = field.strip()
+    if isNull(value):
+        return None
+    return parseDatetime(value)
+
+
+def convertDatetime(value):
+    if type(value) == memoryview:
+        value = value.tobytes()
+    elif type(value) == str:
+        value = value.encode("utf-8")
+    return decodeDatetime(value)
+
+
+class LazyDatetime:
+    '''
+      A datetime field which is decoded when its value is first used. It
+      compares, hashes and prints as its value, and adds and subtracts as
+      its value does, answering datetimes. It is not a datetime itself:
+      the value method answers the datetime, and valueOf answers the value
+      of any field. The formats of resultsink, formatField and
+      nodestore.packValue write its value.
+    '''
+    __slots__ = ("field", "decoded")
+
+    def __init__(self, field):
+        self.field = field
+        self.decoded = None
+
+    def value(self):
+        if self.decoded == None:
+            self.decoded = decodeDatetime(self.field)
+        return self.decoded
+
+    def __repr__(self):
+        return repr(self.value())
+
+    def __str__(self):
+        return str(self.value())
+
+    def __add__(self, other):
+        return self.value() + valueOf(other)
+
+    def __radd__(self, other):
+        return valueOf(other) + self.value()
+
+    def __sub__(self, other):
+        return self.value() - valueOf(other)
+
+    def __rsub__(self, other):
+        return valueOf(other) - self.value()
+
+    def __hash__(self):
+        return hash(self.value())
+
+    def __eq__(self, other):
+        return self.value() == valueOf(other)
+
+    def __ne__(self, other):
+        return self.value() != valueOf(other)
+
+    def __lt__(self, other):
+        return self.value() < valueOf(other)
+
+    def __le__(self, other):
+        return self.value() <= valueOf(other)
+
+    def __gt__(self, other):
+        return self.value() > valueOf(other)
+
+    def __ge__(self, other):
+        return self.value() >= valueOf(other)
+
+
+def valueOf(value):
+    if type(value) == LazyDatetime:
+        return value.value()
+    return value
+
+
+def convertLazyDatetime(value):
+    ''' Answer a LazyDatetime of the field value, or None if it is null.
+      Only the field is copied, so no slice of a mapped table is kept.
+    '''
+    if type(value) == memoryview:
+        value = value.tobytes()
+    elif type(value) == str:
+        value = value.encode("utf-8")
+    if isNull(value.strip()):
+        return None
+    return LazyDatetime(value)
+
+
+def formatField(colType, width, value):
+    # Answer value as a field of the given type and width
+    if value is None:
+        text = "null"
+        if colType[:4] == "char":
+            return text.ljust(width)
+    elif colType == "int":
+        text = str(value)
+    elif colType == "float":
+        text = "%f" % value
+    elif colType == "datetime":
+        value = valueOf(value)
+        hour = value.hour % 12
+        if hour == 0:
+            hour = 12
+        text = "%d/%d/%d %d:%02d:%02d %s" % (value.month, value.day, \
+            value.year, hour, value.minute, value.second, \
+            "AM" if value.hour < 12 else "PM")
+        return text.ljust(width)
+    else:
+        return ("'" + value + "'").ljust(width)
+    return text.rjust(width)
+
+
+def columnWidth(colType):
+    # Answer the number of characters of a column of type colType
+    if colType in WIDTHS:
+        return WIDTHS[colType]
+    if colType[:4] == "char":
+        return int(colType[4:])
+    raise ValueError("Unrecognized Type " + repr(colType))
+
+
+def columnConverter(colType):
+    if colType == "int":
+        return convertInt
+    if colType == "float":
+        return convertFloat
+    if colType == "datetime":
+        return convertDatetime
+    if colType[:4] == "char":
+        return convertChar
+    raise ValueError("Unrecognized Type " + repr(colType))
+
+
+class Schema:
+    def __init__(self, colTypes, lazyDatetimes = False):
+        ''' Compile the column list colTypes. If lazyDatetimes is True,
+          decode answers LazyDatetime objects for datetime fields.
+        '''
+        self.colTypes = list(colTypes)
+        self.lazyDatetimes = lazyDatetimes
+        self.offsets = []
+        self.widths = []
+        self.converters = []
+        offset = 0
+        for colType in self.colTypes:
+            width = columnWidth(colType)
+            self.offsets.append(offset)
+            self.widths.append(width)
+            self.converters.append(columnConverter(colType))
+            offset += width
+        # The size of a record without its line end
+        self.recordSize = offset
+        self.fields = [(self.offsets[i], self.offsets[i] + self.widths[i], \
+            self.converters[i]) for i in range(len(self.colTypes))]
+        # The fields as decode decodes them
+        self.recordFields = self.fields
+        if lazyDatetimes:
+            self.recordFields = [(start, end, convertLazyDatetime \
+                if convert == convertDatetime else convert) \
+                for start, end, convert in self.fields]
+
+    def __repr__(self):
+        if self.lazyDatetimes:
+            return "Schema(" + repr(self.colTypes) + ",lazyDatetimes=True)"
+        return "Schema(" + repr(self.colTypes) + ")"
+
+    def __len__(self):
+        return len(self.colTypes)
+
+    def field(self, record, fieldNum):
+        ''' Answer the value of field fieldNum of record. fieldNum is zero
+          based.
+        '''
+        start, end, convert = self.fields[fieldNum]
+        return convert(record[start:end])
+
+    def decode(self, record):
+        # Answer a tuple of all the field values of record
+        return tuple([convert(record[start:end]) \
+            for start, end, convert in self.recordFields])
+
+    def encode(self, values):
+        ''' Answer the fixed-width record, without its line end, holding
+          values. This is the inverse of decode.
+        '''
+        fields = []
+        for i in range(len(self.colTypes)):
+            fields.append(formatField(self.colTypes[i], self.widths[i], \
+                values[i]))
+        return "".join(fields)
+
+    def projection(self, fieldNums):
+        ''' Answer a function which decodes only the fields fieldNums of a
+          record and answers their values as a tuple in the same order.
+        '''
+        fields = [self.fields[i] for i in fieldNums]
+
+        def project(record):
+            return tuple([convert(record[start:end]) \
+                for start, end, convert in fields])
+
+        return project
+
+
+schemas = {}
+
+def compileSchema(colTypes, lazyDatetimes = False):
+    ''' Answer the compiled Schema for the column list colTypes. Each
+      distinct column list is compiled once.
+    '''
+    key = (tuple(colTypes), lazyDatetimes)
+    if key not in schemas:
+        schemas[key] = Schema(key[0], lazyDatetimes)
+    return schemas[key]
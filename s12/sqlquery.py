@@ -0,0 +1,974 @@
+'''
+  File: sqlquery.py
+  Description: This module answers small SQL queries over the fixed-width
+    tables and the index files of this directory. A query has the form
+
+        [EXPLAIN] SELECT columns [FROM tables] [WHERE conditions]
+
+    The columns are * or a list of column names, which may be qualified by
+    a table name or alias. The tables are a list of table names with
+    optional aliases, separated by commas or by JOIN with an ON clause.
+    If FROM is left out, the tables are taken from the qualified column
+    names, so the Feed query
+
+        SELECT Feed.FeedNum, Feed.Name, FeedAttribType.Name,
+            FeedAttribute.Value
+        WHERE Feed.FeedID = FeedAttribute.FeedID AND
+            FeedAttribute.FeedAttribTypeID = FeedAttribType.FeedAttribTypeID
+
+    can be run as it is written in the comments of the join modules. The
+    conditions are comparisons with =, <>, !=, <, <=, > or >= of columns
+    and literals joined by AND. Literals are numbers, strings in single
+    quotes and, for datetime columns, strings in the format of the tables.
+    A comparison with null is never true, as in SQL.
+
+    The tables, their columns and their indexes are kept in a Catalog.
+    The planner picks the access path of each table. An equality with a
+    literal on an indexed column becomes an index lookup, and any other
+    table is scanned. Only the columns a query needs are decoded. Tables
+    are then joined greedily, starting with the table with the fewest
+    estimated rows. Each step picks the connected table and the join
+    method, a hash join or an index join, with the lowest estimated cost,
+    where the cost is the number of records and index nodes read. The
+    plan of a query is shown by EXPLAIN.
+
+    The estimates use the column statistics written next to the index
+    files of a table, as provided by the tablestats module, when there
+    are any. Otherwise fixed fractions of the rows are assumed to pass
+    each condition.
+
+    Usage:
+        python sqlquery.py "EXPLAIN SELECT Feed.Name WHERE Feed.FeedID = 1035"
+'''
+
+import datetime
+import math
+import operator
+import re
+import sys
+
+import joinquerybtree
+import resultsink
+import schema
+import tablereader
+import tablestats
+
+# The number of outer rows an index join looks up with one retrieveMany
+BATCH_ROWS = 1000
+# The fraction of rows assumed to pass a condition without statistics
+EQUAL_SELECTIVITY = 0.1
+RANGE_SELECTIVITY = 1/3
+# The fan-out assumed for estimating the height of an index
+INDEX_FANOUT = 4
+
+KEYWORDS = {"SELECT", "FROM", "WHERE", "AND", "JOIN", "INNER", "ON", "AS", \
+    "EXPLAIN"}
+OPERATORS = {"=": operator.eq, "<>": operator.ne, "!=": operator.ne, \
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+# The operator with its operands swapped
+FLIPPED = {"=": "=", "<>": "<>", "!=": "!=", "<": ">", "<=": ">=", \
+    ">": "<", ">=": "<="}
+# Values can only be compared with values of the same kind. The char
+# types hold strings.
+KINDS = {"int": "number", "float": "number", "datetime": "datetime"}
+TOKEN = re.compile(r"\s*(?:(\d+\.\d*|\.\d+|\d+)|('(?:[^']|'')*')|" + \
+    r"([A-Za-z_][A-Za-z_0-9]*)|(<=|>=|<>|!=|[-=<>,.*();]))")
+
+
+class Table:
+    def __init__(self, name, fileName, colTypes, columns):
+        ''' Describe the table name kept in the fixed-width file fileName,
+          whose columns have the types colTypes and the names columns.
+        '''
+        if len(colTypes) != len(columns):
+            raise ValueError("Table " + name + " needs a name for each of " + \
+                "its " + str(len(colTypes)) + " columns")
+        self.name = name
+        self.fileName = fileName
+        self.colTypes = list(colTypes)
+        self.columns = list(columns)
+        # The index file and uniqueness of each indexed column
+        self.indexes = {}
+        self.openIndexes = {}
+        self.count = None
+        self.stats = None
+
+    def __repr__(self):
+        return "Table(" + repr(self.name) + "," + repr(self.fileName) + ")"
+
+    def fieldNum(self, column):
+        if column not in self.columns:
+            raise ValueError("Table " + self.name + " has no column " + column)
+        return self.columns.index(column)
+
+    def colType(self, column):
+        return self.colTypes[self.fieldNum(column)]
+
+    def rowCount(self):
+        # Answer the number of records, counted once
+        if self.count == None:
+            with tablereader.TableReader(self.fileName, self.colTypes) as table:
+                self.count = len(table)
+        return self.count
+
+    def statistics(self):
+        ''' Answer the TableStatistics written next to one of the index
+          files of the table when it was built, or None if there are none.
+        '''
+        if self.stats == None:
+            for column in self.indexes:
+                self.stats = tablestats.readStatistics( \
+                    tablestats.statisticsName(self.indexes[column][0]))
+                if self.stats != None:
+                    break
+        return self.stats
+
+    def index(self, column):
+        ''' Answer the BTree indexing column. The index is read from its
+          index file, or built and written if the file does not exist.
+        '''
+        if column not in self.openIndexes:
+            indexName, unique = self.indexes[column]
+            definition = joinquerybtree.IndexDefinition(self.colTypes, \
+                [self.fieldNum(column)], unique = unique)
+            self.openIndexes[column] = joinquerybtree.openDefinedIndex( \
+                indexName, self.fileName, definition)[1]
+        return self.openIndexes[column]
+
+    def offsets(self, column, key):
+        # Answer the record offsets of the records whose column is key
+        index = self.index(column)
+        if not self.indexes[column][1]:
+            return index.retrievePostings(joinquerybtree.Item(key, None))
+        item = index.retrieve(joinquerybtree.Item(key, None))
+        return [] if item == None else [item.getValue()]
+
+
+class Catalog:
+    def __init__(self):
+        self.tables = {}
+
+    def addTable(self, name, fileName, colTypes, columns):
+        table = Table(name, fileName, colTypes, columns)
+        self.tables[name] = table
+        return table
+
+    def addIndex(self, tableName, column, indexName, unique = True):
+        ''' Record that indexName is the index file of column of the table
+          tableName. A non-unique index keeps a posting list per key.
+        '''
+        table = self.table(tableName)
+        table.fieldNum(column)
+        table.indexes[column] = (indexName, unique)
+
+    def table(self, name):
+        if name not in self.tables:
+            raise ValueError("Unknown table " + name)
+        return self.tables[name]
+
+    def selectivity(self, table, column, op, value):
+        ''' Answer the estimated fraction of the rows of table for which
+          column op value holds. The statistics of the table are used if
+          it has any, and value is None for a comparison of two columns.
+        '''
+        statistics = table.statistics()
+        if statistics != None and value != None:
+            return statistics.column(table.fieldNum(column)).selectivity(op, \
+                value)
+        if op == "=":
+            if self.isKey(table, column):
+                return 1 / max(1, table.rowCount())
+            return EQUAL_SELECTIVITY
+        if op == "<>" or op == "!=":
+            return 1 - EQUAL_SELECTIVITY
+        return RANGE_SELECTIVITY
+
+    def joinRows(self, leftRows, rightRows, leftTable, leftColumn, \
+        rightTable, rightColumn):
+        ''' Answer the estimated rows of an equijoin. With the statistics
+          of both tables, the rows of the side with more distinct keys are
+          assumed to match the rows of the other side with the same key.
+          Otherwise, when a side joins on a unique indexed column, each row
+          of the other side matches at most one of its rows, and each row
+          of the larger side is assumed to match one row of the smaller
+          side if neither does.
+        '''
+        leftStatistics = None if leftTable == None else \
+            leftTable.statistics()
+        rightStatistics = None if rightTable == None else \
+            rightTable.statistics()
+        if leftStatistics != None and rightStatistics != None:
+            leftKeys = leftStatistics.column( \
+                leftTable.fieldNum(leftColumn)).distinctCount()
+            rightKeys = rightStatistics.column( \
+                rightTable.fieldNum(rightColumn)).distinctCount()
+            keys = max(min(leftKeys, leftRows), min(rightKeys, rightRows), 1)
+            return leftRows * rightRows / keys
+        if rightTable != None and self.isKey(rightTable, rightColumn):
+            return leftRows * min(1, rightRows / max(1, rightTable.rowCount()))
+        if leftTable != None and self.isKey(leftTable, leftColumn):
+            return rightRows * min(1, leftRows / max(1, leftTable.rowCount()))
+        return max(leftRows, rightRows)
+
+    def isKey(self, table, column):
+        # Answer whether column has a unique index
+        return column in table.indexes and table.indexes[column][1]
+
+
+def defaultCatalog():
+    ''' Answer a catalog of the tables of the Feed query in the current
+      directory and the index files main of joinquerybtree writes.
+    '''
+    catalog = Catalog()
+    catalog.addTable("Feed", "Feed.tbl", joinquerybtree.feedCols, \
+        ["FeedID", "Column1", "FeedNum", "Name", "Date", "Column5", \
+        "Column6", "Column7", "Comment", "Column9"])
+    catalog.addTable("FeedAttribType", "FeedAttribType.tbl", \
+        joinquerybtree.attribTypeCols, ["FeedAttribTypeID", "Name", \
+        "Description", "Column3", "Column4", "Column5", "Column6"])
+    catalog.addTable("FeedAttribute", "FeedAttribute.tbl", \
+        joinquerybtree.feedAttributeCols, ["FeedID", "FeedAttribTypeID", \
+        "Value"])
+    catalog.addIndex("Feed", "FeedID", "Feed.idx")
+    catalog.addIndex("FeedAttribType", "FeedAttribTypeID", \
+        "FeedAttribType.idx")
+    return catalog
+
+
+class Query:
+    def __init__(self):
+        self.explain = False
+        # (table name, alias) pairs
+        self.tables = []
+        # (alias or None, column) pairs, or None for *
+        self.columns = None
+        # (operand, op, operand) triples. An operand is ("column", alias,
+        # column) or ("literal", value).
+        self.conditions = []
+
+
+def tokenize(text):
+    ''' Answer the tokens of text as (kind, value) pairs. The kinds are
+      number, string, name, keyword and symbol.
+    '''
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = TOKEN.match(text, pos)
+        if match == None:
+            raise ValueError("Unexpected character " + \
+                repr(text[pos:].strip()[:1]) + " in query")
+        number, string, name, symbol = match.groups()
+        if number != None:
+            value = float(number) if "." in number else int(number)
+            tokens.append(("number", value))
+        elif string != None:
+            tokens.append(("string", string[1:-1].replace("''", "'")))
+        elif name != None:
+            if name.upper() in KEYWORDS:
+                tokens.append(("keyword", name.upper()))
+            else:
+                tokens.append(("name", name))
+        else:
+            tokens.append(("symbol", symbol))
+        pos = match.end()
+    return tokens
+
+
+class Parser:
+    def __init__(self, text):
+        self.tokens = tokenize(text)
+        self.pos = 0
+
+    def peek(self):
+        if self.pos < len(self.tokens):
+            return self.tokens[self.pos]
+        return (None, None)
+
+    def next(self):
+        token = self.peek()
+        self.pos += 1
+        return token
+
+    def accept(self, kind, value = None):
+        # Consume the next token if it matches and answer whether it did
+        token = self.peek()
+        if token[0] == kind and (value == None or token[1] == value):
+            self.pos += 1
+            return True
+        return False
+
+    def expect(self, kind, value = None):
+        token = self.next()
+        if token[0] != kind or (value != None and token[1] != value):
+            found = "the end" if token[0] == None else repr(token[1])
+            raise ValueError("Expected " + (value or kind) + " but found " + \
+                found)
+        return token[1]
+
+    def parse(self):
+        query = Query()
+        query.explain = self.accept("keyword", "EXPLAIN")
+        self.expect("keyword", "SELECT")
+        if self.accept("symbol", "*"):
+            query.columns = None
+        else:
+            query.columns = [self.columnRef()]
+            while self.accept("symbol", ","):
+                query.columns.append(self.columnRef())
+
+        if self.accept("keyword", "FROM"):
+            query.tables.append(self.tableRef())
+            while True:
+                if self.accept("symbol", ","):
+                    query.tables.append(self.tableRef())
+                elif self.accept("keyword", "JOIN") or \
+                    (self.accept("keyword", "INNER") and \
+                    self.expect("keyword", "JOIN")):
+                    query.tables.append(self.tableRef())
+                    self.expect("keyword", "ON")
+                    self.conditions(query)
+                else:
+                    break
+
+        if self.accept("keyword", "WHERE"):
+            self.conditions(query)
+        self.accept("symbol", ";")
+        if self.pos < len(self.tokens):
+            raise ValueError("Unexpected " + repr(self.peek()[1]) + \
+                " in query")
+        return query
+
+    def columnRef(self):
+        name = self.expect("name")
+        if self.accept("symbol", "."):
+            return (name, self.expect("name"))
+        return (None, name)
+
+    def tableRef(self):
+        name = self.expect("name")
+        alias = name
+        if self.accept("keyword", "AS"):
+            alias = self.expect("name")
+        elif self.peek()[0] == "name":
+            alias = self.next()[1]
+        return (name, alias)
+
+    def conditions(self, query):
+        query.conditions.append(self.condition())
+        while self.accept("keyword", "AND"):
+            query.conditions.append(self.condition())
+
+    def condition(self):
+        left = self.operand()
+        op = self.expect("symbol")
+        if op not in OPERATORS:
+            raise ValueError("Unknown comparison " + repr(op))
+        return (left, op, self.operand())
+
+    def operand(self):
+        negative = self.accept("symbol", "-")
+        kind, value = self.peek()
+        if kind == "number":
+            self.next()
+            return ("literal", -value if negative else value)
+        if negative:
+            raise ValueError("Expected a number after -")
+        if kind == "string":
+            self.next()
+            return ("literal", value)
+        alias, column = self.columnRef()
+        return ("column", alias, column)
+
+
+def parse(text):
+    # Answer the Query of the SQL text
+    return Parser(text).parse()
+
+
+class PlanNode:
+    ''' A step of a plan. It answers its rows as tuples of the values of
+      its columns, which are (alias, column) pairs.
+    '''
+    def explain(self, depth = 0):
+        lines = ["  "*depth + self.describe() + " (rows=" + \
+            str(round(self.rows)) + " cost=" + str(round(self.cost)) + ")"]
+        for child in self.children:
+            lines.extend(child.explain(depth+1))
+        return lines
+
+    def position(self, ref):
+        return self.columns.index(ref)
+
+
+def matches(row, tests):
+    # Answer whether the row passes all (position, compare, value) tests
+    for position, compare, value in tests:
+        if row[position] is None or value is None or \
+            not compare(row[position], value):
+            return False
+    return True
+
+
+class Scan(PlanNode):
+    def __init__(self, alias, table, columns, filters, rows):
+        self.alias = alias
+        self.table = table
+        self.columns = [(alias, column) for column in columns]
+        self.filters = filters
+        self.rows = rows
+        self.cost = table.rowCount()
+        self.children = []
+
+    def describe(self):
+        text = "Scan " + self.table.name + aliasText(self) + " [" + \
+            ", ".join([column for alias, column in self.columns]) + "]"
+        return text + filterText(self.filters)
+
+    def __iter__(self):
+        fieldNums = [self.table.fieldNum(column) for alias, column in \
+            self.columns]
+        literalTests, columnPairs = splitTests(self.columns, self.filters)
+        with tablereader.TableReader(self.table.fileName, \
+            self.table.colTypes) as reader:
+            project = reader.schema.projection(fieldNums)
+            for recNum in range(len(reader)):
+                row = project(reader.record(recNum))
+                if matches(row, literalTests) and pairsMatch(row, columnPairs):
+                    yield row
+
+
+class IndexLookup(PlanNode):
+    def __init__(self, alias, table, column, key, columns, filters, rows):
+        self.alias = alias
+        self.table = table
+        self.column = column
+        self.key = key
+        self.columns = [(alias, column) for column in columns]
+        self.filters = filters
+        self.rows = rows
+        self.cost = indexHeight(table) + rows
+        self.children = []
+
+    def describe(self):
+        return "IndexLookup " + self.table.name + aliasText(self) + \
+            " on " + self.column + " = " + repr(self.key) + " [" + \
+            ", ".join([column for alias, column in self.columns]) + "]" + \
+            filterText(self.filters)
+
+    def __iter__(self):
+        fieldNums = [self.table.fieldNum(column) for alias, column in \
+            self.columns]
+        literalTests, columnPairs = splitTests(self.columns, self.filters)
+        offsets = self.table.offsets(self.column, self.key)
+        with tablereader.TableReader(self.table.fileName, \
+            self.table.colTypes) as reader:
+            project = reader.projection(fieldNums)
+            for offset in offsets:
+                row = project(offset)
+                if matches(row, literalTests) and pairsMatch(row, columnPairs):
+                    yield row
+
+
+class HashJoin(PlanNode):
+    def __init__(self, left, right, leftKeys, rightKeys, rows):
+        ''' Join left and right on the columns leftKeys of left and
+          rightKeys of right. The side with fewer estimated rows is the
+          build side. The rows are those of left followed by those of
+          right.
+        '''
+        self.left = left
+        self.right = right
+        self.leftKeys = leftKeys
+        self.rightKeys = rightKeys
+        self.columns = left.columns + right.columns
+        self.rows = rows
+        self.cost = left.cost + right.cost + left.rows + right.rows
+        self.children = [left, right]
+
+    def describe(self):
+        build = self.right if self.right.rows <= self.left.rows else self.left
+        return "HashJoin " + " AND ".join([qualified(l) + " = " + \
+            qualified(r) for l, r in zip(self.leftKeys, self.rightKeys)]) + \
+            " (build " + ", ".join(sorted(set([alias for alias, column in \
+            build.columns]))) + ")"
+
+    def __iter__(self):
+        leftKey = [self.left.position(ref) for ref in self.leftKeys]
+        rightKey = [self.right.position(ref) for ref in self.rightKeys]
+        buildRight = self.right.rows <= self.left.rows
+        if buildRight:
+            build, probe, buildKey, probeKey = self.right, self.left, \
+                rightKey, leftKey
+        else:
+            build, probe, buildKey, probeKey = self.left, self.right, \
+                leftKey, rightKey
+
+        table = {}
+        for row in build:
+            key = tuple([row[i] for i in buildKey])
+            if None in key:
+                continue
+            if key in table:
+                table[key].append(row)
+            else:
+                table[key] = [row]
+
+        for row in probe:
+            matched = table.get(tuple([row[i] for i in probeKey]))
+            if matched != None:
+                for match in matched:
+                    if buildRight:
+                        yield row + match
+                    else:
+                        yield match + row
+
+
+class IndexJoin(PlanNode):
+    def __init__(self, outer, alias, table, column, outerKey, columns, \
+        filters, rows):
+        ''' Join the rows of outer with the records of table whose column
+          equals the column outerKey of outer, found with the index of
+          column. The rows are those of outer followed by the columns of
+          table.
+        '''
+        self.outer = outer
+        self.alias = alias
+        self.table = table
+        self.column = column
+        self.outerKey = outerKey
+        self.innerColumns = [(alias, column) for column in columns]
+        self.columns = outer.columns + self.innerColumns
+        self.filters = filters
+        self.rows = rows
+        self.cost = outer.cost + outer.rows * (indexHeight(table) + 1)
+        self.children = [outer]
+
+    def describe(self):
+        return "IndexJoin " + self.table.name + aliasText(self) + " on " + \
+            qualified((self.alias, self.column)) + " = " + \
+            qualified(self.outerKey) + " [" + ", ".join([column for alias, \
+            column in self.innerColumns]) + "]" + filterText(self.filters)
+
+    def __iter__(self):
+        keyAt = self.outer.position(self.outerKey)
+        fieldNums = [self.table.fieldNum(column) for alias, column in \
+            self.innerColumns]
+        literalTests, columnPairs = splitTests(self.innerColumns, \
+            self.filters)
+        unique = self.table.indexes[self.column][1]
+        index = self.table.index(self.column)
+        with tablereader.TableReader(self.table.fileName, \
+            self.table.colTypes) as reader:
+            project = reader.projection(fieldNums)
+            batch = []
+            for row in self.outer:
+                batch.append(row)
+                if len(batch) == BATCH_ROWS:
+                    yield from self.joinBatch(batch, keyAt, index, unique, \
+                        project, literalTests, columnPairs)
+                    batch = []
+            yield from self.joinBatch(batch, keyAt, index, unique, project, \
+                literalTests, columnPairs)
+
+    def joinBatch(self, batch, keyAt, index, unique, project, literalTests, \
+        columnPairs):
+        # Join a batch of outer rows, searching the index once per key.
+        # A null key matches nothing and cannot be sorted with the others.
+        batch = [row for row in batch if row[keyAt] is not None]
+        probes = [joinquerybtree.Item(row[keyAt], None) for row in batch]
+        if unique:
+            found = index.retrieveMany(probes)
+        for i in range(len(batch)):
+            if unique:
+                offsets = [] if found[i] == None else [found[i].getValue()]
+            else:
+                offsets = index.retrievePostings(probes[i])
+            for offset in offsets:
+                inner = project(offset)
+                if matches(inner, literalTests) and \
+                    pairsMatch(inner, columnPairs):
+                    yield batch[i] + inner
+
+
+class CrossJoin(PlanNode):
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.columns = left.columns + right.columns
+        self.rows = left.rows * right.rows
+        self.cost = left.cost + right.cost + self.rows
+        self.children = [left, right]
+
+    def describe(self):
+        return "CrossJoin"
+
+    def __iter__(self):
+        rightRows = list(self.right)
+        for row in self.left:
+            for other in rightRows:
+                yield row + other
+
+
+class Filter(PlanNode):
+    def __init__(self, child, conditions):
+        self.child = child
+        self.conditions = conditions
+        self.columns = child.columns
+        self.rows = child.rows * RANGE_SELECTIVITY ** len(conditions)
+        self.cost = child.cost
+        self.children = [child]
+
+    def describe(self):
+        return "Filter " + conditionText(self.conditions)
+
+    def __iter__(self):
+        literalTests, columnPairs = splitTests(self.columns, self.conditions)
+        for row in self.child:
+            if matches(row, literalTests) and pairsMatch(row, columnPairs):
+                yield row
+
+
+class Project(PlanNode):
+    def __init__(self, child, columns):
+        self.child = child
+        self.columns = columns
+        self.rows = child.rows
+        self.cost = child.cost
+        self.children = [child]
+
+    def describe(self):
+        return "Project [" + ", ".join([qualified(ref) for ref in \
+            self.columns]) + "]"
+
+    def __iter__(self):
+        positions = [self.child.position(ref) for ref in self.columns]
+        for row in self.child:
+            yield tuple([row[i] for i in positions])
+
+
+def splitTests(columns, conditions):
+    ''' Answer the conditions as tests of rows with the given columns. The
+      first list compares a column with a literal and the second list
+      compares two columns.
+    '''
+    literalTests = []
+    columnPairs = []
+    for left, op, right in conditions:
+        if right[0] == "literal":
+            literalTests.append((columns.index(left[1:]), OPERATORS[op], \
+                right[1]))
+        else:
+            columnPairs.append((columns.index(left[1:]), OPERATORS[op], \
+                columns.index(right[1:])))
+    return literalTests, columnPairs
+
+
+def pairsMatch(row, columnPairs):
+    for position, compare, other in columnPairs:
+        if row[position] is None or row[other] is None or \
+            not compare(row[position], row[other]):
+            return False
+    return True
+
+
+def qualified(ref):
+    return ref[0] + "." + ref[1]
+
+
+def aliasText(node):
+    return "" if node.alias == node.table.name else " " + node.alias
+
+
+def filterText(conditions):
+    if len(conditions) == 0:
+        return ""
+    return " where " + conditionText(conditions)
+
+
+def conditionText(conditions):
+    return " AND ".join([operandText(left) + " " + op + " " + \
+        operandText(right) for left, op, right in conditions])
+
+
+def operandText(operand):
+    if operand[0] == "literal":
+        return repr(operand[1])
+    return qualified(operand[1:])
+
+
+def indexHeight(table):
+    # Answer the estimated number of levels of an index of table
+    return max(1, math.ceil(math.log(max(2, table.rowCount()), INDEX_FANOUT)))
+
+
+def resolve(query, catalog):
+    ''' Check the tables and columns of query against catalog. Answer a
+      dictionary from alias to Table. Column references get their alias
+      filled in, and literals compared with datetime columns are
+      converted to datetimes.
+    '''
+    if len(query.tables) == 0:
+        # Take the tables from the qualified column names
+        refs = list(query.columns or [])
+        for left, op, right in query.conditions:
+            for operand in (left, right):
+                if operand[0] == "column":
+                    refs.append(operand[1:])
+        for alias, column in refs:
+            if alias == None:
+                raise ValueError("Column " + column + " needs a table " + \
+                    "name when the query has no FROM")
+            if (alias, alias) not in query.tables:
+                query.tables.append((alias, alias))
+
+    tables = {}
+    for name, alias in query.tables:
+        if alias in tables:
+            raise ValueError("Table " + alias + " is named twice")
+        tables[alias] = catalog.table(name)
+
+    def resolveRef(alias, column):
+        if alias != None:
+            if alias not in tables:
+                raise ValueError("Unknown table " + alias)
+            tables[alias].fieldNum(column)
+            return (alias, column)
+        found = [a for name, a in query.tables if column in \
+            tables[a].columns]
+        if len(found) == 0:
+            raise ValueError("Unknown column " + column)
+        if len(found) > 1:
+            raise ValueError("Column " + column + " is ambiguous")
+        return (found[0], column)
+
+    if query.columns == None:
+        query.columns = [(alias, column) for name, alias in query.tables \
+            for column in tables[alias].columns]
+    else:
+        query.columns = [resolveRef(alias, column) for alias, column in \
+            query.columns]
+
+    conditions = []
+    for left, op, right in query.conditions:
+        if left[0] == "literal" and right[0] == "column":
+            left, op, right = right, FLIPPED[op], left
+        if left[0] == "literal":
+            raise ValueError("A condition must name a column")
+        left = ("column",) + resolveRef(left[1], left[2])
+        if right[0] == "column":
+            right = ("column",) + resolveRef(right[1], right[2])
+            leftType = tables[left[1]].colType(left[2])
+            rightType = tables[right[1]].colType(right[2])
+            if kindOf(leftType) != kindOf(rightType):
+                raise ValueError("Column " + left[2] + " of type " + \
+                    leftType + " cannot be compared with column " + \
+                    right[2] + " of type " + rightType)
+        else:
+            right = ("literal", literalFor(tables[left[1]], left[2], \
+                right[1]))
+        conditions.append((left, op, right))
+    query.conditions = conditions
+    return tables
+
+
+def kindOf(colType):
+    # Answer the kind of the values of a column of type colType
+    return KINDS.get(colType, "string")
+
+
+def literalFor(table, column, value):
+    ''' Answer value converted to the type of column. A whole number
+      compared with an int column becomes an int. Raise ValueError if the
+      literal cannot be compared with the values of the column.
+    '''
+    colType = table.colType(column)
+    kind = kindOf(colType)
+    if kind == "datetime" and type(value) == str:
+        try:
+            return datetime.datetime.strptime(value, schema.DATETIME_FORMAT)
+        except ValueError:
+            raise ValueError("Column " + column + " needs a datetime " + \
+                "written as " + schema.DATETIME_FORMAT + " but found " + \
+                repr(value))
+    if kind == "number" and type(value) != str:
+        if colType == "float":
+            return float(value)
+        if value == int(value):
+            return int(value)
+        return value
+    if kind == "string" and type(value) == str:
+        return value
+    raise ValueError("Column " + column + " of type " + colType + \
+        " cannot be compared with " + repr(value))
+
+
+def plan(query, catalog):
+    ''' Answer the root PlanNode of query, which must have been resolved
+      against catalog.
+    '''
+    tables = resolve(query, catalog)
+    aliases = [alias for name, alias in query.tables]
+
+    # The columns each table must decode
+    needed = dict([(alias, []) for alias in aliases])
+    def need(ref):
+        if ref[1] not in needed[ref[0]]:
+            needed[ref[0]].append(ref[1])
+    for ref in query.columns:
+        need(ref)
+
+    local = dict([(alias, []) for alias in aliases])
+    edges = []
+    later = []
+    for left, op, right in query.conditions:
+        need(left[1:])
+        if right[0] == "column":
+            need(right[1:])
+        if right[0] == "literal" or left[1] == right[1]:
+            local[left[1]].append((left, op, right))
+        elif op == "=":
+            edges.append((left[1:], right[1:]))
+        else:
+            later.append((left, op, right))
+
+    access = {}
+    for alias in aliases:
+        access[alias] = accessPath(alias, tables[alias], needed[alias], \
+            local[alias], catalog)
+
+    remaining = list(aliases)
+    first = min(remaining, key = lambda alias: access[alias].rows)
+    remaining.remove(first)
+    current = access[first]
+    joined = set([first])
+
+    while len(remaining) > 0:
+        best = None
+        for alias in remaining:
+            keys = edgesBetween(edges, joined, alias)
+            if len(keys) == 0:
+                continue
+            for candidate in joinCandidates(current, access[alias], alias, \
+                tables[alias], keys, needed[alias], local[alias], catalog):
+                if best == None or candidate.cost < best[0].cost:
+                    best = (candidate, alias, keys)
+        if best == None:
+            alias = min(remaining, key = lambda alias: access[alias].rows)
+            current = CrossJoin(current, access[alias])
+        else:
+            current, alias, keys = best
+            # Further equalities between the same tables become filters
+            for mine, theirs in keys:
+                if isinstance(current, IndexJoin) and \
+                    theirs[1] == current.column and mine == current.outerKey:
+                    continue
+                if isinstance(current, HashJoin):
+                    continue
+                later.append((("column",) + mine, "=", ("column",) + theirs))
+        remaining.remove(alias)
+        joined.add(alias)
+
+    if len(later) > 0:
+        current = Filter(current, later)
+    return Project(current, query.columns)
+
+
+def edgesBetween(edges, joined, alias):
+    # Answer (joined column, alias column) pairs of equalities
+    pairs = []
+    for left, right in edges:
+        if left[0] in joined and right[0] == alias:
+            pairs.append((left, right))
+        elif right[0] in joined and left[0] == alias:
+            pairs.append((right, left))
+    return pairs
+
+
+def accessPath(alias, table, columns, conditions, catalog):
+    ''' Answer an IndexLookup if a condition compares an indexed column of
+      table with a literal for equality, and a Scan otherwise.
+    '''
+    rows = table.rowCount()
+    for condition in conditions:
+        rows *= catalog.selectivity(table, condition[0][2], condition[1], \
+            condition[2][1] if condition[2][0] == "literal" else None)
+    rows = max(rows, 1) if table.rowCount() > 0 else 0
+
+    for condition in conditions:
+        left, op, right = condition
+        if op == "=" and right[0] == "literal" and left[2] in table.indexes:
+            others = [c for c in conditions if c is not condition]
+            return IndexLookup(alias, table, left[2], right[1], columns, \
+                others, rows)
+    return Scan(alias, table, columns, conditions, rows)
+
+
+def joinCandidates(current, inner, alias, table, keys, columns, \
+    conditions, catalog):
+    ''' Answer the ways of joining the plan current with the table table
+      on the (current column, table column) pairs keys.
+    '''
+    rows = current.rows
+    for mine, theirs in keys:
+        rows = catalog.joinRows(rows, inner.rows, tableOf(current, mine), \
+            mine[1], table, theirs[1])
+    candidates = [HashJoin(current, inner, [mine for mine, theirs in keys], \
+        [theirs for mine, theirs in keys], rows)]
+    for mine, theirs in keys:
+        if theirs[1] in table.indexes:
+            candidates.append(IndexJoin(current, alias, table, theirs[1], \
+                mine, columns, conditions, rows))
+    return candidates
+
+
+def tableOf(node, ref):
+    # Answer the Table of the column ref of the plan node
+    for child in [node] + descendants(node):
+        if hasattr(child, "table") and child.alias == ref[0]:
+            return child.table
+    return None
+
+
+def descendants(node):
+    found = []
+    for child in node.children:
+        found.append(child)
+        found.extend(descendants(child))
+    return found
+
+
+def execute(text, catalog = None):
+    ''' Answer a tuple of the column names and the rows of the query text.
+      For an EXPLAIN query, the rows are the lines of the plan.
+    '''
+    if catalog == None:
+        catalog = defaultCatalog()
+    query = parse(text)
+    root = plan(query, catalog)
+    if query.explain:
+        return ["plan"], iter([(line,) for line in root.explain()])
+    return [qualified(ref) for ref in root.columns], iter(root)
+
+
+FEED_QUERY = "SELECT Feed.FeedNum, Feed.Name, FeedAttribType.Name, " + \
+    "FeedAttribute.Value WHERE Feed.FeedID = FeedAttribute.FeedID AND " + \
+    "FeedAttribute.FeedAttribTypeID = FeedAttribType.FeedAttribTypeID"
+
+
+def main(text = FEED_QUERY, outputFormat = "text"):
+    before = datetime.datetime.now()
+    columns, rows = execute(text)
+    resultsink.writeRows(rows, outputFormat = outputFormat)
+    after = datetime.datetime.now()
+    deltaT = after - before
+    milliseconds = deltaT.total_seconds() * 1000
+    print("Done. The total time for the SQL query was", milliseconds, \
+        "milliseconds.")
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        main(" ".join(sys.argv[1:]))
+    else:
+        main()
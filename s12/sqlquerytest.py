@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+
+import schema
+import sqlquery
+
+attribTypeCols = ["int","char20","char60","int","int","int","int"]
+outerCols = ["int","int"]
+
+def writeTable(fileName, colTypes, rows):
+    encode = schema.compileSchema(colTypes).encode
+    with open(fileName, "w") as table:
+        for row in rows:
+            table.write(encode(row) + "\n")
+
+def main():
+    # The tables are written to a temporary directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    directory = tempfile.mkdtemp()
+    shutil.copy(os.path.join(here, "FeedAttribType.tbl"), directory)
+    os.chdir(directory)
+    try:
+        tests()
+    finally:
+        os.chdir(here)
+        shutil.rmtree(directory)
+
+def tests():
+    # Outer.TypeID is null in half of the rows
+    writeTable("Outer.tbl", outerCols, [(1, 0), (2, None), (3, 5), \
+        (4, None), (5, 1)])
+    catalog = sqlquery.Catalog()
+    catalog.addTable("Outer", "Outer.tbl", outerCols, ["ID", "TypeID"])
+    catalog.addTable("FeedAttribType", "FeedAttribType.tbl", \
+        attribTypeCols, ["FeedAttribTypeID", "Name", "Description", \
+        "Column3", "Column4", "Column5", "Column6"])
+    catalog.addIndex("FeedAttribType", "FeedAttribTypeID", \
+        "FeedAttribType.idx")
+
+    expected = [(1, "DM"), (3, "NEL"), (5, "ADF")]
+    outer = catalog.table("Outer")
+    inner = catalog.table("FeedAttribType")
+
+    # An index join whose outer rows have null keys
+    scan = sqlquery.Scan("Outer", outer, ["ID", "TypeID"], [], 5)
+    join = sqlquery.IndexJoin(scan, "FeedAttribType", inner, \
+        "FeedAttribTypeID", ("Outer", "TypeID"), ["Name"], [], 5)
+    try:
+        rows = [(row[0], row[2]) for row in join]
+        if rows == expected:
+            print("Test 1 Passed")
+        else:
+            print("Test 1 Failed with", rows)
+    except TypeError as error:
+        print("Test 1 Failed with", error)
+
+    # The same join through the planner, whatever method it picks
+    columns, rows = sqlquery.execute("SELECT Outer.ID, FeedAttribType.Name " + \
+        "FROM Outer JOIN FeedAttribType ON Outer.TypeID = " + \
+        "FeedAttribType.FeedAttribTypeID", catalog)
+    rows = sorted(rows)
+    if rows == expected:
+        print("Test 2 Passed")
+    else:
+        print("Test 2 Failed with", rows)
+
+    # A literal or column of the wrong type is a query error
+    test3Passed = True
+    for query in ["SELECT ID FROM Outer WHERE ID = 'x'", \
+        "SELECT Name FROM FeedAttribType WHERE Name = 5", \
+        "SELECT Name FROM FeedAttribType WHERE FeedAttribTypeID = '0'", \
+        "SELECT Name FROM FeedAttribType WHERE Name < 1.5", \
+        "SELECT Name FROM Outer JOIN FeedAttribType ON " + \
+        "Outer.TypeID = FeedAttribType.Name"]:
+        try:
+            list(sqlquery.execute(query, catalog)[1])
+            print("Test 3 Failed on", query)
+            test3Passed = False
+        except ValueError:
+            pass
+        except TypeError as error:
+            print("Test 3 Failed on", query, "with", error)
+            test3Passed = False
+    if test3Passed:
+        print("Test 3 Passed")
+
+    # A whole number compared with an int column is an int
+    query = "SELECT Name FROM FeedAttribType WHERE FeedAttribTypeID = "
+    rows = list(sqlquery.execute(query + "5.0", catalog)[1])
+    if rows == list(sqlquery.execute(query + "5", catalog)[1]) and \
+        rows == [("NEL",)]:
+        print("Test 4 Passed")
+    else:
+        print("Test 4 Failed with", rows)
+
+if __name__ == "__main__":
+    main()
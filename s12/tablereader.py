@@ -0,0 +1,136 @@
+'''
+  File: tablereader.py
+  Description: This module provides the TableReader class, which reads a
+    fixed-width .tbl file through a memory map. Records are answered by
+    record number as memoryview slices of the map, so no record is copied
+    and no system call is made per record. The fields of a record are
+    decoded by the compiled Schema of the table, which works directly on
+    the slices.
+
+    The record length, including the line end, is taken from the first
+    line of the file. The last record may lack its line end.
+'''
+
+import mmap
+import os
+import zlib
+
+import schema
+
+
+class TableReader:
+    def __init__(self, fileName, colTypes, lazyDatetimes = False):
+        ''' Map the table fileName whose columns have the types colTypes.
+          If lazyDatetimes is True, decode answers LazyDatetime objects
+          from the schema module for datetime fields, which are parsed
+          only when used.
+        '''
+        self.fileName = fileName
+        self.schema = schema.compileSchema(colTypes, lazyDatetimes)
+        self.file = open(fileName, "rb")
+        size = os.path.getsize(fileName)
+
+        if size == 0:
+            self.map = None
+            self.view = memoryview(b"")
+            self.recordLength = self.schema.recordSize + 1
+            self.count = 0
+        else:
+            self.map = mmap.mmap(self.file.fileno(), 0, \
+                access = mmap.ACCESS_READ)
+            self.view = memoryview(self.map)
+            lineEnd = self.map.find(b"\n")
+            self.recordLength = lineEnd + 1 if lineEnd >= 0 else size
+            self.count = (size + self.recordLength - 1) // self.recordLength
+
+        if self.recordLength < self.schema.recordSize:
+            self.close()
+            raise ValueError("The records of " + fileName + " are shorter " + \
+                "than the " + str(self.schema.recordSize) + \
+                " characters of their columns")
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, recNum):
+        return self.record(recNum)
+
+    def __iter__(self):
+        for recNum in range(self.count):
+            yield self.record(recNum)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def record(self, recNum):
+        ''' Answer record recNum, which is zero based, as a memoryview
+          slice of the map without its line end.
+        '''
+        if not (0 <= recNum < self.count):
+            raise IndexError("Record " + str(recNum) + " is not in " + \
+                self.fileName)
+        start = recNum * self.recordLength
+        return self.view[start:start + self.schema.recordSize]
+
+    def field(self, recNum, fieldNum):
+        # Answer the value of field fieldNum of record recNum
+        return self.schema.field(self.record(recNum), fieldNum)
+
+    def decode(self, recNum):
+        # Answer a tuple of all the field values of record recNum
+        return self.schema.decode(self.record(recNum))
+
+    def projection(self, fieldNums):
+        ''' Answer a function which answers the values of the fields
+          fieldNums of a record, given its record number.
+        '''
+        project = self.schema.projection(fieldNums)
+        record = self.record
+
+        def projectRecord(recNum):
+            return project(record(recNum))
+
+        return projectRecord
+
+    def checksum(self, count = None, limit = None):
+        ''' Answer the CRC-32 of the first count records, or of all of
+          them if count is None. If limit is not None, only the last limit
+          bytes of those records are checked, so the checksum costs the
+          same however long the table is. The line end of the last record
+          is left out, so the checksum does not change when records are
+          appended after a last record without a line end.
+        '''
+        if count == None:
+            count = self.count
+        if count == 0:
+            return 0
+        end = min(count * self.recordLength - 1, len(self.view))
+        start = 0
+        if limit != None:
+            start = max(0, end - limit)
+        return zlib.crc32(self.view[start:end])
+
+    def state(self, limit = None):
+        ''' Answer a dictionary of the number of records, their checksum
+          over at most their last limit bytes, as answered by checksum, the
+          limit, and the size and modification time in nanoseconds of the
+          file as it was mapped. An index keeps the state of the table it
+          was built from to tell later which records were appended.
+        '''
+        return {'recordCount': self.count, \
+            'checksum': self.checksum(self.count, limit), \
+            'checkedBytes': limit, 'tableSize': len(self.view), \
+            'tableTime': os.fstat(self.file.fileno()).st_mtime_ns}
+
+    def close(self):
+        ''' Unmap the table. A BufferError is raised while record slices
+          handed out by the reader are still referenced.
+        '''
+        if self.map != None:
+            self.view.release()
+            self.map.close()
+            self.map = None
+        self.file.close()
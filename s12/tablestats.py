@@ -0,0 +1,335 @@
+'''
+  File: tablestats.py
+  Description: This module provides the statistics of the columns of a
+    fixed-width table. They are collected while an index over the table is
+    built, since the build reads every record anyway, and are kept in a
+    file next to the index file, named after it with .stats added. A
+    planner can then estimate how many rows a condition or a join keeps
+    without reading the table again.
+
+    For each column, a ColumnStatistics object keeps the number of rows,
+    the number of nulls, the smallest and largest value, the number of
+    distinct values and an equi-depth histogram. The distinct values are
+    counted with a HyperLogLog, which needs a fixed 2**precision bytes
+    however many values it sees, and is within a few percent of the true
+    count. The histogram is built from a random sample of the values and
+    holds the upper bound of each of its buckets, where every bucket holds
+    the same number of values.
+
+    Rows added to statistics read from a file, as for records appended to
+    a table, update all of them but the histograms, which keep the bounds
+    of the values seen when they were built.
+
+    The statistics file is JSON. Datetime values are written in ISO format
+    and the HyperLogLog registers are compressed and base64 encoded.
+'''
+
+import base64
+import bisect
+import datetime
+import hashlib
+import json
+import math
+import os
+import random
+import zlib
+
+import schema
+import tablereader
+
+STATS_VERSION = 1
+HLL_PRECISION = 10
+# The number of values sampled per column for its histogram
+SAMPLE_ROWS = 8192
+HISTOGRAM_BUCKETS = 32
+# The fraction of values assumed to pass a range condition without a
+# histogram
+RANGE_SELECTIVITY = 1/3
+
+
+class HyperLogLog:
+    def __init__(self, precision = HLL_PRECISION, registers = None):
+        ''' Create an empty counter with 2**precision registers, or a
+          counter with the given registers.
+        '''
+        if not (4 <= precision <= 16):
+            raise ValueError("The precision of a HyperLogLog must be " + \
+                "between 4 and 16")
+        self.precision = precision
+        if registers == None:
+            self.registers = bytearray(1 << precision)
+        else:
+            if len(registers) != 1 << precision:
+                raise ValueError("A HyperLogLog of precision " + \
+                    str(precision) + " needs " + str(1 << precision) + \
+                    " registers")
+            self.registers = bytearray(registers)
+
+    def add(self, value):
+        # The first precision bits of the hash pick a register, which
+        # keeps the longest run of leading zeros of the other bits
+        digest = hashlib.blake2b(repr(value).encode(), digest_size = 8)
+        x = int.from_bytes(digest.digest(), "little")
+        bits = 64 - self.precision
+        index = x >> bits
+        rank = bits - (x & ((1 << bits) - 1)).bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        # Count the values added to other as well
+        if other.precision != self.precision:
+            raise ValueError("Only HyperLogLogs of the same precision " + \
+                "can be merged")
+        for i in range(len(self.registers)):
+            if other.registers[i] > self.registers[i]:
+                self.registers[i] = other.registers[i]
+
+    def count(self):
+        ''' Answer the estimated number of distinct values added. Small
+          counts are estimated from the number of empty registers.
+        '''
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / sum([2.0 ** -r for r in self.registers])
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros > 0:
+            estimate = m * math.log(m / zeros)
+        return estimate
+
+
+class ColumnStatistics:
+    def __init__(self, colType, seed = 1):
+        self.colType = colType
+        self.rows = 0
+        self.nulls = 0
+        self.minimum = None
+        self.maximum = None
+        self.distinct = HyperLogLog()
+        # The upper bounds of the buckets of the histogram, set by finish
+        self.histogram = []
+        self.sample = []
+        # Values are sampled until the histogram is built
+        self.sampling = True
+        self.random = random.Random(seed)
+
+    def __repr__(self):
+        return "ColumnStatistics(" + repr(self.colType) + ",rows=" + \
+            str(self.rows) + ",nulls=" + str(self.nulls) + ",distinct=" + \
+            str(self.distinctCount()) + ",min=" + repr(self.minimum) + \
+            ",max=" + repr(self.maximum) + ")"
+
+    def add(self, value):
+        self.rows += 1
+        if value is None:
+            self.nulls += 1
+            return
+        if self.minimum is None or value < self.minimum:
+            self.minimum = value
+        if self.maximum is None or value > self.maximum:
+            self.maximum = value
+        self.distinct.add(value)
+        if not self.sampling:
+            return
+        # Keep a uniform sample of the values seen, as in reservoir
+        # sampling
+        seen = self.rows - self.nulls
+        if len(self.sample) < SAMPLE_ROWS:
+            self.sample.append(value)
+        else:
+            i = self.random.randrange(seen)
+            if i < SAMPLE_ROWS:
+                self.sample[i] = value
+
+    def finish(self, buckets = HISTOGRAM_BUCKETS):
+        # Build the histogram from the sample and drop the sample
+        values = sorted(self.sample)
+        buckets = min(buckets, len(values))
+        self.histogram = [values[(i+1) * len(values) // buckets - 1] \
+            for i in range(buckets)]
+        self.sample = []
+        self.sampling = False
+
+    def nullFraction(self):
+        if self.rows == 0:
+            return 0.0
+        return self.nulls / self.rows
+
+    def distinctCount(self):
+        # Answer the estimated number of distinct non-null values
+        present = self.rows - self.nulls
+        if present == 0:
+            return 0
+        return max(1, min(present, round(self.distinct.count())))
+
+    def selectivity(self, op, value):
+        ''' Answer the estimated fraction of the rows whose value v makes
+          v op value true, where op is =, <>, !=, <, <=, > or >=. A null
+          never satisfies a comparison.
+        '''
+        if value is None or self.minimum is None:
+            return 0.0
+        present = 1 - self.nullFraction()
+        if op == "=":
+            if value < self.minimum or value > self.maximum:
+                return 0.0
+            # A value ending several buckets of the histogram is frequent
+            buckets = bisect.bisect_right(self.histogram, value) - \
+                bisect.bisect_left(self.histogram, value)
+            if buckets > 1:
+                return present * buckets / len(self.histogram)
+            return present / self.distinctCount()
+        if op == "<>" or op == "!=":
+            return present - self.selectivity("=", value)
+        if op == "<" or op == "<=":
+            return present * self.fractionBelow(value, op == "<=")
+        if op == ">" or op == ">=":
+            return present * (1 - self.fractionBelow(value, op == ">"))
+        raise ValueError("Unknown comparison " + repr(op))
+
+    def fractionBelow(self, value, inclusive):
+        ''' Answer the estimated fraction of the non-null values less than
+          value, or not greater than value if inclusive is True.
+        '''
+        if value < self.minimum or (value == self.minimum and not inclusive):
+            return 0.0
+        if value > self.maximum or (value == self.maximum and inclusive):
+            return 1.0
+        if len(self.histogram) == 0:
+            return RANGE_SELECTIVITY
+        if inclusive:
+            return bisect.bisect_right(self.histogram, value) / \
+                len(self.histogram)
+        return bisect.bisect_left(self.histogram, value) / len(self.histogram)
+
+    def asDict(self):
+        registers = zlib.compress(bytes(self.distinct.registers))
+        return {
+            'type': self.colType,
+            'rows': self.rows,
+            'nulls': self.nulls,
+            'min': encodeValue(self.minimum),
+            'max': encodeValue(self.maximum),
+            'distinct': self.distinctCount(),
+            'histogram': [encodeValue(value) for value in self.histogram],
+            'precision': self.distinct.precision,
+            'registers': base64.b64encode(registers).decode("ascii"),
+        }
+
+    @staticmethod
+    def fromDict(entry):
+        column = ColumnStatistics(entry['type'])
+        column.rows = entry['rows']
+        column.nulls = entry['nulls']
+        column.minimum = decodeValue(column.colType, entry['min'])
+        column.maximum = decodeValue(column.colType, entry['max'])
+        column.histogram = [decodeValue(column.colType, value) \
+            for value in entry['histogram']]
+        registers = zlib.decompress(base64.b64decode(entry['registers']))
+        column.distinct = HyperLogLog(entry['precision'], registers)
+        column.sampling = False
+        return column
+
+
+def encodeValue(value):
+    value = schema.valueOf(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return value
+
+
+def decodeValue(colType, value):
+    if colType == "datetime" and value != None:
+        return datetime.datetime.fromisoformat(value)
+    return value
+
+
+class TableStatistics:
+    def __init__(self, colTypes, tableName = None):
+        ''' Create empty statistics for the columns of a table whose
+          columns have the types colTypes.
+        '''
+        self.colTypes = list(colTypes)
+        self.tableName = tableName
+        self.rows = 0
+        self.columns = [ColumnStatistics(colTypes[i], i+1) \
+            for i in range(len(colTypes))]
+        self.decode = schema.compileSchema(colTypes).decode
+
+    def __repr__(self):
+        return "TableStatistics(" + repr(self.tableName) + ",rows=" + \
+            str(self.rows) + ")"
+
+    def addRecord(self, record):
+        # Add the values of a record of the table
+        self.addRow(self.decode(record))
+
+    def addRow(self, values):
+        self.rows += 1
+        for i in range(len(values)):
+            self.columns[i].add(values[i])
+
+    def finish(self, buckets = HISTOGRAM_BUCKETS):
+        # Build the histograms once all rows are added
+        for column in self.columns:
+            column.finish(buckets)
+
+    def column(self, fieldNum):
+        return self.columns[fieldNum]
+
+    def asDict(self):
+        return {
+            'version': STATS_VERSION,
+            'table': self.tableName,
+            'rows': self.rows,
+            'columns': [column.asDict() for column in self.columns],
+        }
+
+    @staticmethod
+    def fromDict(entry):
+        if entry.get('version') != STATS_VERSION:
+            raise ValueError("Unsupported statistics version " + \
+                repr(entry.get('version')))
+        columns = [ColumnStatistics.fromDict(column) \
+            for column in entry['columns']]
+        statistics = TableStatistics([column.colType for column in columns], \
+            entry['table'])
+        statistics.rows = entry['rows']
+        statistics.columns = columns
+        return statistics
+
+
+def statisticsName(indexName):
+    # Answer the name of the statistics file of the index file indexName
+    return indexName + ".stats"
+
+
+def writeStatistics(fileName, statistics):
+    ''' Write statistics to fileName. The file is written under a
+      temporary name and then renamed, as index files are.
+    '''
+    tempName = fileName + ".tmp"
+    with open(tempName, "w") as statsFile:
+        json.dump(statistics.asDict(), statsFile, indent = 1)
+        statsFile.write("\n")
+    os.replace(tempName, fileName)
+
+
+def readStatistics(fileName):
+    # Answer the TableStatistics in fileName, or None if there is no file
+    if not os.path.isfile(fileName):
+        return None
+    with open(fileName, "r") as statsFile:
+        return TableStatistics.fromDict(json.load(statsFile))
+
+
+def collectStatistics(tableName, colTypes, buckets = HISTOGRAM_BUCKETS):
+    ''' Answer the statistics of the table tableName, reading all of its
+      records. Building an index collects them without a separate pass.
+    '''
+    statistics = TableStatistics(colTypes, tableName)
+    with tablereader.TableReader(tableName, colTypes) as table:
+        for recNum in range(len(table)):
+            statistics.addRecord(table.record(recNum))
+    statistics.finish(buckets)
+    return statistics
@@ -0,0 +1,111 @@
+import datetime
+import os
+import random
+import shutil
+import tempfile
+
+import joinquerybtree
+import tablereader
+import tablestats
+
+def close(estimate, exact, tolerance):
+    return abs(estimate - exact) <= tolerance * exact
+
+def main():
+    # The tables are copied to a temporary directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    directory = tempfile.mkdtemp()
+    shutil.copy(os.path.join(here, "FeedAttribute.tbl"), directory)
+    os.chdir(directory)
+    try:
+        tests()
+    finally:
+        os.chdir(here)
+        shutil.rmtree(directory)
+
+def tests():
+    # A HyperLogLog is within a few percent of the number of distinct
+    # values, is not changed by repeated values and merges two counts
+    counts = {}
+    for exact in [10, 1000, 50000]:
+        counter = tablestats.HyperLogLog()
+        for value in range(exact):
+            counter.add(value)
+            counter.add(value)
+        counts[exact] = counter.count()
+    first = tablestats.HyperLogLog()
+    second = tablestats.HyperLogLog()
+    for value in range(20000):
+        first.add(value)
+        second.add(value + 10000)
+    first.merge(second)
+    if all(close(counts[exact], exact, 0.05) for exact in counts) and \
+        close(first.count(), 30000, 0.05):
+        print("Test 1 Passed")
+    else:
+        print("Test 1 Failed with", counts, first.count())
+
+    # The histogram estimates the fraction of rows a range keeps, and a
+    # frequent value is recognised by the buckets it ends
+    generator = random.Random(22)
+    column = tablestats.ColumnStatistics("int")
+    values = [generator.randrange(10000) for i in range(20000)] + \
+        [7] * 20000 + [None] * 10000
+    for value in values:
+        column.add(value)
+    column.finish()
+
+    def actual(test):
+        return sum(1 for value in values if value != None and \
+            test(value)) / len(values)
+
+    estimates = [(column.selectivity("<", 2500), \
+        actual(lambda value: value < 2500)), \
+        (column.selectivity(">=", 9000), \
+        actual(lambda value: value >= 9000)), \
+        (column.selectivity("=", 7), actual(lambda value: value == 7))]
+    if all(abs(estimate - exact) < 0.03 for estimate, exact in estimates) \
+        and column.nullFraction() == 0.2 and \
+        column.selectivity("=", 20000) == 0.0 and \
+        column.selectivity("<", None) == 0.0:
+        print("Test 2 Passed")
+    else:
+        print("Test 2 Failed with", estimates)
+
+    # Statistics written to a file are read back with the same estimates
+    statistics = tablestats.TableStatistics(["int", "datetime"], "Log.tbl")
+    start = datetime.datetime(2020, 1, 1)
+    for i in range(5000):
+        statistics.addRow((i % 700, start + datetime.timedelta(hours = i)))
+    statistics.finish()
+    tablestats.writeStatistics("Log.idx.stats", statistics)
+    copy = tablestats.readStatistics("Log.idx.stats")
+    if copy.rows == 5000 and copy.column(0).distinctCount() == \
+        statistics.column(0).distinctCount() and \
+        copy.column(1).maximum == start + datetime.timedelta(hours = 4999) \
+        and copy.column(1).selectivity("<", start + datetime.timedelta( \
+        hours = 1000)) == statistics.column(1).selectivity("<", start + \
+        datetime.timedelta(hours = 1000)) and \
+        tablestats.readStatistics("Missing.idx.stats") == None:
+        print("Test 3 Passed")
+    else:
+        print("Test 3 Failed with", copy.column(0), copy.column(1))
+
+    # The statistics of a table agree with the values in it
+    colTypes = joinquerybtree.feedAttributeCols
+    statistics = tablestats.collectStatistics("FeedAttribute.tbl", colTypes)
+    with tablereader.TableReader("FeedAttribute.tbl", colTypes) as table:
+        rows = [table.decode(recNum) for recNum in range(len(table))]
+    feedIDs = len(set(row[0] for row in rows if row[0] != None))
+    above = sum(1 for row in rows if row[1] != None and row[1] > 3) / \
+        len(rows)
+    if statistics.rows == len(rows) and \
+        close(statistics.column(0).distinctCount(), feedIDs, 0.05) and \
+        abs(statistics.column(1).selectivity(">", 3) - above) < 0.05:
+        print("Test 4 Passed")
+    else:
+        print("Test 4 Failed with", statistics.column(0), \
+            statistics.column(1).selectivity(">", 3), above)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+'''
+  File: treestats.py
+  Description: This module provides the instrumentation of the BTree class
+    in joinquerybtree.py. BTree.instrument attaches a TreeStatistics object
+    to a tree. From then on the tree counts the nodes it reads, the nodes
+    it splits and the nodes it merges or redistributes. For each lookup or
+    change, it counts the calls, the time spent and the nodes read.
+
+    A tree which is not instrumented only tests that its statistics are
+    None, and an instrumented tree adds a counter per node read and two
+    clock readings per operation, so the instrumentation is cheap enough to
+    be left on.
+
+    The treeShape function walks a tree and answers its height, its number
+    of nodes and items and a histogram of how full its nodes are.
+    BTree.statistics answers all of these, with the statistics of the node
+    store if it keeps any, as a dictionary. The prometheusText function
+    writes such a dictionary in the text format read by Prometheus.
+'''
+
+import re
+import time
+
+
+class TreeStatistics:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        # Set all counters to zero
+        self.reads = 0
+        self.splits = 0
+        self.merges = 0
+        self.redistributions = 0
+        # For each operation, its calls, seconds, node reads and the most
+        # nodes read by one call
+        self.operations = {}
+        # The number of measured operations in progress, so an operation
+        # calling another one is only measured once
+        self.depth = 0
+
+    def observe(self, name, seconds, reads):
+        entry = self.operations.get(name)
+        if entry == None:
+            entry = [0, 0.0, 0, 0]
+            self.operations[name] = entry
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] += reads
+        if reads > entry[3]:
+            entry[3] = reads
+
+    def asDict(self):
+        operations = {}
+        for name in self.operations:
+            count, seconds, reads, maxReads = self.operations[name]
+            operations[name] = {
+                'count': count,
+                'seconds': seconds,
+                'reads': reads,
+                'maxReads': maxReads,
+                'readsPerOperation': reads / count,
+            }
+        return {
+            'reads': self.reads,
+            'splits': self.splits,
+            'merges': self.merges,
+            'redistributions': self.redistributions,
+            'operations': operations,
+        }
+
+
+def measured(operation):
+    ''' Answer a BTree method which calls operation and, if the tree is
+      instrumented, records its time and node reads under the name of
+      operation.
+    '''
+    name = operation.__name__
+
+    def measuredOperation(self, *args):
+        stats = self.stats
+        if stats == None or stats.depth > 0:
+            return operation(self, *args)
+        stats.depth += 1
+        reads = stats.reads
+        before = time.perf_counter()
+        try:
+            return operation(self, *args)
+        finally:
+            stats.depth -= 1
+            stats.observe(name, time.perf_counter() - before, \
+                stats.reads - reads)
+
+    measuredOperation.__name__ = name
+    measuredOperation.__doc__ = operation.__doc__
+    return measuredOperation
+
+
+def treeShape(tree, buckets = 10):
+    ''' Answer a dictionary with the height of tree, its numbers of nodes
+      and items, and a histogram of the fill of its nodes. Bucket i of the
+      histogram counts the nodes holding more than i/buckets and at most
+      (i+1)/buckets of their 2*degree items, or of the bytes of their
+      page in a sized store, and the first bucket also counts empty
+      nodes. Every node is read from the node store, without counting
+      the reads.
+    '''
+    histogram = [0]*buckets
+    nodes = 0
+    items = 0
+    fillSum = 0.0
+    height = 0
+    sized = getattr(tree.store, "sized", False)
+    level = [tree.rootIndex]
+    while len(level) > 0:
+        height += 1
+        below = []
+        for index in level:
+            node = tree.store.read(index)
+            n = node.getNumberOfKeys()
+            if sized:
+                size = tree.store.nodeSize(node)
+                bucket = -(-size * buckets // tree.store.pageSize) - 1
+                fillSum += size / tree.store.pageSize
+            else:
+                bucket = -(-n * buckets // (2*tree.degree)) - 1
+                fillSum += n / (2*tree.degree)
+            histogram[max(bucket, 0)] += 1
+            nodes += 1
+            items += n
+            if not node.isLeaf():
+                below.extend([node.getChild(i) for i in range(n+1)])
+        level = below
+    return {
+        'height': height,
+        'nodes': nodes,
+        'items': items,
+        'fillHistogram': histogram,
+        'fillSum': fillSum,
+    }
+
+
+def metricName(name):
+    # Answer a camel case name in the lower case style of Prometheus
+    return re.sub("([a-z0-9])([A-Z])", r"\1_\2", name).lower()
+
+
+def prometheusText(statistics, prefix = "btree"):
+    ''' Answer the dictionary answered by BTree.statistics in the text
+      exposition format of Prometheus.
+    '''
+    lines = []
+
+    def metric(name, kind, value, labels = ""):
+        if kind != None:
+            lines.append("# TYPE " + prefix + "_" + name + " " + kind)
+        lines.append(prefix + "_" + name + labels + " " + repr(value))
+
+    counters = [('reads', 'node_reads_total'), ('splits', 'splits_total'), \
+        ('merges', 'merges_total'), \
+        ('redistributions', 'redistributions_total')]
+    for key, name in counters:
+        if key in statistics:
+            metric(name, "counter", statistics[key])
+
+    operations = statistics.get('operations', {})
+    fields = [('count', 'operations_total', 'counter'), \
+        ('seconds', 'operation_seconds_total', 'counter'), \
+        ('reads', 'operation_node_reads_total', 'counter'), \
+        ('maxReads', 'operation_node_reads_max', 'gauge')]
+    for key, name, kind in fields:
+        if len(operations) > 0:
+            lines.append("# TYPE " + prefix + "_" + name + " " + kind)
+        for operation in sorted(operations):
+            metric(name, None, operations[operation][key], \
+                '{operation="' + operation + '"}')
+
+    for key in ['height', 'nodes', 'items']:
+        if key in statistics:
+            metric(key, "gauge", statistics[key])
+
+    if 'fillHistogram' in statistics:
+        histogram = statistics['fillHistogram']
+        lines.append("# TYPE " + prefix + "_node_fill histogram")
+        total = 0
+        for i in range(len(histogram) - 1):
+            total += histogram[i]
+            metric("node_fill_bucket", None, total, \
+                '{le="' + repr((i+1) / len(histogram)) + '"}')
+        total += histogram[-1]
+        metric("node_fill_bucket", None, total, '{le="+Inf"}')
+        metric("node_fill_sum", None, statistics['fillSum'])
+        metric("node_fill_count", None, total)
+
+    store = statistics.get('store', {})
+    for key in sorted(store):
+        value = store[key]
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            metric("store_" + metricName(key), "gauge", value)
+
+    lines.append("")
+    return "\n".join(lines)
@@ -0,0 +1,239 @@
+'''
+  File: versionstore.py
+  Description: This module provides the VersionedNodeStore class, a node
+    store which keeps old versions of nodes so readers can use snapshots of
+    a BTree while a writer changes it. It can be used wherever a node store
+    is expected, for instance
+
+        feedIndex = BTree(3, store = VersionedNodeStore())
+        ...
+        snapshot = feedIndex.snapshot()
+        item = snapshot.retrieve(Item(2285, None))
+        snapshot.close()
+
+    Nodes are never changed where readers can see them. Every write of the
+    writer adds a new version of the node, tagged with the version being
+    built. The BTree commits the store at the end of every operation which
+    changes it. The commit publishes the version together with its root
+    index in a single assignment, and the next version is begun. The
+    versions of a node are kept in a tuple which is replaced, never
+    changed, so readers need no locks.
+
+    A snapshot answers, for each node, its newest version which is not
+    newer than the version published when the snapshot was taken. The
+    BTree answered by BTree.snapshot reads through such a view and cannot
+    be changed. Each reader thread should take its own snapshot, since a
+    BTree keeps the path of its last search.
+
+    Old versions of a node are dropped at a commit once no open snapshot
+    can read them. A recycled node index is only handed out again once no
+    open snapshot is older than the recycling, so snapshots must be closed
+    when they are no longer needed. Only the registry of open snapshots is
+    guarded by a lock.
+
+    There must be only one writer. Nodes read by the writer are copies,
+    since the BTree changes the nodes it reads before writing them.
+'''
+
+from copy import deepcopy
+import threading
+
+
+class VersionedNodeStore:
+    def __init__(self, nodes = None):
+        ''' Create a store holding the nodes of the dictionary nodes as
+          version 0.
+        '''
+        if nodes == None:
+            nodes = {}
+        # For each node index, a tuple of (version, node) pairs, oldest
+        # first
+        self.versions = {}
+        for index in nodes:
+            self.versions[index] = ((0, nodes[index]),)
+        # The indices with more than one version
+        self.shared = set()
+        self.freeList = []
+        # (version, index) pairs of recycled indices still visible to
+        # some snapshot
+        self.retired = []
+        self.rootIndex = None
+        self.freeIndex = None
+        self.published = (0, None, None)
+        self.version = 1
+        self.snapshots = {}
+        self.lock = threading.Lock()
+
+    def bind(self, nodeClass, itemClass):
+        pass
+
+    def read(self, index):
+        ''' Answer the newest version of the node with the given index for
+          the writer. A committed node is copied, so the writer never
+          changes a node a snapshot can see.
+        '''
+        versions = self.versions.get(index)
+        if versions == None:
+            return None
+        version, aNode = versions[-1]
+        if version == self.version:
+            return aNode
+        return deepcopy(aNode)
+
+    def readVersion(self, index, version):
+        # Answer the newest version of the node not newer than version
+        versions = self.versions.get(index, ())
+        for i in range(len(versions)-1, -1, -1):
+            if versions[i][0] <= version:
+                return versions[i][1]
+        return None
+
+    def pin(self, index):
+        pass
+
+    def unpin(self, index):
+        pass
+
+    def write(self, index, aNode):
+        versions = self.versions.get(index, ())
+        if len(versions) > 0 and versions[-1][0] == self.version:
+            versions = versions[:-1]
+        versions = versions + ((self.version, aNode),)
+        if len(versions) > 1:
+            self.shared.add(index)
+        self.versions[index] = versions
+
+    def recycle(self, index):
+        self.retired.append((self.version, index))
+
+    def reuse(self):
+        ''' Answer a recycled node index no snapshot can see, or None if
+          there is none.
+        '''
+        if len(self.freeList) == 0:
+            return None
+        return self.freeList.pop()
+
+    def freeIndices(self):
+        return list(self.freeList) + [index for version, index in self.retired]
+
+    def setHeader(self, rootIndex, freeIndex):
+        self.rootIndex = rootIndex
+        self.freeIndex = freeIndex
+
+    def commit(self):
+        ''' Publish the version built since the last commit with the root
+          and free index last set, begin the next version and drop the
+          versions no open snapshot can read.
+        '''
+        self.published = (self.version, self.rootIndex, self.freeIndex)
+        self.version += 1
+        self.collect()
+
+    def oldestVersion(self):
+        # Answer the oldest version an open snapshot or a new one can read
+        with self.lock:
+            if len(self.snapshots) > 0:
+                return min(self.snapshots)
+            return self.published[0]
+
+    def collect(self):
+        oldest = self.oldestVersion()
+        for index in list(self.shared):
+            versions = self.versions[index]
+            # Keep the newest version not newer than oldest and all newer
+            # ones
+            first = 0
+            while first + 1 < len(versions) and versions[first+1][0] <= oldest:
+                first += 1
+            if first > 0:
+                versions = versions[first:]
+                self.versions[index] = versions
+            if len(versions) == 1:
+                self.shared.discard(index)
+
+        retired = []
+        for version, index in self.retired:
+            if version <= oldest:
+                self.freeList.append(index)
+            else:
+                retired.append((version, index))
+        self.retired = retired
+
+    def snapshot(self):
+        # Answer a read-only view of the last published version
+        with self.lock:
+            version, rootIndex, freeIndex = self.published
+            self.snapshots[version] = self.snapshots.get(version, 0) + 1
+        return SnapshotView(self, version, rootIndex, freeIndex)
+
+    def release(self, version):
+        with self.lock:
+            count = self.snapshots.get(version, 0)
+            if count <= 1:
+                self.snapshots.pop(version, None)
+            else:
+                self.snapshots[version] = count - 1
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class SnapshotView:
+    '''
+      A read-only node store showing one version of a VersionedNodeStore.
+    '''
+    def __init__(self, store, version, rootIndex, freeIndex):
+        self.store = store
+        self.version = version
+        self.rootIndex = rootIndex
+        self.freeIndex = freeIndex
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def bind(self, nodeClass, itemClass):
+        pass
+
+    def read(self, index):
+        return self.store.readVersion(index, self.version)
+
+    def pin(self, index):
+        pass
+
+    def unpin(self, index):
+        pass
+
+    def write(self, index, aNode):
+        raise RuntimeError("A snapshot of a BTree cannot be changed")
+
+    def recycle(self, index):
+        raise RuntimeError("A snapshot of a BTree cannot be changed")
+
+    def reuse(self):
+        return None
+
+    def freeIndices(self):
+        return []
+
+    def setHeader(self, rootIndex, freeIndex):
+        pass
+
+    def commit(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        # Let the store drop the versions only this snapshot could read
+        if not self.closed:
+            self.closed = True
+            self.store.release(self.version)
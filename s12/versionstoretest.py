@@ -0,0 +1,94 @@
+import threading
+
+import versionstore
+from joinquerybtree import BTree, Item
+
+def keys(aTree):
+    return [item.getKey() for item in aTree]
+
+def main():
+    # A snapshot shows the tree as of the last change before it was taken
+    store = versionstore.VersionedNodeStore()
+    aTree = BTree(2, store = store)
+    for key in range(0, 200, 2):
+        aTree.insert(Item(key, key))
+    snapshot = aTree.snapshot()
+    for key in range(1, 200, 2):
+        aTree.insert(Item(key, key))
+    for key in range(0, 100):
+        aTree.delete(Item(key, None))
+    later = aTree.snapshot()
+    if keys(snapshot) == list(range(0, 200, 2)) and \
+        snapshot.retrieve(Item(50, None)).getValue() == 50 and \
+        snapshot.retrieve(Item(51, None)) == None and \
+        keys(later) == list(range(100, 200)) == keys(aTree):
+        print("Test 1 Passed")
+    else:
+        print("Test 1 Failed with", keys(snapshot), keys(later))
+
+    # A snapshot cannot be changed, and a store without versions cannot
+    # take snapshots
+    refused = 0
+    for change in [snapshot.insert, snapshot.delete, snapshot.update]:
+        try:
+            change(Item(300, 300))
+        except RuntimeError:
+            refused += 1
+    try:
+        BTree(2).snapshot()
+    except RuntimeError:
+        refused += 1
+    if refused == 4 and keys(snapshot) == list(range(0, 200, 2)):
+        print("Test 2 Passed")
+    else:
+        print("Test 2 Failed with", refused)
+
+    # Node indices recycled while an old snapshot is open are not reused,
+    # and old versions are dropped once the snapshots are closed
+    retired = len(store.retired)
+    snapshot.close()
+    later.close()
+    aTree.insert(Item(0, 0))
+    if retired > 0 and len(store.retired) == 0 and \
+        len(store.shared) == 0 and \
+        all(len(versions) == 1 for versions in store.versions.values()):
+        print("Test 3 Passed")
+    else:
+        print("Test 3 Failed with", retired, len(store.retired), \
+            len(store.shared))
+
+    # Readers in other threads see whole versions while the tree changes
+    published = {store.published[0]: keys(aTree)}
+    errors = []
+    done = threading.Event()
+
+    def reader():
+        while not done.is_set():
+            snapshot = aTree.snapshot()
+            seen = keys(snapshot)
+            if snapshot.store.version in published and \
+                published[snapshot.store.version] != seen:
+                errors.append(snapshot.store.version)
+            if keys(snapshot) != seen:
+                errors.append(snapshot.store.version)
+            snapshot.close()
+
+    readers = [threading.Thread(target = reader) for i in range(3)]
+    for thread in readers:
+        thread.start()
+    for key in range(1000):
+        if key % 3 == 2:
+            aTree.delete(Item(key - 1, None))
+        else:
+            aTree.insert(Item(key, key))
+        published[store.published[0]] = keys(aTree)
+    done.set()
+    for thread in readers:
+        thread.join()
+    if errors == [] and len(store.snapshots) == 0:
+        print("Test 4 Passed")
+    else:
+        print("Test 4 Failed with", errors[:5])
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+'''
+  File: wal.py
+  Description: This module provides the LoggedFileNodeStore class, a
+    FileNodeStore whose page writes go through a write-ahead redo log. It
+    can be used wherever a node store is expected, for instance
+
+        store = LoggedFileNodeStore("Feed.pages", 3)
+        feedIndex = BTree(3, store = store)
+
+    A page written by the BTree, including the free pages of recycled
+    nodes, is appended to the log and kept in memory instead of being
+    written to its place in the page file. Reads see the logged pages
+    first. Each BTree operation ends with a commit, which appends the
+    root, free index and free list head and a commit record, so the pages
+    of an operation are recovered together or not at all.
+
+    By default the log is forced to disk with fsync at every commit, so
+    a commit which has returned survives a power failure. A store opened
+    with syncEvery greater than 1 only forces the log to disk once every
+    syncEvery commits, or when the store is flushed, so many commits share
+    one fsync. This is a group commit. The log is still written to the
+    operating system at every commit, so a crash of the process loses
+    nothing committed, but after a power failure the commits since the
+    last fsync may be lost.
+
+    When the log grows beyond checkpointBytes, a checkpoint writes the
+    logged pages to their places in the page file, forces the page file
+    to disk and empties the log. Closing the store also takes a
+    checkpoint.
+
+    When a store is opened and its log is not empty, the committed
+    transactions of the log are replayed and a checkpoint is taken. A
+    transaction whose records are incomplete or fail their checksum, as
+    after a crash in the middle of a write, is dropped with everything
+    after it.
+
+    The log file is named after the page file with .wal added unless a
+    name is given. Each record is a kind, a page index and a payload
+    length, the payload and a CRC-32 of all three.
+'''
+
+import os
+import struct
+import zlib
+
+import nodestore
+
+LOG_MAGIC = b"BTWL"
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct("<4sHI")
+RECORD = struct.Struct("<BII")
+CHECKSUM = struct.Struct("<I")
+STATE = struct.Struct("<III")
+LOG_PAGE = 1
+LOG_STATE = 2
+LOG_COMMIT = 3
+
+SYNC_EVERY = 1
+CHECKPOINT_BYTES = 16 * 1024 * 1024
+
+
+class LoggedFileNodeStore(nodestore.FileNodeStore):
+    def __init__(self, fileName, degree = None, pageSize = None, \
+        logName = None, syncEvery = SYNC_EVERY, \
+        checkpointBytes = CHECKPOINT_BYTES, layout = "plain", \
+        keyWidth = None):
+        ''' Open or create the page file fileName and its log logName, as
+          a FileNodeStore is opened or created. Committed changes in the
+          log are recovered.
+        '''
+        if syncEvery < 1:
+            raise ValueError("syncEvery must be at least 1")
+        # The pages written since the last checkpoint
+        self.pending = {}
+        nodestore.FileNodeStore.__init__(self, fileName, degree, pageSize, \
+            layout, keyWidth)
+        if logName == None:
+            logName = fileName + ".wal"
+        self.logName = logName
+        self.syncEvery = syncEvery
+        self.checkpointBytes = checkpointBytes
+        self.unsynced = 0
+        self.commits = 0
+        self.syncs = 0
+        self.checkpoints = 0
+
+        if os.path.isfile(logName) and os.path.getsize(logName) > 0:
+            self.log = open(logName, "r+b")
+            self.recover()
+        else:
+            self.log = open(logName, "w+b")
+            self.resetLog()
+
+    def readPage(self, index):
+        if index in self.pending:
+            return self.pending[index]
+        return nodestore.FileNodeStore.readPage(self, index)
+
+    def writePage(self, index, data):
+        if len(data) > self.pageSize:
+            raise RuntimeError("Node " + str(index) + " needs " + \
+                str(len(data)) + " bytes but the page size is " + \
+                str(self.pageSize))
+        data = bytes(data)
+        self.appendRecord(LOG_PAGE, index, data)
+        self.pending[index] = data.ljust(self.pageSize, b"\0")
+
+    def appendRecord(self, kind, index, payload):
+        record = RECORD.pack(kind, index, len(payload)) + payload
+        self.log.write(record + CHECKSUM.pack(zlib.crc32(record)))
+
+    def commit(self):
+        ''' Make the changes since the last commit one transaction. The log
+          is forced to disk every syncEvery commits, and a checkpoint is
+          taken once the log grows beyond checkpointBytes.
+        '''
+        rootIndex = self.rootIndex if self.rootIndex != None else 0
+        freeIndex = self.freeIndex if self.freeIndex != None else 0
+        self.appendRecord(LOG_STATE, 0, STATE.pack(rootIndex, freeIndex, \
+            self.freeHead))
+        self.appendRecord(LOG_COMMIT, 0, b"")
+        self.log.flush()
+        self.commits += 1
+        self.unsynced += 1
+        if self.unsynced >= self.syncEvery:
+            self.sync()
+        if self.log.tell() >= self.checkpointBytes:
+            self.checkpoint()
+
+    def sync(self):
+        # Force the committed log records to disk
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        self.unsynced = 0
+        self.syncs += 1
+
+    def checkpoint(self):
+        ''' Write the logged pages to the page file, force it to disk and
+          empty the log. A checkpoint is only taken after a commit.
+        '''
+        for index in sorted(self.pending):
+            nodestore.FileNodeStore.writePage(self, index, \
+                self.pending[index])
+        nodestore.FileNodeStore.flush(self)
+        self.pending = {}
+        self.resetLog()
+        self.checkpoints += 1
+
+    def resetLog(self):
+        self.log.seek(0)
+        self.log.truncate()
+        self.log.write(LOG_HEADER.pack(LOG_MAGIC, LOG_VERSION, \
+            self.pageSize))
+        self.sync()
+
+    def recover(self):
+        ''' Replay the committed transactions of the log and take a
+          checkpoint. Answer the number of transactions replayed.
+        '''
+        self.log.seek(0)
+        data = self.log.read()
+        if len(data) < LOG_HEADER.size:
+            # A crash while the log was being emptied after a checkpoint
+            self.resetLog()
+            return 0
+        magic, version, pageSize = LOG_HEADER.unpack_from(data, 0)
+        if magic != LOG_MAGIC:
+            raise ValueError(self.logName + " is not a BTree log")
+        if version != LOG_VERSION:
+            raise ValueError("Unsupported log version " + str(version))
+        if pageSize != self.pageSize:
+            raise ValueError(self.logName + " has pages of " + \
+                str(pageSize) + " bytes but " + self.fileName + " has " + \
+                "pages of " + str(self.pageSize) + " bytes")
+
+        replayed = 0
+        pages = {}
+        state = None
+        pos = LOG_HEADER.size
+        while pos + RECORD.size <= len(data):
+            kind, index, length = RECORD.unpack_from(data, pos)
+            end = pos + RECORD.size + length
+            if end + CHECKSUM.size > len(data) or \
+                CHECKSUM.unpack_from(data, end)[0] != \
+                zlib.crc32(data[pos:end]):
+                break
+            payload = data[pos + RECORD.size:end]
+            pos = end + CHECKSUM.size
+
+            if kind == LOG_PAGE:
+                pages[index] = payload.ljust(self.pageSize, b"\0")
+            elif kind == LOG_STATE:
+                state = STATE.unpack(payload)
+            elif kind == LOG_COMMIT:
+                self.pending.update(pages)
+                if state != None:
+                    rootIndex, freeIndex, self.freeHead = state
+                    self.rootIndex = rootIndex if rootIndex != 0 else None
+                    self.freeIndex = freeIndex if freeIndex != 0 else None
+                pages = {}
+                state = None
+                replayed += 1
+            else:
+                break
+
+        self.checkpoint()
+        return replayed
+
+    def flush(self):
+        # Commit and force the log to disk
+        self.commit()
+        self.sync()
+
+    def close(self):
+        if not self.file.closed:
+            self.commit()
+            self.checkpoint()
+            self.log.close()
+            self.file.close()
+
+    def statistics(self):
+        # Answer a dictionary with the counts of the log
+        return {"commits": self.commits, "syncs": self.syncs, \
+            "checkpoints": self.checkpoints, "pendingPages": \
+            len(self.pending), "logBytes": self.log.tell()}
@@ -0,0 +1,95 @@
+import os
+import shutil
+import tempfile
+
+import wal
+from joinquerybtree import BTree, Item
+
+def crashCopy(fileName, copyName):
+    # Copy a page file and its log as they are, as a crash would leave
+    # them
+    shutil.copy(fileName, copyName)
+    shutil.copy(fileName + ".wal", copyName + ".wal")
+
+def keys(aTree):
+    return [item.getKey() for item in aTree]
+
+def main():
+    # The page files are written to a temporary directory
+    here = os.path.dirname(os.path.abspath(__file__))
+    directory = tempfile.mkdtemp()
+    os.chdir(directory)
+    try:
+        tests()
+    finally:
+        os.chdir(here)
+        shutil.rmtree(directory)
+
+def tests():
+    # Committed changes are only in the log until a checkpoint, and they
+    # are recovered from it after a crash
+    store = wal.LoggedFileNodeStore("feed.pages", 2, 512)
+    aTree = BTree(2, store = store)
+    for key in range(100):
+        aTree.insert(Item(key, key))
+    for key in range(0, 100, 3):
+        aTree.delete(Item(key, None))
+    expected = [key for key in range(100) if key % 3 != 0]
+    crashCopy("feed.pages", "crash.pages")
+    os.remove("crash.pages.wal")
+    withoutLog = keys(BTree(2, store = wal.LoggedFileNodeStore( \
+        "crash.pages")))
+    crashCopy("feed.pages", "crash.pages")
+    recovered = keys(BTree(2, store = wal.LoggedFileNodeStore( \
+        "crash.pages")))
+    if withoutLog == [] and recovered == expected:
+        print("Test 1 Passed")
+    else:
+        print("Test 1 Failed with", withoutLog, recovered)
+
+    # A transaction torn by a crash is dropped and the ones before it
+    # are recovered
+    logSize = os.path.getsize("feed.pages.wal")
+    aTree.insert(Item(1000, 1000))
+    crashCopy("feed.pages", "torn.pages")
+    with open("torn.pages.wal", "r+b") as log:
+        log.truncate((logSize + os.path.getsize("torn.pages.wal")) // 2)
+    recovered = keys(BTree(2, store = wal.LoggedFileNodeStore( \
+        "torn.pages")))
+    if recovered == expected:
+        print("Test 2 Passed")
+    else:
+        print("Test 2 Failed with", recovered)
+
+    # Closing takes a checkpoint, which empties the log, and the tree is
+    # then read from the page file alone
+    aTree.close()
+    expected.append(1000)
+    os.remove("feed.pages.wal")
+    store = wal.LoggedFileNodeStore("feed.pages")
+    if keys(BTree(2, store = store)) == expected and \
+        store.statistics()["logBytes"] == wal.LOG_HEADER.size:
+        print("Test 3 Passed")
+    else:
+        print("Test 3 Failed with", store.statistics())
+    store.close()
+
+    # With group commit many commits share one fsync, and a small
+    # checkpointBytes keeps the log short
+    store = wal.LoggedFileNodeStore("group.pages", 2, 512, syncEvery = 10, \
+        checkpointBytes = 8192)
+    aTree = BTree(2, store = store)
+    for key in range(200):
+        aTree.insert(Item(key, key))
+    statistics = store.statistics()
+    if statistics["commits"] >= 200 and \
+        statistics["syncs"] < statistics["commits"] // 5 and \
+        statistics["checkpoints"] > 0 and statistics["logBytes"] < 8192 \
+        + 2 * store.pageSize:
+        print("Test 4 Passed")
+    else:
+        print("Test 4 Failed with", statistics)
+    aTree.close()
+
+if __name__ == "__main__":
+    main()